@@ -1,5 +1,14 @@
 import logging
+import yaml
 from resource_manager.backend.netbox_asn_pool import NetboxAsnPool
+from resource_manager.backend.netbox_client import NetboxClient
+from resource_manager.backend.netbox_pool_cache import NetboxPoolCache, get_size
+from resource_manager.backend.netbox_writer import NetboxWriteQueue
+from resource_manager.backend.netbox_async import coalesce, run_in_executor
+from resource_manager.backend.netbox_utils import (
+    DEFAULT_WARM_UP_WORKERS,
+    warm_up_pools,
+)
 
 logger = logging.getLogger("resource-manager")
 
@@ -9,8 +18,11 @@ class NetboxAsnManager(object):
 
         self.__supported_types = ["ASN"]
         self.mandatory_config_sections = ["netbox"]
-        self.asn_pools = {}
         self.asn_pools_spec = {}
+        self._pending_pools = {}
+
+        ## Error of the last attempt to create a pool, per pool name
+        self.failed_pools = {}
 
         for section in self.mandatory_config_sections:
             if section not in config.keys():
@@ -23,6 +35,34 @@ class NetboxAsnManager(object):
         else:
             self.netbox_secure = True
 
+        ## All pools created by this manager share the same HTTP connections
+        self.client = NetboxClient.from_config(config["netbox"])
+
+        ## Paging mode used to load the pools, offset or keyset
+        self.paging = config["netbox"].get("paging")
+
+        ## Queue used to save the new allocations in Netbox, if enabled
+        self.write_queue = None
+        if config["netbox"].get("write_back"):
+            self.write_queue = NetboxWriteQueue(
+                self.client,
+                self.netbox_addr,
+                secure=self.netbox_secure,
+                batch_size=config["netbox"].get("write_batch_size", 100),
+            )
+
+        ## Pools created by this manager, refreshed in the background once older than pool_ttl
+        self.asn_pools = NetboxPoolCache(
+            self._create_pool,
+            ttl=config["netbox"].get("pool_ttl"),
+            max_pools=config["netbox"].get("max_pools"),
+            max_memory=config["netbox"].get("max_pools_memory"),
+            sizeof=self._get_pool_size,
+            merge=self._merge_pools,
+            can_evict=self._can_evict_pool,
+            reloader=self._refresh_pool,
+        )
+
         self.netbox_custom_field_name = "ASN"
 
         ## Extract optional config parameters from the configuration if present
@@ -36,7 +76,8 @@ class NetboxAsnManager(object):
 
         ## Open input file
         logger.debug("Opening input file %s" % (spec_file))
-        asn_pools_spec = yaml.load(open(spec_file))
+        with open(spec_file) as f:
+            asn_pools_spec = yaml.safe_load(f)
 
         for pool in asn_pools_spec:
             self.add_pool_specification(name=pool, spec=asn_pools_spec[pool])
@@ -87,7 +128,10 @@ class NetboxAsnManager(object):
     def supported_types(self):
         return self.__supported_types
 
-    def resolve(self, var_type, var_params, identifier=None):
+    def _check_params(self, var_type, var_params):
+        """
+        Ensure the type is supported and that a specification exist for this pool
+        """
 
         if var_type.upper() not in self.__supported_types:
             logger.warn("type %s not supported for NetboxAsnManager" % var_type)
@@ -100,17 +144,143 @@ class NetboxAsnManager(object):
         if not var_params:
             return False
 
+        return True
+
+    def _create_pool(self, name, revalidate=False):
+
+        if name not in self.asn_pools_spec.keys():
+            raise Exception("No specification defined for ASN pool %s" % name)
+
+        return NetboxAsnPool(
+            netbox=self.netbox_addr,
+            name=name,
+            scope=self.asn_pools_spec[name]["scope"],
+            asn_range=self.asn_pools_spec[name]["range"],
+            custom_field=self.netbox_custom_field_name,
+            secure=self.netbox_secure,
+            client=self.client,
+            paging=self.paging,
+            write_queue=self.write_queue,
+            revalidate=revalidate,
+        )
+
+    def _refresh_pool(self, name):
+        """
+        Create the pool replacing a stale one, the cached responses are checked with Netbox
+        """
+        return self._create_pool(name, revalidate=True)
+
+    def resolve(self, var_type, var_params, identifier=None):
+
+        if not self._check_params(var_type, var_params):
+            return False
+
+        try:
+            pool = self._get_pool(var_params)
+
+        except Exception as err:
+            logger.warn(
+                "Something went wrong while creating the NetboxAsnPool for %s > %s"
+                % (var_params, err)
+            )
+            return False
+
+        next_asn = pool.get(identifier=identifier)
+        return next_asn
+
+    def resolve_many(self, var_type, var_params, identifiers):
+        """
+        Resolve multiple identifiers from the same pool, the pool is looked up only once
+        and the ASN are allocated in a single call to get_many()
+
+        return a list with the ASN of each identifier, in the same order
+        """
+
+        if not self._check_params(var_type, var_params):
+            return [False] * len(identifiers)
+
+        try:
+            pool = self._get_pool(var_params)
+
+        except Exception as err:
+            logger.warn(
+                "Something went wrong while creating the NetboxAsnPool for %s > %s"
+                % (var_params, err)
+            )
+            return [False] * len(identifiers)
+
+        return pool.get_many(identifiers)
+
+    def _get_pool(self, name):
+        """
+        Return the pool for a given name, create it if needed
+        If the creation fails, the pool is marked as failed and the exception is raised
+        """
+
+        try:
+            pool = self.asn_pools.load(name, name)
+        except Exception as err:
+            self.failed_pools[name] = str(err)
+            raise
+
+        self.failed_pools.pop(name, None)
+
+        return pool
+
+    def _get_pool_size(self, pool):
+        """
+        Return the memory used by a pool, without the objects shared between the pools
+        """
+        return get_size(pool, exclude=[self.client, self.write_queue])
+
+    def _merge_pools(self, stale_pool, pool):
+        """
+        Carry over the allocations of a stale pool to the pool replacing it
+        """
+        return pool.merge(stale_pool)
+
+    def _can_evict_pool(self, pool):
+        """
+        A pool with allocations not saved in Netbox is kept in memory
+        """
+        return not pool.has_unsaved()
+
+    def warm_up(self, names=None, workers=DEFAULT_WARM_UP_WORKERS):
+        """
+        Create the pools in parallel, before the first call to resolve
+        The pools that couldn't be created are listed in failed_pools
+
+        args
+            names (list): names of the pools to create, all pools with a specification by default
+            workers (int): number of pools created at the same time
+
+        return a dict with the result of each pool
+            loaded (bool), time (time to load the pool in sec), error (str or None)
+        """
+
+        if names is None:
+            names = list(self.asn_pools_spec.keys())
+
+        return warm_up_pools(self._get_pool, names, workers=workers)
+
+    async def resolve_async(self, var_type, var_params, identifier=None):
+        """
+        Async version of resolve
+        The pool is created outside of the event loop if needed,
+        concurrent calls for the same pool share the same creation
+        """
+
+        if not self._check_params(var_type, var_params):
+            return False
+
         if var_params not in self.asn_pools.keys():
             try:
-
-                self.asn_pools[var_params] = NetboxAsnPool(
-                    netbox=self.netbox_addr,
-                    name=var_params,
-                    scope=self.asn_pools_spec[var_params]["scope"],
-                    asn_range=self.asn_pools_spec[var_params]["range"],
-                    custom_field=self.netbox_custom_field_name,
-                    secure=self.netbox_secure,
+                pool = await coalesce(
+                    self._pending_pools,
+                    var_params,
+                    lambda: run_in_executor(self._create_pool, var_params),
                 )
+                self.asn_pools.add(var_params, pool, var_params)
 
             except Exception as err:
                 logger.warn(
@@ -119,5 +289,33 @@ class NetboxAsnManager(object):
                 )
                 return False
 
-        next_asn = self.asn_pools[var_params].get(identifier=identifier)
+        next_asn = self.asn_pools.load(var_params, var_params).get(
+            identifier=identifier
+        )
         return next_asn
+
+    def flush(self):
+        """
+        Save the allocations done since the last flush in Netbox, if write back is enabled
+
+        return a dict with the number of objects written and rejected
+        """
+
+        if self.write_queue is None:
+            return {"written": 0, "conflicts": 0}
+
+        return self.write_queue.flush()
+
+    def apply_event(self, object_type, event, data):
+        """
+        Apply an event received from Netbox (webhook) to all the pools already created
+
+        Return the number of pools that applied the event
+        """
+
+        nbr_applied = 0
+        for pool in list(self.asn_pools.values()):
+            if pool.apply_event(object_type, event, data):
+                nbr_applied += 1
+
+        return nbr_applied
@@ -4,13 +4,24 @@ import yaml
 import os
 import inspect
 import requests
+import threading
 from collections import defaultdict
 
 from resource_manager.pools.integer import IntegerPool
-from resource_manager.backend.netbox_utils import query_netbox
+from resource_manager.backend.netbox_utils import (
+    iter_netbox,
+    get_deleted_ids,
+    SyncWatermark,
+    lock_current,
+    synchronized,
+    match_filters,
+)
 
 logger = logging.getLogger("resource-manager")
 
+## Fields requested from Netbox while loading a pool
+DEVICE_FIELDS = ["id", "name", "custom_fields", "last_updated"]
+
 
 class NetboxAsnPool(object):
     """
@@ -19,7 +30,17 @@ class NetboxAsnPool(object):
     """
 
     def __init__(
-        self, netbox, name, scope, asn_range=[], custom_field="ASN", secure=True
+        self,
+        netbox,
+        name,
+        scope,
+        asn_range=[],
+        custom_field="ASN",
+        secure=True,
+        client=None,
+        paging=None,
+        write_queue=None,
+        revalidate=False,
     ):
 
         self.nb = netbox
@@ -47,47 +68,391 @@ class NetboxAsnPool(object):
 
             requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
-        self.nb = requests.session()
+        ## Use the shared client if provided, otherwise create a dedicated session
+        if client:
+            self.nb = client
+        else:
+            self.nb = requests.session()
         self.nb_addr = netbox
         self.verify_certs = secure
+        self.custom_field = custom_field
+        self.paging = paging
+        self.scope = scope
+        self.write_queue = write_queue
+
+        ## With revalidate, the devices are not served from the cache of the client
+        ## without checking with Netbox, used when the pool is refreshed
+        self.revalidate = revalidate
+
+        ## Lock used to allocate the ASN and apply the changes from Netbox
+        self.lock = threading.RLock()
+
+        ## ASN and name of each device from Netbox, by Netbox id
+        ## and time of the last synchronization with Netbox, used by sync()
+        self.asn_by_netbox_id = {}
+        self.devices_by_name = {}
+        self.watermark = SyncWatermark()
+        self.last_sync = None
+
+        ## Identifier of the ASN allocated by get() and the ones not saved in Netbox yet,
+        ## they are carried over by merge() to the pool replacing this one after a refresh
+        self.local = {}
+        self.unsaved = set()
+        self.replaced_by = None
 
         ### Create the Integer Pool
         self.pool = IntegerPool(self.name, start=asn_range[0], end=asn_range[1])
 
         ### Query Netbox to find the devices in scope for this group
-        url = self.nb_addr + "/api/dcim/devices/"
-        url_params = "is_network_device=True"
+        self.url_params = "is_network_device=True"
         for item in scope:
             for key, value in item.items():
-                url_params = url_params + "&%s=%s" % (key, value)
-
-        resp = query_netbox(
-            req=self.nb, url=url, params=url_params, secure=self.verify_certs
-        )
-
-        logger.debug("Found %s devices in scope" % resp["count"])
+                self.url_params = self.url_params + "&%s=%s" % (key, value)
 
         ### Go over the list of devices and reserve the existing ASN
-        for dev in resp["results"]:
+        nbr_devices = 0
+        for dev in self._get_devices(revalidate=self.revalidate):
+            nbr_devices += 1
+            self.watermark.update(dev.get("last_updated"))
 
-            ## Check if the device has an ASN number define
-            if not isinstance(dev["custom_fields"], dict):
-                continue
-            elif custom_field not in dev["custom_fields"].keys():
+            if "id" in dev:
+                self.devices_by_name[dev["name"]] = dev["id"]
+
+            asn = self._get_asn(dev)
+            if asn is None:
                 continue
-            elif dev["custom_fields"][custom_field] == None:
+
+            ## The ASN is recorded for the device only if it's not already used by another one
+            if not self.pool.reserve(integer=asn, identifier=dev["name"]):
+                logger.warn(
+                    "ASN %s of %s is already used by another device"
+                    % (asn, dev["name"])
+                )
                 continue
 
-            self.pool.reserve(
-                integer=dev["custom_fields"][custom_field], identifier=dev["name"]
-            )
+            if "id" in dev:
+                self.asn_by_netbox_id[dev["id"]] = (int(asn), dev["name"])
+
+        logger.debug("Found %s devices in scope" % nbr_devices)
+
+        self.last_sync = self.watermark.since()
+
+    def _get_devices(self, since=None, revalidate=False):
+        """
+        Get the devices in scope from Netbox
+        if since is defined, only the devices created or modified since then are returned
+        if revalidate is defined, the cache of the client is checked with Netbox
+        """
+
+        url = self.nb_addr + "/api/dcim/devices/"
+        url_params = self.url_params
+
+        if since:
+            url_params += "&last_updated__gte=%s" % since
+
+        return iter_netbox(
+            req=self.nb,
+            url=url,
+            params=url_params,
+            secure=self.verify_certs,
+            paging=self.paging,
+            fields=DEVICE_FIELDS,
+            revalidate=revalidate,
+        )
+
+    def _get_asn(self, dev):
+        """
+        Return the ASN defined on a device or None
+        """
+
+        ## Check if the device has an ASN number define
+        if not isinstance(dev.get("custom_fields"), dict):
+            return None
+        elif self.custom_field not in dev["custom_fields"].keys():
+            return None
+
+        return dev["custom_fields"][self.custom_field]
+
+    def sync(self):
+        """
+        Apply the changes done in Netbox since the last synchronization
+        The devices created or modified are found with their last_updated time
+        and the devices deleted are found in the changelog
+
+        The devices removed from the scope are not detected, only apply_event() can detect them
+        """
+
+        since = self.last_sync
+        self.watermark.start()
+
+        ### Get the changes from Netbox first, the pool is locked only to apply them
+        deleted_ids = get_deleted_ids(
+            req=self.nb,
+            netbox=self.nb_addr,
+            object_type="dcim.device",
+            since=since,
+            secure=self.verify_certs,
+            watermark=self.watermark,
+        )
+        devices = list(self._get_devices(since=since, revalidate=True))
+
+        with self.lock:
+            ### Release the ASN of the devices deleted in Netbox
+            nbr_deleted = 0
+            for netbox_id in deleted_ids:
+                if self._remove_device(netbox_id):
+                    nbr_deleted += 1
+
+            ### Release the previous ASN of the devices modified and reserve the new one
+            nbr_updated = 0
+            for dev in devices:
+                self.watermark.update(dev.get("last_updated"))
+                if self._update_device(dev):
+                    nbr_updated += 1
+
+        logger.debug(
+            "sync(), %s devices updated and %s devices deleted in Netbox for %s"
+            % (nbr_updated, nbr_deleted, self.name)
+        )
+
+        self.last_sync = self.watermark.since()
+
+        return True
+
+    @synchronized
+    def apply_event(self, object_type, event, data):
+        """
+        Apply an event received from Netbox (webhook) for a device
+        event is created, updated or deleted and data is the device
+
+        Return True if the event has been applied to this pool
+        """
+
+        if object_type != "dcim.device":
+            return False
+
+        if self.replaced_by is not None:
+            return self.replaced_by.apply_event(object_type, event, data)
+
+        ## The ASN is kept if the scope can't be checked with the fields sent by Netbox
+        if event == "deleted" or self._is_in_scope(data) is False:
+            return self._remove_device(data["id"])
+
+        return self._update_device(data)
+
+    def _is_in_scope(self, dev):
+        """
+        Check if a device from Netbox matches all the filters defined in the scope
+        Return None if a filter can't be checked with the fields of the device
+        """
+
+        result = True
+
+        for item in self.scope:
+            match = match_filters(dev, item)
+            if match is False:
+                return False
+            elif match is None:
+                result = None
+
+        return result
+
+    def _remove_device(self, netbox_id):
+        """
+        Release the ASN of a device by Netbox id, if any
+        """
+
+        if netbox_id not in self.asn_by_netbox_id:
+            return False
+
+        asn, name = self.asn_by_netbox_id.pop(netbox_id)
+        self.pool.release(integer=asn)
+        self._forget_local(asn)
+
+        return True
 
+    def _forget_local(self, asn):
+        """
+        Remove an ASN from the ASN allocated by get()
+        """
+
+        self.unsaved.discard(asn)
+
+        return self.local.pop(asn, None) is not None
+
+    def _update_device(self, dev):
+        """
+        Release the previous ASN of a device from Netbox and reserve the new one
+        Return False if nothing has changed
+        """
+
+        asn = self._get_asn(dev)
+        if asn is not None:
+            asn = int(asn)
+
+        self.devices_by_name[dev["name"]] = dev["id"]
+
+        if self.asn_by_netbox_id.get(dev["id"]) == (asn, dev["name"]):
+            return False
+
+        self._remove_device(dev["id"])
+
+        if asn is not None:
+            ## The ASN in Netbox replaces the one allocated locally for this device, if any
+            local_asn = self.pool.int_by_id.get(dev["name"], asn)
+            if local_asn != asn:
+                self.pool.release(identifier=dev["name"])
+                self._forget_local(local_asn)
+
+            ## Releasing this device later must not release the ASN of another device
+            if not self.pool.reserve(integer=asn, identifier=dev["name"]):
+                logger.warn(
+                    "ASN %s of %s is already used by another device"
+                    % (asn, dev["name"])
+                )
+                return True
+
+            self.asn_by_netbox_id[dev["id"]] = (asn, dev["name"])
+
+            ## The ASN allocated locally is now saved in Netbox
+            if self.local.get(asn) == dev["name"]:
+                self.unsaved.discard(asn)
+
+        return True
+
+    @synchronized
     def get(self, identifier=None):
         """
         Find the next available ASN in the pool
         """
+
+        ## The pool has been refreshed, the new version is used
+        if self.replaced_by is not None:
+            return self.replaced_by.get(identifier=identifier)
+
         logger.debug("Will try to get an ASN for %s" % identifier)
 
+        is_new = identifier not in self.pool.int_by_id
+
         asn = self.pool.get(identifier=identifier)
 
+        if asn is not None and is_new:
+            self._add_local(asn, identifier)
+
         return asn
+
+    @synchronized
+    def get_many(self, identifiers):
+        """
+        Find an ASN for multiple identifiers at once with IntegerPool.get_many
+        Each identifier None gets a new ASN
+
+        return a list with the ASN of each identifier, in the same order
+        """
+
+        if self.replaced_by is not None:
+            return self.replaced_by.get_many(identifiers)
+
+        logger.debug("Will try to get %s ASN" % len(identifiers))
+
+        names = [identifier for identifier in identifiers if identifier is not None]
+        new_names = set([name for name in names if name not in self.pool.int_by_id])
+
+        asn_by_name = self.pool.get_many(names)
+
+        for name in names:
+            if name in new_names and asn_by_name[name] is not None:
+                new_names.discard(name)
+                self._add_local(asn_by_name[name], name)
+
+        return [
+            asn_by_name[identifier] if identifier is not None else self.get()
+            for identifier in identifiers
+        ]
+
+    def _add_local(self, asn, identifier):
+        """
+        Save an ASN allocated by get() and add it to the write queue if any
+        """
+
+        self.local[asn] = identifier
+        self.unsaved.add(asn)
+
+        if self.write_queue is not None:
+            self._write_asn(asn, identifier)
+
+    def has_unsaved(self):
+        """
+        Return True if some ASN allocated by get() are not saved in Netbox
+        """
+        return len(self.unsaved) > 0
+
+    def merge(self, pool):
+        """
+        Carry over the ASN allocated by get() on the previous version of this pool,
+        the ASN loaded from Netbox take precedence.
+        The previous version forwards the next requests to this pool
+        """
+
+        with pool.lock, self.lock:
+            for asn, identifier in pool.local.items():
+
+                ## Already in Netbox, with this ASN or another one
+                if identifier is not None and identifier in self.pool.int_by_id:
+                    continue
+
+                if not self.pool.reserve(asn, identifier=identifier):
+                    logger.warn(
+                        "ASN %s (%s) is used by another device in Netbox, SKIPPING"
+                        % (asn, identifier)
+                    )
+                    continue
+
+                self.local[asn] = identifier
+                if asn in pool.unsaved:
+                    self.unsaved.add(asn)
+
+            pool.replaced_by = self
+
+        logger.debug(
+            "merge(), %s ASN carried over for %s (%s not saved)"
+            % (len(self.local), self.name, len(self.unsaved))
+        )
+
+        return True
+
+    def _write_asn(self, asn, identifier):
+        """
+        Add the ASN of a device to the write queue
+        the ASN is released if Netbox rejects it
+        """
+
+        dev_id = self.devices_by_name.get(identifier)
+
+        if dev_id is None:
+            logger.warn(
+                "Unable to find the device %s in Netbox, ASN %s will not be saved"
+                % (identifier, asn)
+            )
+            return False
+
+        ## The callbacks are applied to the pool replacing this one after a refresh
+        def on_success(item):
+            with lock_current(self) as pool:
+                pool.asn_by_netbox_id[dev_id] = (asn, identifier)
+                pool.unsaved.discard(asn)
+
+        def on_error(item):
+            with lock_current(self) as pool:
+                if pool._forget_local(asn):
+                    pool.pool.release(integer=asn)
+
+        self.write_queue.add(
+            "/api/dcim/devices/",
+            {"id": dev_id, "custom_fields": {self.custom_field: asn}},
+            method="PATCH",
+            on_success=on_success,
+            on_error=on_error,
+        )
+
+        return True
@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import logging
+
+from resource_manager.backend.netbox_asn_pool import NetboxAsnPool
+from resource_manager.backend.netbox_ip_pool import NetboxIpPool
+from resource_manager.backend.netbox_net_pool import NetboxNetPool
+from resource_manager.backend.netbox_utils import query_netbox
+
+logger = logging.getLogger("resource-manager")
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """
+    Run a blocking function in the default executor of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def query_netbox_async(
+    req,
+    url,
+    params,
+    secure=True,
+    batch_size=500,
+    concurrency=None,
+    timeout=None,
+    paging=None,
+    fields=None,
+):
+    """
+    Async equivalent of query_netbox
+
+    The query is executed outside of the event loop by query_netbox,
+    so both paging modes and the fields selection are supported
+    and the pages are still fetched concurrently in offset mode
+    """
+
+    return await run_in_executor(
+        query_netbox,
+        req,
+        url,
+        params,
+        secure=secure,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        timeout=timeout,
+        paging=paging,
+        fields=fields,
+    )
+
+
+async def create_netbox_asn_pool(**kwargs):
+    """
+    Create a NetboxAsnPool without blocking the event loop
+    """
+    return await run_in_executor(NetboxAsnPool, **kwargs)
+
+
+async def create_netbox_ip_pool(**kwargs):
+    """
+    Create a NetboxIpPool without blocking the event loop
+    """
+    return await run_in_executor(NetboxIpPool, **kwargs)
+
+
+async def create_netbox_net_pool(**kwargs):
+    """
+    Create a NetboxNetPool without blocking the event loop
+    """
+    return await run_in_executor(NetboxNetPool, **kwargs)
+
+
+async def coalesce(pending, key, coro_func):
+    """
+    Share a single execution of coro_func between all callers using the same key
+    pending is a dict used to keep track of the executions in progress
+    """
+    if key not in pending:
+        pending[key] = asyncio.ensure_future(coro_func())
+
+    try:
+        return await asyncio.shield(pending[key])
+    finally:
+        if key in pending and pending[key].done():
+            del pending[key]
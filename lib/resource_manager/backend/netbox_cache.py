@@ -0,0 +1,150 @@
+import logging
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+logger = logging.getLogger("resource-manager")
+
+
+class NetboxCache(object):
+    """
+    Persistent cache of the responses of the Netbox API, stored as one json file per request
+
+    Each entry is keyed by the URL and the params of the request,
+    an entry younger than ttl is used without contacting Netbox,
+    an older entry is revalidated with the ETag / Last-Modified returned by Netbox (if any)
+    and is used as long as Netbox returns 304 Not Modified
+    """
+
+    def __init__(self, path, ttl=300):
+        """
+        Inputs:
+            path: directory used to store the cache
+            ttl: number of seconds an entry is used without revalidation
+        """
+
+        self.path = path
+        self.ttl = ttl
+
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def get_key(url, params=None):
+
+        if not isinstance(params, str):
+            params = json.dumps(params, sort_keys=True)
+
+        return hashlib.sha1(("%s?%s" % (url, params)).encode("utf-8")).hexdigest()
+
+    def _get_file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def load(self, url, params=None):
+        """
+        Return the entry for this request or None
+        """
+
+        try:
+            with open(self._get_file(self.get_key(url, params))) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, url, params, data, etag=None, last_modified=None):
+        """
+        Save the response of a request, the file is replaced atomically
+        """
+
+        entry = {
+            "url": url,
+            "params": params,
+            "time": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "data": data,
+        }
+
+        filename = self._get_file(self.get_key(url, params))
+
+        ## Each write uses its own temporary file, the same entry can be saved
+        ## by multiple threads or processes at the same time
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=os.path.dirname(filename), suffix=".tmp", delete=False
+        ) as f:
+            try:
+                json.dump(entry, f)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+
+        os.replace(f.name, filename)
+
+        return entry
+
+    def clear(self):
+        """
+        Delete all entries
+        """
+
+        for filename in os.listdir(self.path):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(self.path, filename))
+
+    def is_fresh(self, entry):
+        return time.time() - entry["time"] < self.ttl
+
+    def fetch(self, req, url, params, secure=True, timeout=None, revalidate=False):
+        """
+        Return the decoded response of a GET request, from the cache if possible
+        With revalidate, a fresh entry is checked with Netbox as well
+        """
+
+        entry = self.load(url, params)
+
+        if entry and self.is_fresh(entry) and not revalidate:
+            self.hits += 1
+            return entry["data"]
+
+        headers = {}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        resp = req.get(
+            url, params=params, verify=secure, timeout=timeout, headers=headers
+        )
+
+        if entry and resp.status_code == 304:
+            logger.debug("NetboxCache, %s?%s not modified" % (url, params))
+            self.revalidations += 1
+            self.save(
+                url,
+                params,
+                entry["data"],
+                etag=entry["etag"],
+                last_modified=entry["last_modified"],
+            )
+            return entry["data"]
+
+        resp.raise_for_status()
+
+        self.misses += 1
+        data = resp.json()
+        self.save(
+            url,
+            params,
+            data,
+            etag=resp.headers.get("ETag"),
+            last_modified=resp.headers.get("Last-Modified"),
+        )
+
+        return data
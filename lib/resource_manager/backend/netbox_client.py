@@ -0,0 +1,111 @@
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+from resource_manager.backend.netbox_cache import NetboxCache
+
+logger = logging.getLogger("resource-manager")
+
+
+class NetboxClient(object):
+    """
+    HTTP client to share the same connection pool between all pools using the same Netbox
+
+    The client can be used everywhere a requests session is expected (query_netbox)
+    """
+
+    def __init__(
+        self,
+        address,
+        secure=True,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        max_retries=0,
+        keep_alive=True,
+        timeout=None,
+        cache=None,
+    ):
+        """
+        Inputs:
+            address: Netbox Server Address http:1.2.3.4:4851
+            secure: verify the certificates
+            pool_connections: number of hosts to keep a connection pool for
+            pool_maxsize: max number of connections kept open per host
+            pool_block: wait for a connection to be available when a host reached pool_maxsize
+            max_retries: number of retries for failed connections
+            keep_alive: reuse the connections between requests
+            timeout: default timeout of each request in seconds
+            cache: NetboxCache used by query_netbox to store the responses
+        """
+
+        self.address = address
+        self.secure = secure
+        self.timeout = timeout
+        self.cache = cache
+
+        if not secure:
+            from requests.packages.urllib3.exceptions import InsecureRequestWarning
+
+            requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=max_retries,
+        )
+
+        self.session = requests.session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a client from the netbox section of the configuration
+        """
+
+        options = {}
+        for key in [
+            "secure",
+            "pool_connections",
+            "pool_maxsize",
+            "pool_block",
+            "max_retries",
+            "keep_alive",
+            "timeout",
+        ]:
+            if key in config:
+                options[key] = config[key]
+
+        ## The cache is enabled only if a directory is defined
+        if config.get("cache_dir"):
+            options["cache"] = NetboxCache(
+                config["cache_dir"], ttl=config.get("cache_ttl", 300)
+            )
+
+        return cls(config["address"], **options)
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request using the shared session
+        """
+
+        if self.timeout and not kwargs.get("timeout"):
+            kwargs["timeout"] = self.timeout
+
+        return self.session.get(url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request using the shared session
+        """
+
+        if self.timeout and not kwargs.get("timeout"):
+            kwargs["timeout"] = self.timeout
+
+        return self.session.request(method, url, **kwargs)
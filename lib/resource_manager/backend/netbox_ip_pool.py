@@ -5,17 +5,54 @@ import os
 import inspect
 import ipaddress
 import requests
+import threading
 
 from collections import defaultdict
 
-from resource_manager.pools.ipaddr_subnet import IpAddressPool
-from resource_manager.backend.netbox_utils import query_netbox
+from resource_manager.pools.ipaddr_subnet import IpAddressPool, parse_addresses
+from resource_manager.backend.netbox_utils import (
+    query_netbox,
+    iter_netbox,
+    get_status,
+    get_interface_identifier,
+    get_deleted_ids,
+    SyncWatermark,
+    synchronized,
+    PrefixIndex,
+)
 
 logger = logging.getLogger("resource-manager")
 
+## Number of IPs reserved at once while loading a prefix
+RESERVE_BATCH_SIZE = 500
+
+## Fields requested from Netbox while loading a pool
+PREFIX_FIELDS = ["id", "prefix", "description", "last_updated"]
+IP_ADDRESS_FIELDS = [
+    "id",
+    "address",
+    "status",
+    "assigned_object",
+    "interface",
+    "last_updated",
+]
+
 
 class NetboxIpPool(object):
-    def __init__(self, netbox, site, role, family, description=None, secure=True):
+    def __init__(
+        self,
+        netbox,
+        site,
+        role,
+        family,
+        description=None,
+        secure=True,
+        client=None,
+        parent_batch_size=1,
+        paging=None,
+        write_queue=None,
+        revalidate=False,
+    ):
         """
         Inputs:
             netbox: Netbox Server Address http:1.2.3.4:4851
@@ -23,6 +60,13 @@ class NetboxIpPool(object):
             role: 
             family:
             description:
+            client: NetboxClient to share the same connections with other pools
+            parent_batch_size: number of prefixes to query at once to get the existing IPs
+                               Netbox must support multiple values for the parent filter
+            paging: offset or keyset, paging mode used to get the existing IPs
+            write_queue: NetboxWriteQueue used to save the new IPs in Netbox
+            revalidate: check with Netbox the responses served from the cache of the client,
+                        used when the pool is refreshed
         """
 
         if not secure:
@@ -30,7 +74,11 @@ class NetboxIpPool(object):
 
             requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
-        self.nb = requests.session()
+        ## Use the shared client if provided, otherwise create a dedicated session
+        if client:
+            self.nb = client
+        else:
+            self.nb = requests.session()
         self.nb_addr = netbox
         self.verify_certs = secure
 
@@ -38,12 +86,26 @@ class NetboxIpPool(object):
         self.role = role
         self.ip_family = family
         self.description = description
+        self.parent_batch_size = max(int(parent_batch_size), 1)
+        self.paging = paging
+        self.write_queue = write_queue
+        self.revalidate = revalidate
 
         self.identifier = None
 
         self.data = None
 
         self.subnets = []
+        self.index = PrefixIndex()
+
+        ## Lock used to allocate the IPs and apply the changes from Netbox
+        self.lock = threading.RLock()
+
+        ## Address of each IP reserved from Netbox, by Netbox id
+        ## and time of the last synchronization with Netbox, used by sync()
+        self.ips_by_netbox_id = {}
+        self.watermark = SyncWatermark()
+        self.last_sync = None
 
         ### Define unique identifier for this pool
         if self.site_name and self.description:
@@ -62,10 +124,14 @@ class NetboxIpPool(object):
 
         self._get_info_from_netbox()
 
-    def get(self, identifier=None, return_mask=True, id=None):
+    @synchronized
+    def get(self, identifier=None, return_mask=True, id=None, data=None):
         """
         Find the next available IP in the pool
         Or if id is defined, get a specific IP in the pool
+
+        If the pool has a write queue, the new IPs are added to the queue
+        data can be used to provide additional fields (assigned_object_id ...)
         """
         logger.debug("Will try to get an IP for %s" % identifier)
 
@@ -83,8 +149,19 @@ class NetboxIpPool(object):
 
         for subnet in self.subnets:
 
+            is_new = not id or subnet._get_owner(id) is None
+
             ip = subnet.get(identifier=identifier, id=id)
 
+            ## Reserve the new IP in the nested prefixes as well
+            if ip and is_new:
+                for other in self._get_subnets(str(ip)):
+                    if other is not subnet:
+                        other.reserve(str(ip), identifier=identifier)
+
+            if ip and is_new and self.write_queue is not None:
+                self._write_ip(subnet, ip, identifier, data)
+
             if ip and return_mask:
                 return "%s/%s" % (ip, subnet.subnet.prefixlen)
             elif ip:
@@ -92,6 +169,37 @@ class NetboxIpPool(object):
 
         return False
 
+    def _write_ip(self, subnet, ip, identifier=None, data=None):
+        """
+        Add a new IP to the write queue
+        the IP is released if Netbox rejects it
+        """
+
+        address = "%s/%s" % (ip, subnet.subnet.prefixlen)
+
+        ip_data = {"address": address, "status": "active"}
+        if identifier:
+            ip_data["description"] = identifier
+        ip_data.update(data or {})
+
+        def on_success(item):
+            with self.lock:
+                self.ips_by_netbox_id[item.result["id"]] = address
+
+        def on_error(item):
+            with self.lock:
+                for pool in self._get_subnets(address):
+                    pool.release(ip_address=address)
+
+        self.write_queue.add(
+            "/api/ipam/ip-addresses/",
+            ip_data,
+            on_success=on_success,
+            on_error=on_error,
+        )
+
+        return True
+
     def _get_info_from_netbox(self):
 
         logger.debug(
@@ -108,55 +216,259 @@ class NetboxIpPool(object):
                 "Unable to find a prefix for %s in netbox" % (self.identifier)
             )
 
+        prefixes = []
         for result in resp["results"]:
-            if self.description and result["description"] != self.description:
+            if self.description and result.get("description") != self.description:
                 continue
-            self._add_prefix(result["prefix"])
+            prefixes.append(result["prefix"])
+
+        self._add_prefixes(prefixes)
 
         if self.subnets == []:
             raise Exception(
                 "Unable to find a prefix for %s in netbox" % (self.identifier)
             )
 
+        self.last_sync = self.watermark.since()
+
+        return True
+
+    def sync(self):
+        """
+        Apply the changes done in Netbox since the last synchronization
+        The IPs created or modified are found with their last_updated time
+        and the IPs deleted are found in the changelog
+
+        New prefixes are not added to the pool
+        """
+
+        since = self.last_sync
+        self.watermark.start()
+
+        ### Get the changes from Netbox first, the pool is locked only to apply them
+        deleted_ids = get_deleted_ids(
+            req=self.nb,
+            netbox=self.nb_addr,
+            object_type="ipam.ipaddress",
+            since=since,
+            secure=self.verify_certs,
+            watermark=self.watermark,
+        )
+
+        ips = []
+        prefixes = [str(pool.subnet) for pool in self.subnets]
+        for i in range(0, len(prefixes), self.parent_batch_size):
+            batch = prefixes[i : i + self.parent_batch_size]
+            ips.extend(
+                self._get_all_ips_per_prefixes(
+                    prefixes=batch, since=since, revalidate=True
+                )
+            )
+
+        with self.lock:
+            ### Release the IPs deleted in Netbox
+            nbr_deleted = 0
+            for netbox_id in deleted_ids:
+                if self._remove_ip(netbox_id):
+                    nbr_deleted += 1
+
+            ### Release the previous version of the IPs modified and reserve the new one
+            for ip in ips:
+                self.watermark.update(ip.get("last_updated"))
+                self._update_ip(ip)
+
+        logger.debug(
+            "sync(), %s ip(s) updated and %s ip(s) deleted in Netbox for %s"
+            % (len(ips), nbr_deleted, self.identifier)
+        )
+
+        self.last_sync = self.watermark.since()
+
         return True
 
+    @synchronized
+    def apply_event(self, object_type, event, data):
+        """
+        Apply an event received from Netbox (webhook) for an IP address
+        event is created, updated or deleted and data is the IP address
+
+        Return True if the event has been applied to this pool
+        """
+
+        if object_type != "ipam.ipaddress":
+            return False
+
+        if event == "deleted":
+            return self._remove_ip(data["id"])
+
+        return self._update_ip(data)
+
+    def _remove_ip(self, netbox_id):
+        """
+        Release the IP associated with a Netbox id, if any
+        """
+
+        if netbox_id not in self.ips_by_netbox_id:
+            return False
+
+        address = self.ips_by_netbox_id.pop(netbox_id)
+        pools = self._get_subnets(address)
+
+        if not pools:
+            return False
+
+        for pool in pools:
+            pool.release(ip_address=address)
+
+        return True
+
+    def _update_ip(self, ip):
+        """
+        Release the previous version of an IP from Netbox and reserve the new one
+        Return False if the IP is not part of this pool or not active anymore
+        """
+
+        self._remove_ip(ip["id"])
+
+        if get_status(ip) not in ["active", "reserved", None]:
+            return False
+
+        pools = self._get_subnets(ip["address"])
+
+        if not pools:
+            return False
+
+        for pool in pools:
+            pool.reserve(ip["address"], identifier=get_interface_identifier(ip))
+
+        self.ips_by_netbox_id[ip["id"]] = ip["address"]
+
+        return True
+
+    def _get_subnets(self, address):
+        """
+        Return all IpAddressPools containing an address, the prefixes may be nested
+        """
+
+        ip = ipaddress.ip_interface(address)
+
+        return self.index.lookup_all(ip.version, int(ip))
+
     def _add_prefix(self, prefix):
 
-        ###
-        pool = IpAddressPool(prefix)
+        return self._add_prefixes([prefix])
+
+    def _add_prefixes(self, prefixes):
+        """
+        Create an IpAddressPool for each prefix and reserve the IPs already present in Netbox
 
-        ### Get the list of existing IPs in Netbox
-        resp = self._get_all_ips_per_prefix(prefix=prefix)
+        The IPs of parent_batch_size prefixes are requested at once
+        and each IP is assigned to its prefix with a PrefixIndex
+        """
 
-        logger.debug("Found %s ip(s) in Netbox for %s" % (len(resp["results"]), prefix))
+        pools = [IpAddressPool(prefix) for prefix in prefixes]
+        index = PrefixIndex([(pool.subnet, pool) for pool in pools])
 
-        for ip in resp["results"]:
-            if ip["status"]["label"] not in ["Active", "Reserved"]:
-                continue
+        for i in range(0, len(prefixes), self.parent_batch_size):
+            batch = prefixes[i : i + self.parent_batch_size]
 
-            identifier = None
+            ### Get the list of existing IPs in Netbox
+            ### and reserve them by batch while they are received
+            nbr_ips = 0
+            items = []
+            for ip in self._get_all_ips_per_prefixes(
+                prefixes=batch, revalidate=self.revalidate
+            ):
+                nbr_ips += 1
+                self.watermark.update(ip.get("last_updated"))
 
-            ## make sure we have a device and an interface assigned to this IP
-            if isinstance(ip["interface"], dict):
-                if "device" in ip["interface"].keys():
-                    identifier = "{device}::{interface}".format(
-                        device=ip["interface"]["device"]["name"],
-                        interface=ip["interface"]["name"],
-                    )
+                ## IPs without status are reserved to be safe
+                if get_status(ip) not in ["active", "reserved", None]:
+                    continue
 
-            pool.reserve(ip["address"], identifier=identifier)
+                ## make sure we have a device and an interface assigned to this IP
+                identifier = get_interface_identifier(ip)
 
-        self.subnets.append(pool)
+                items.append((ip["address"], identifier))
+
+                if "id" in ip:
+                    self.ips_by_netbox_id[ip["id"]] = ip["address"]
+
+                if len(items) >= RESERVE_BATCH_SIZE:
+                    self._reserve_by_prefix(index, items)
+                    items = []
+
+            self._reserve_by_prefix(index, items)
+
+            logger.debug("Found %s ip(s) in Netbox for %s" % (nbr_ips, batch))
+
+        self.subnets.extend(pools)
+        for pool in pools:
+            self.index.add(pool.subnet, pool)
 
         return True
 
-    def _get_all_ips_per_prefix(self, prefix):
+    def _reserve_by_prefix(self, index, items):
+        """
+        Group a list of (address, identifier) per IpAddressPool and reserve them
+        If the prefixes are nested, each address is reserved in all prefixes containing it
+        """
+
+        if not items:
+            return True
+
+        if len(index) == 1:
+            index.items[0].reserve_many(items)
+            return True
+
+        groups = {}
+
+        ## The version is taken from each address, a pool may contain both families
+        items_per_version = {4: [], 6: []}
+        for item in items:
+            items_per_version[6 if ":" in item[0] else 4].append(item)
+
+        for version, version_items in items_per_version.items():
+            addresses = parse_addresses([item[0] for item in version_items], version)
+
+            for item, address in zip(version_items, addresses):
+                pools = index.lookup_all(version, address)
+
+                if not pools:
+                    logger.debug("Unable to find a prefix for %s" % item[0])
+                    continue
+
+                for pool in pools:
+                    groups.setdefault(id(pool), (pool, []))[1].append(item)
+
+        for pool, pool_items in groups.values():
+            pool.reserve_many(pool_items)
+
+        return True
+
+    def _get_all_ips_per_prefixes(self, prefixes, since=None, revalidate=False):
+        """
+        Get the IPs of a list of prefixes from Netbox
+        if since is defined, only the IPs created or modified since then are returned
+        if revalidate is defined, the cache of the client is checked with Netbox
+        """
 
         url = self.nb_addr + "/api/ipam/ip-addresses/"
-        url_params = "parent=%s" % prefix.replace("/", "%2f")
+        url_params = "&".join(
+            ["parent=%s" % prefix.replace("/", "%2f") for prefix in prefixes]
+        )
 
-        return query_netbox(
-            req=self.nb, url=url, params=url_params, secure=self.verify_certs
+        if since:
+            url_params += "&last_updated__gte=%s" % since
+
+        return iter_netbox(
+            req=self.nb,
+            url=url,
+            params=url_params,
+            secure=self.verify_certs,
+            paging=self.paging,
+            fields=IP_ADDRESS_FIELDS,
+            revalidate=revalidate,
         )
 
     def _get_list_prefix_from_netbox(self, role, site=None, family=4, status=1):
@@ -175,5 +487,10 @@ class NetboxIpPool(object):
             url_params = "role=%s&family=%s&status=%s" % (role, family, status)
 
         return query_netbox(
-            req=self.nb, url=url, params=url_params, secure=self.verify_certs
+            req=self.nb,
+            url=url,
+            params=url_params,
+            secure=self.verify_certs,
+            fields=PREFIX_FIELDS,
+            revalidate=self.revalidate,
         )
@@ -1,5 +1,13 @@
 import logging
 from resource_manager.backend.netbox_net_pool import NetboxNetPool
+from resource_manager.backend.netbox_client import NetboxClient
+from resource_manager.backend.netbox_pool_cache import NetboxPoolCache, get_size
+from resource_manager.backend.netbox_writer import NetboxWriteQueue
+from resource_manager.backend.netbox_async import coalesce, run_in_executor
+from resource_manager.backend.netbox_utils import (
+    DEFAULT_WARM_UP_WORKERS,
+    warm_up_pools,
+)
 
 logger = logging.getLogger("resource-manager")
 
@@ -10,7 +18,10 @@ class NetboxNetManager(object):
         self.__supported_types = ["NET4", "NET6"]
         self.mandatory_config_sections = ["netbox"]
 
-        self.net_pools = {}
+        self._pending_pools = {}
+
+        ## Error of the last attempt to create a pool, per pool identifier
+        self.failed_pools = {}
 
         for section in self.mandatory_config_sections:
             if section not in config.keys():
@@ -23,10 +34,47 @@ class NetboxNetManager(object):
         else:
             self.netbox_secure = True
 
+        ## Number of parent prefixes to query at once while loading a pool
+        ## 1 by default (one query per container) since the parent filter
+        ## only accepts multiple values in recent versions of Netbox
+        self.parent_batch_size = config["netbox"].get("parent_batch_size", 1)
+
+        ## Paging mode used to load the pools, offset or keyset
+        self.paging = config["netbox"].get("paging")
+
+        ## All pools created by this manager share the same HTTP connections
+        self.client = NetboxClient.from_config(config["netbox"])
+
+        ## Queue used to save the new allocations in Netbox, if enabled
+        self.write_queue = None
+        if config["netbox"].get("write_back"):
+            self.write_queue = NetboxWriteQueue(
+                self.client,
+                self.netbox_addr,
+                secure=self.netbox_secure,
+                batch_size=config["netbox"].get("write_batch_size", 100),
+            )
+
+        ## Pools created by this manager, refreshed in the background once older than pool_ttl
+        self.net_pools = NetboxPoolCache(
+            self._create_pool,
+            ttl=config["netbox"].get("pool_ttl"),
+            max_pools=config["netbox"].get("max_pools"),
+            max_memory=config["netbox"].get("max_pools_memory"),
+            sizeof=self._get_pool_size,
+            merge=self._merge_pools,
+            can_evict=self._can_evict_pool,
+            reloader=self._refresh_pool,
+        )
+
     def supported_types(self):
         return self.__supported_types
 
-    def resolve(self, var_type, var_params, identifier=None):
+    def _check_params(self, var_type, var_params):
+        """
+        Ensure the type is supported and parse the params
+        Return a tuple (pool_identifier, params) or (False, None)
+        """
 
         if var_type.upper() not in self.__supported_types:
             logger.warn(
@@ -34,13 +82,16 @@ class NetboxNetManager(object):
                     type=var_type, my_class=type(self).__name__
                 )
             )
-            return False
+            return (False, None)
 
         if not var_params:
-            return False
+            return (False, None)
 
         (pool_identifier, params) = self.parse_params(var_params)
 
+        if not pool_identifier:
+            return (False, None)
+
         if "4" in var_type:
             params["family"] = 4
         elif "6" in var_type:
@@ -48,15 +99,153 @@ class NetboxNetManager(object):
         else:
             params["family"] = None
 
+        return (pool_identifier, params)
+
+    def _create_pool(self, params, revalidate=False):
+
+        return NetboxNetPool(
+            netbox=self.netbox_addr,
+            role=params["role"],
+            site=params["site"],
+            family=params["family"],
+            secure=self.netbox_secure,
+            client=self.client,
+            parent_batch_size=self.parent_batch_size,
+            paging=self.paging,
+            write_queue=self.write_queue,
+            revalidate=revalidate,
+        )
+
+    def _refresh_pool(self, params):
+        """
+        Create the pool replacing a stale one, the cached responses are checked with Netbox
+        """
+        return self._create_pool(params, revalidate=True)
+
+    def resolve(self, var_type, var_params, identifier=None):
+
+        (pool_identifier, params) = self._check_params(var_type, var_params)
+
+        if not pool_identifier:
+            return False
+
+        try:
+            pool = self._get_pool(pool_identifier, params)
+
+        except Exception as err:
+            logger.warn(
+                "Something went wrong while creating the NetboxNetPool for %s > %s"
+                % (pool_identifier, err)
+            )
+            return False
+
+        next_net = pool.get(size=params["size"], identifier=identifier)
+
+        return next_net
+
+    def resolve_many(self, var_type, var_params, identifiers):
+        """
+        Resolve multiple identifiers from the same pool, the pool is looked up only once
+        and the subnets are allocated in a single call to get_many()
+
+        return a list with the subnet of each identifier, in the same order
+        """
+
+        (pool_identifier, params) = self._check_params(var_type, var_params)
+
+        if not pool_identifier:
+            return [False] * len(identifiers)
+
+        try:
+            pool = self._get_pool(pool_identifier, params)
+
+        except Exception as err:
+            logger.warn(
+                "Something went wrong while creating the NetboxNetPool for %s > %s"
+                % (pool_identifier, err)
+            )
+            return [False] * len(identifiers)
+
+        return pool.get_many(params["size"], identifiers)
+
+    def _get_pool(self, pool_identifier, params):
+        """
+        Return the pool for a given identifier, create it if needed
+        If the creation fails, the pool is marked as failed and the exception is raised
+        """
+
+        try:
+            pool = self.net_pools.load(pool_identifier, params)
+        except Exception as err:
+            self.failed_pools[pool_identifier] = str(err)
+            raise
+
+        self.failed_pools.pop(pool_identifier, None)
+
+        return pool
+
+    def _get_pool_size(self, pool):
+        """
+        Return the memory used by a pool, without the objects shared between the pools
+        """
+        return get_size(pool, exclude=[self.client, self.write_queue])
+
+    def _merge_pools(self, stale_pool, pool):
+        """
+        Carry over the allocations of a stale pool to the pool replacing it
+        """
+        return pool.merge(stale_pool)
+
+    def _can_evict_pool(self, pool):
+        """
+        A pool with allocations not saved in Netbox is kept in memory
+        """
+        return not pool.has_unsaved()
+
+    def warm_up(self, pools, var_type="NET4", workers=DEFAULT_WARM_UP_WORKERS):
+        """
+        Create the pools in parallel, before the first call to resolve
+        The pools that couldn't be created are listed in failed_pools
+
+        args
+            pools (list): params of the pools to create, as provided to resolve (site/role/size or role/size)
+            var_type (str): NET4 or NET6
+            workers (int): number of pools created at the same time
+
+        return a dict with the result of each pool
+            loaded (bool), time (time to load the pool in sec), error (str or None)
+        """
+
+        def load(var_params):
+            (pool_identifier, params) = self._check_params(var_type, var_params)
+
+            if not pool_identifier:
+                raise Exception("Invalid parameters %s for %s" % (var_params, var_type))
+
+            return self._get_pool(pool_identifier, params)
+
+        return warm_up_pools(load, pools, workers=workers)
+
+    async def resolve_async(self, var_type, var_params, identifier=None):
+        """
+        Async version of resolve
+        The pool is created outside of the event loop if needed,
+        concurrent calls for the same pool share the same creation
+        """
+
+        (pool_identifier, params) = self._check_params(var_type, var_params)
+
+        if not pool_identifier:
+            return False
+
         if pool_identifier not in self.net_pools.keys():
             try:
-                self.net_pools[pool_identifier] = NetboxNetPool(
-                    netbox=self.netbox_addr,
-                    role=params["role"],
-                    site=params["site"],
-                    family=params["family"],
-                    secure=self.netbox_secure,
+                pool = await coalesce(
+                    self._pending_pools,
+                    pool_identifier,
+                    lambda: run_in_executor(self._create_pool, params),
                 )
+                self.net_pools.add(pool_identifier, pool, params)
 
             except Exception as err:
                 logger.warn(
@@ -65,12 +254,38 @@ class NetboxNetManager(object):
                 )
                 return False
 
-        next_net = self.net_pools[pool_identifier].get(
+        next_net = self.net_pools.load(pool_identifier, params).get(
             size=params["size"], identifier=identifier
         )
 
         return next_net
 
+    def flush(self):
+        """
+        Save the allocations done since the last flush in Netbox, if write back is enabled
+
+        return a dict with the number of objects written and rejected
+        """
+
+        if self.write_queue is None:
+            return {"written": 0, "conflicts": 0}
+
+        return self.write_queue.flush()
+
+    def apply_event(self, object_type, event, data):
+        """
+        Apply an event received from Netbox (webhook) to all the pools already created
+
+        Return the number of pools that applied the event
+        """
+
+        nbr_applied = 0
+        for pool in list(self.net_pools.values()):
+            if pool.apply_event(object_type, event, data):
+                nbr_applied += 1
+
+        return nbr_applied
+
     def parse_params(self, params):
         """
         args 
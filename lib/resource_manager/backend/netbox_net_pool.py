@@ -1,38 +1,103 @@
 import logging
+import ipaddress
 import re
 import yaml
 import os
 import requests
+import threading
 
 from collections import defaultdict
 
 from resource_manager.pools.ipaddr_subnet import IpAddressPool
 from resource_manager.pools.ipaddr_prefixes import PrefixesPool
 
-from resource_manager.backend.netbox_utils import query_netbox
+from resource_manager.backend.netbox_utils import (
+    query_netbox,
+    iter_netbox,
+    get_deleted_ids,
+    SyncWatermark,
+    lock_current,
+    synchronized,
+    match_filters,
+    PrefixIndex,
+)
 
 logger = logging.getLogger("resource-manager")
 
+## Fields requested from Netbox while loading a pool
+PREFIX_FIELDS = ["id", "prefix", "description", "last_updated"]
+
 
 class NetboxNetPool(object):
-    def __init__(self, netbox, role, family, site=None, secure=True):
+    def __init__(
+        self,
+        netbox,
+        role,
+        family,
+        site=None,
+        secure=True,
+        client=None,
+        parent_batch_size=1,
+        paging=None,
+        write_queue=None,
+        revalidate=False,
+    ):
+        """
+        Inputs:
+            netbox: Netbox Server Address http:1.2.3.4:4851
+            role:
+            family:
+            site:
+            client: NetboxClient to share the same connections with other pools
+            parent_batch_size: number of parent prefixes to query at once to get the existing prefixes
+                               Netbox must support multiple values for the parent filter,
+                               with the default of 1 the prefixes are requested with one query per container
+            paging: offset or keyset, paging mode used to get the existing prefixes
+            write_queue: NetboxWriteQueue used to save the new prefixes in Netbox
+            revalidate: check with Netbox the responses served from the cache of the client,
+                        used when the pool is refreshed
+        """
 
         if not secure:
             from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
             requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
-        self.nb = requests.session()
+        ## Use the shared client if provided, otherwise create a dedicated session
+        if client:
+            self.nb = client
+        else:
+            self.nb = requests.session()
         self.nb_addr = netbox
         self.verify_certs = secure
 
         self.site_name = site
         self.role = role
         self.ip_family = family
+        self.parent_batch_size = max(int(parent_batch_size), 1)
+        self.paging = paging
+        self.write_queue = write_queue
+        self.revalidate = revalidate
 
         self.data = None
 
         self.prefixes = []
+        self.index = PrefixIndex()
+
+        ## Lock used to allocate the prefixes and apply the changes from Netbox
+        self.lock = threading.RLock()
+
+        ## Prefix and identifier of each prefix from Netbox, by Netbox id
+        ## and time of the last synchronization with Netbox, used by sync()
+        self.prefixes_by_netbox_id = {}
+        self.watermark = SyncWatermark()
+        self.last_sync = None
+
+        ## Identifier of the prefixes allocated by get() and the ones not saved in Netbox yet,
+        ## they are carried over by merge() to the pool replacing this one after a refresh
+        self.local = {}
+        self.unsaved = set()
+        self.replaced_by = None
 
         ## Get prefix from netbox based on Site and Role
         url = self.nb_addr + "/api/ipam/prefixes/"
@@ -45,7 +110,12 @@ class NetboxNetPool(object):
             params += "&site={site}".format(site=self.site_name)
 
         resp = query_netbox(
-            req=self.nb, url=url, params=params, secure=self.verify_certs
+            req=self.nb,
+            url=url,
+            params=params,
+            secure=self.verify_certs,
+            fields=PREFIX_FIELDS,
+            revalidate=self.revalidate,
         )
 
         if resp["count"] == 0:
@@ -57,33 +127,304 @@ class NetboxNetPool(object):
         self.data = resp["results"]
 
         ### Save all prefixes
-        for p in self.data:
-            prefix = PrefixesPool(p["prefix"])
-
-            # Get the list of existing prefix in Netbox
-            # And reserve them in the local object
-            # TODO need to remove te mask_lenght limitation
-            url = self.nb_addr + "/api/ipam/prefixes/"
-            params = "parent={parent}&family={family}".format(
-                parent=p["prefix"], family=str(self.ip_family)
-            )
+        containers = [p["prefix"] for p in self.data]
+        for i in range(0, len(containers), self.parent_batch_size):
+            self._add_prefixes(containers[i : i + self.parent_batch_size])
 
-            if self.site_name:
-                params += "&site={site}".format(site=self.site_name)
+        self.last_sync = self.watermark.since()
+
+    def _add_prefixes(self, containers):
+        """
+        Create a PrefixesPool for each container prefix
+        with the prefixes already present in Netbox
 
-            resp = query_netbox(
-                req=self.nb, url=url, params=params, secure=self.verify_certs
+        The existing prefixes of all containers are requested in one query
+        and each prefix is assigned to the most specific container containing it with a PrefixIndex.
+        Prefixes already covered by another prefix are skipped by PrefixesPool.from_reservations
+        """
+
+        reservations = {container: [] for container in containers}
+        index = PrefixIndex([(container, container) for container in containers])
+
+        for net in self._get_child_prefixes(containers, revalidate=self.revalidate):
+            self.watermark.update(net.get("last_updated"))
+            sub = ipaddress.ip_network(net["prefix"])
+
+            container = index.lookup(
+                sub.version, int(sub.network_address), prefixlen=sub.prefixlen
             )
+            if container is None:
+                logger.debug("Unable to find a parent prefix for %s" % net["prefix"])
+                continue
 
-            logger.debug("Found %s prefixes in Netbox" % len(resp["results"]))
+            reservations[container].append(
+                (net["prefix"], net.get("description") or None)
+            )
+
+            if "id" in net:
+                self.prefixes_by_netbox_id[net["id"]] = reservations[container][-1]
 
-            for net in resp["results"]:
-                if net["description"]:
-                    prefix.reserve(net["prefix"], identifier=net["description"])
-                else:
-                    prefix.reserve(net["prefix"])
+        for container in containers:
+            prefix = PrefixesPool.from_reservations(container, reservations[container])
+            logger.debug(
+                "Found %s prefixes in Netbox for %s"
+                % (len(prefix.sub_by_key), container)
+            )
 
             self.prefixes.append(prefix)
+            self.index.add(prefix.network, prefix)
+
+        return True
+
+    def sync(self):
+        """
+        Apply the changes done in Netbox since the last synchronization
+        The prefixes created or modified are found with their last_updated time
+        and the prefixes deleted are found in the changelog
+
+        New container prefixes are not added to the pool
+        """
+
+        since = self.last_sync
+        self.watermark.start()
+
+        updated = []
+        released = []
+
+        ### Get the changes from Netbox first, the pool is locked only to apply them
+        deleted_ids = get_deleted_ids(
+            req=self.nb,
+            netbox=self.nb_addr,
+            object_type="ipam.prefix",
+            since=since,
+            secure=self.verify_certs,
+            watermark=self.watermark,
+        )
+
+        nets = []
+        containers = [str(prefix.network) for prefix in self.prefixes]
+        for i in range(0, len(containers), self.parent_batch_size):
+            batch = containers[i : i + self.parent_batch_size]
+            nets.extend(self._get_child_prefixes(batch, since=since, revalidate=True))
+
+        with self.lock:
+            ### Release the prefixes deleted in Netbox
+            nbr_deleted = 0
+            for netbox_id in deleted_ids:
+                if self._remove_prefix(netbox_id, released):
+                    nbr_deleted += 1
+
+            ### Release the previous version of the prefixes modified and reserve the new one
+            for net in nets:
+                self.watermark.update(net.get("last_updated"))
+                self._update_prefix(net, updated, released)
+
+            self._reserve_prefixes(updated, released)
+
+        logger.debug(
+            "sync(), %s prefixes updated and %s prefixes deleted in Netbox for %s (v%s)"
+            % (len(updated), nbr_deleted, self.role, self.ip_family)
+        )
+
+        self.last_sync = self.watermark.since()
+
+        return True
+
+    @synchronized
+    def apply_event(self, object_type, event, data):
+        """
+        Apply an event received from Netbox (webhook) for a prefix
+        event is created, updated or deleted and data is the prefix
+
+        Return True if the event has been applied to this pool
+        """
+
+        if object_type != "ipam.prefix":
+            return False
+
+        if self.replaced_by is not None:
+            return self.replaced_by.apply_event(object_type, event, data)
+
+        updated = []
+        released = []
+
+        ## The prefix is kept if the scope can't be checked with the fields sent by Netbox
+        if event == "deleted" or self._is_in_scope(data) is False:
+            applied = self._remove_prefix(data["id"], released)
+        else:
+            applied = self._update_prefix(data, updated, released)
+
+        self._reserve_prefixes(updated, released)
+
+        return applied
+
+    def _is_in_scope(self, net):
+        """
+        Check if a prefix from Netbox is part of one of the container prefixes of this pool
+        Return None if the site can't be checked with the fields of the prefix
+        """
+
+        if self._get_container(net["prefix"]) is None:
+            return False
+
+        if self.site_name:
+            return match_filters(net, {"site": self.site_name})
+
+        return True
+
+    def _remove_prefix(self, netbox_id, released):
+        """
+        Release the prefix associated with a Netbox id, if any
+        The prefixes released are added to released
+        """
+
+        if netbox_id not in self.prefixes_by_netbox_id:
+            return False
+
+        prefix, identifier = self.prefixes_by_netbox_id.pop(netbox_id)
+        container = self._get_container(prefix)
+        self._forget_local(prefix)
+
+        if container and container.release(subnet=prefix):
+            released.append(ipaddress.ip_network(prefix))
+
+        return True
+
+    def _forget_local(self, prefix):
+        """
+        Remove a prefix from the prefixes allocated by get()
+        """
+
+        self.unsaved.discard(str(prefix))
+
+        return self.local.pop(str(prefix), None) is not None
+
+    def _update_prefix(self, net, updated, released):
+        """
+        Release the previous version of a prefix from Netbox
+        and add the new one to the list of prefixes to reserve (updated)
+        """
+
+        reservation = (net["prefix"], net.get("description") or None)
+
+        if self.prefixes_by_netbox_id.get(net["id"]) == reservation:
+            return False
+
+        self._remove_prefix(net["id"], released)
+
+        self.prefixes_by_netbox_id[net["id"]] = reservation
+        updated.append(reservation)
+
+        ## The prefix allocated locally is now saved in Netbox
+        if net["prefix"] in self.local:
+            self.unsaved.discard(net["prefix"])
+
+        return True
+
+    def _reserve_prefixes(self, updated, released):
+        """
+        Reserve a list of (prefix, identifier)
+        The prefixes nested in a prefix released were not reserved before, they are reserved too
+        """
+
+        if released:
+            for reservation in self.prefixes_by_netbox_id.values():
+                sub = ipaddress.ip_network(reservation[0])
+
+                for net in released:
+                    if sub.version == net.version and sub.subnet_of(net):
+                        updated.append(reservation)
+                        break
+
+        for prefix, identifier in updated:
+            container = self._get_container(prefix)
+
+            if container is None:
+                logger.debug("Unable to find a parent prefix for %s" % prefix)
+                continue
+
+            container.reserve(prefix, identifier=identifier)
+
+        return True
+
+    def _get_container(self, prefix):
+        """
+        Return the PrefixesPool containing a prefix or None
+        """
+
+        sub = ipaddress.ip_network(prefix)
+
+        return self.index.lookup(
+            sub.version, int(sub.network_address), prefixlen=sub.prefixlen
+        )
+
+    def _get_child_prefixes(self, containers, since=None, revalidate=False):
+        """
+        Get the list of existing prefix in Netbox for a list of parent prefixes
+        if since is defined, only the prefixes created or modified since then are returned
+        if revalidate is defined, the cache of the client is checked with Netbox
+        """
+
+        # TODO need to remove te mask_lenght limitation
+        url = self.nb_addr + "/api/ipam/prefixes/"
+        params = "&".join(["parent=%s" % container for container in containers])
+        params += "&family={family}".format(family=str(self.ip_family))
+
+        if self.site_name:
+            params += "&site={site}".format(site=self.site_name)
+
+        if since:
+            params += "&last_updated__gte={since}".format(since=since)
+
+        return iter_netbox(
+            req=self.nb,
+            url=url,
+            params=params,
+            secure=self.verify_certs,
+            paging=self.paging,
+            fields=PREFIX_FIELDS,
+            revalidate=revalidate,
+        )
+
+    def _write_prefix(self, container, prefix, identifier=None, data=None):
+        """
+        Add a new prefix to the write queue
+        the prefix is released if Netbox rejects it
+        """
+
+        prefix_data = {
+            "prefix": str(prefix),
+            "status": "active",
+            "role": {"slug": self.role},
+            "description": identifier or "",
+        }
+        if self.site_name:
+            prefix_data["site"] = {"slug": self.site_name}
+        prefix_data.update(data or {})
+
+        ## The callbacks are applied to the pool replacing this one after a refresh
+        def on_success(item):
+            with lock_current(self) as pool:
+                pool.prefixes_by_netbox_id[item.result["id"]] = (
+                    str(prefix),
+                    identifier,
+                )
+                pool.unsaved.discard(str(prefix))
+
+        def on_error(item):
+            with lock_current(self) as pool:
+                container = pool._get_container(prefix)
+                if pool._forget_local(prefix) and container:
+                    container.release(subnet=prefix)
+
+        self.write_queue.add(
+            "/api/ipam/prefixes/",
+            prefix_data,
+            on_success=on_success,
+            on_error=on_error,
+        )
+
+        return True
 
     def get_parent_prefixes(self):
         """
@@ -95,26 +436,124 @@ class NetboxNetPool(object):
 
         return parent_list
 
-    def get(self, size, identifier=None):
+    @synchronized
+    def get(self, size, identifier=None, data=None):
         """
         Reserve a new subnet
+
+        If the pool has a write queue, the new subnets are added to the queue
+        data can be used to provide additional fields (vrf, tenant ...)
         """
 
+        ## The pool has been refreshed, the new version is used
+        if self.replaced_by is not None:
+            return self.replaced_by.get(size, identifier=identifier, data=data)
+
         ### First check if this identifier already has a subnet assigned
         ### in one of the existing pool
         for prefix in self.prefixes:
             if prefix.check_if_already_allocated(identifier=identifier):
                 return prefix.get(size=size, identifier=identifier)
 
-        ### If Nothing was found previously, assign a new subnet
+        return self._get_new(size, identifier=identifier, data=data)
+
+    @synchronized
+    def get_many(self, size, identifiers, data=None):
+        """
+        Reserve a subnet for multiple identifiers at once,
+        the containers are searched for the existing subnets only once for the whole batch
+        Each identifier None gets a new subnet
+
+        return a list with the subnet of each identifier, in the same order
+        """
+
+        if self.replaced_by is not None:
+            return self.replaced_by.get_many(size, identifiers, data=data)
+
+        containers = {}
+        for prefix in self.prefixes:
+            for identifier in prefix.sub_by_id.keys():
+                containers.setdefault(identifier, prefix)
+
+        results = []
+        for identifier in identifiers:
+            container = containers.get(identifier) if identifier else None
+
+            if container is not None:
+                results.append(container.get(size=size, identifier=identifier))
+                continue
+
+            new_prefix = self._get_new(size, identifier=identifier, data=data)
+            results.append(new_prefix)
+
+            if new_prefix and identifier:
+                containers[identifier] = self._get_container(new_prefix)
+
+        return results
+
+    def _get_new(self, size, identifier=None, data=None):
+        """
+        Assign a new subnet from the first container with enough space
+        """
+
         for prefix in self.prefixes:
             new_prefix = prefix.get(size=size, identifier=identifier)
             if new_prefix:
+                self.local[str(new_prefix)] = identifier
+                self.unsaved.add(str(new_prefix))
+
+                if self.write_queue is not None:
+                    self._write_prefix(prefix, new_prefix, identifier, data)
+
                 return new_prefix
 
         ### if nothing has been assigned and returned before, no more subnet are available
         return False
 
+    def has_unsaved(self):
+        """
+        Return True if some prefixes allocated by get() are not saved in Netbox
+        """
+        return len(self.unsaved) > 0
+
+    def merge(self, pool):
+        """
+        Carry over the prefixes allocated by get() on the previous version of this pool,
+        the prefixes loaded from Netbox take precedence.
+        The previous version forwards the next requests to this pool
+        """
+
+        with pool.lock, self.lock:
+            for prefix, identifier in pool.local.items():
+
+                ## Already in Netbox, with this prefix or another one
+                if identifier is not None and any(
+                    [p.check_if_already_allocated(identifier) for p in self.prefixes]
+                ):
+                    continue
+
+                container = self._get_container(prefix)
+
+                if container is None or not container.reserve(prefix, identifier):
+                    logger.warn(
+                        "%s (%s) overlaps with a prefix in Netbox, SKIPPING"
+                        % (prefix, identifier)
+                    )
+                    continue
+
+                self.local[prefix] = identifier
+                if prefix in pool.unsaved:
+                    self.unsaved.add(prefix)
+
+            pool.replaced_by = self
+
+        logger.debug(
+            "merge(), %s prefixes carried over for %s (v%s), %s not saved"
+            % (len(self.local), self.role, self.ip_family, len(self.unsaved))
+        )
+
+        return True
+
     ## This function propably should not live here
 
     # def get_net_ip(self, device=None, interface=None, ipid=1):
@@ -0,0 +1,344 @@
+import logging
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+
+logger = logging.getLogger("resource-manager")
+
+## Types of objects not counted by get_size, shared with the rest of the program
+SHARED_TYPES = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.MethodType,
+    types.BuiltinFunctionType,
+)
+
+
+def get_size(obj, exclude=None):
+    """
+    Return an estimation of the memory used by an object and everything it references, in bytes
+
+    args
+        exclude (list): objects not counted, like the objects shared between the pools
+    """
+
+    seen = set([id(item) for item in exclude or []])
+    size = 0
+    stack = [obj]
+
+    while stack:
+        item = stack.pop()
+
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+
+        ## Classes, functions and modules are shared
+        if isinstance(item, SHARED_TYPES):
+            continue
+
+        size += sys.getsizeof(item)
+
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+
+        if hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+
+        for slot in getattr(type(item), "__slots__", ()):
+            if hasattr(item, slot):
+                stack.append(getattr(item, slot))
+
+    return size
+
+
+class NetboxPoolCacheEntry(object):
+    def __init__(self, pool, args, size=0):
+
+        self.pool = pool
+        self.args = args
+        self.size = size
+        self.loaded_at = time.time()
+        self.thread = None
+
+
+class NetboxPoolCache(object):
+    """
+    Cache of the pools created by a manager, keyed by pool identifier
+
+    A pool older than ttl is stale, it keeps serving the allocations
+    while a new pool is created from Netbox in a background thread,
+    the new pool replaces the stale one once it's fully loaded.
+    The allocations done on the stale pool are carried over to the new one with merge
+
+    The pools not used recently are evicted when there is more than max_pools pools
+    or when the estimated memory used by the pools is over max_memory,
+    a pool is never evicted if can_evict returns False (allocations not saved in Netbox)
+    """
+
+    def __init__(
+        self,
+        loader,
+        ttl=None,
+        max_pools=None,
+        max_memory=None,
+        sizeof=None,
+        merge=None,
+        can_evict=None,
+        reloader=None,
+    ):
+        """
+        Inputs:
+            loader: function creating a pool, called with the args provided to load()
+            ttl: number of seconds a pool is fresh, the pools are never refreshed if None
+            max_pools: max number of pools in the cache
+            max_memory: max memory used by the pools, in bytes
+            sizeof: function returning the memory used by a pool, get_size by default
+            merge: function called with the stale pool and the new pool before replacing it
+            can_evict: function returning False if a pool must stay in the cache
+            reloader: function creating the pool replacing a stale one, loader by default
+        """
+
+        self.loader = loader
+        self.ttl = ttl
+        self.max_pools = max_pools
+        self.max_memory = max_memory
+        self.sizeof = sizeof or get_size
+        self.merge = merge
+        self.can_evict = can_evict
+        self.reloader = reloader or loader
+
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self._load_locks = {}
+
+        self.refreshes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+
+        entry = self._get_entry(key)
+        if entry is None:
+            raise KeyError(key)
+
+        return entry.pool
+
+    def __setitem__(self, key, pool):
+        self.add(key, pool)
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def values(self):
+        return [entry.pool for entry in list(self.entries.values())]
+
+    def items(self):
+        return [(key, entry.pool) for key, entry in list(self.entries.items())]
+
+    def pop(self, key, default=None):
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+        return entry.pool if entry else default
+
+    @property
+    def memory(self):
+        """
+        Estimated memory used by all the pools, in bytes (only if max_memory is defined)
+        """
+        return sum([entry.size for entry in list(self.entries.values())])
+
+    def load(self, key, *args):
+        """
+        Return the pool for a given key, create it with loader(*args) if needed
+        Only one thread creates a given pool, the others wait for it
+
+        If the pool is stale, it's returned and a refresh is started in the background
+        """
+
+        entry = self._get_entry(key)
+
+        if entry is None:
+            with self._load_locks.setdefault(key, threading.Lock()):
+                ## Another thread may have created the pool while waiting for the lock
+                entry = self._get_entry(key)
+                if entry is None:
+                    return self.add(key, self.loader(*args), *args)
+
+        if self.is_stale(entry):
+            self.refresh(key)
+
+        return entry.pool
+
+    def is_stale(self, entry):
+
+        if self.ttl is None:
+            return False
+
+        return time.time() - entry.loaded_at >= self.ttl
+
+    def refresh(self, key):
+        """
+        Start the creation of a new pool for key in the background,
+        if no refresh is already in progress for this pool
+
+        Return the thread of the refresh or None
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.thread is not None:
+                return None
+
+            entry.thread = threading.Thread(target=self._refresh, args=(key, entry))
+            entry.thread.daemon = True
+
+        entry.thread.start()
+
+        return entry.thread
+
+    def join(self, timeout=None):
+        """
+        Wait for the refreshes in progress
+        """
+
+        for entry in list(self.entries.values()):
+            thread = entry.thread
+            if thread is not None:
+                thread.join(timeout)
+
+    def _refresh(self, key, entry):
+
+        start = time.time()
+
+        try:
+            pool = self.reloader(*entry.args)
+            size = self._get_size(pool)
+
+        except Exception as err:
+            logger.warn(
+                "Unable to refresh the pool %s, keeping the stale one > %s" % (key, err)
+            )
+
+            ## Try again once the pool is stale again
+            with self.lock:
+                entry.loaded_at = time.time()
+                entry.thread = None
+            return False
+
+        with self.lock:
+            entry.thread = None
+
+            ## The pool has been evicted or replaced during the refresh
+            if self.entries.get(key) is not entry:
+                return False
+
+            ## The allocations done on the stale pool during the refresh are carried over
+            if self.merge is not None:
+                try:
+                    self.merge(entry.pool, pool)
+                except Exception as err:
+                    logger.warn(
+                        "Unable to carry over the allocations of the pool %s, keeping the stale one > %s"
+                        % (key, err)
+                    )
+                    entry.loaded_at = time.time()
+                    return False
+
+            new_entry = NetboxPoolCacheEntry(pool, entry.args, size=size)
+            self.entries[key] = new_entry
+            self.refreshes += 1
+
+            self._evict(keep=key)
+
+        logger.debug("Pool %s refreshed in %.2fs" % (key, time.time() - start))
+
+        return True
+
+    def _get_size(self, pool):
+
+        ## The size is only estimated if needed, it requires to go through the whole pool
+        if self.max_memory is None:
+            return 0
+
+        return self.sizeof(pool)
+
+    def _get_entry(self, key):
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        return entry
+
+    def add(self, key, pool, *args):
+        """
+        Add a pool created outside of the cache,
+        args are provided to loader to refresh it
+        """
+
+        entry = NetboxPoolCacheEntry(pool, args, size=self._get_size(pool))
+
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict(keep=key)
+
+        return pool
+
+    def _evict(self, keep=None):
+        """
+        Remove the least recently used pools until the cache is within its limits
+        The pool identified by keep is never removed
+        """
+
+        while len(self.entries) > 1 and self._is_full():
+            key = self._get_evictable(keep=keep)
+            if key is None:
+                logger.debug("No pool can be evicted from the cache")
+                break
+
+            del self.entries[key]
+            self.evictions += 1
+
+            logger.debug("Pool %s evicted from the cache" % key)
+
+    def _get_evictable(self, keep=None):
+        """
+        Return the key of the least recently used pool that can be evicted or None
+        """
+
+        for key, entry in self.entries.items():
+            if key == keep:
+                continue
+
+            if self.can_evict is not None and not self.can_evict(entry.pool):
+                continue
+
+            return key
+
+        return None
+
+    def _is_full(self):
+
+        if self.max_pools is not None and len(self.entries) > self.max_pools:
+            return True
+
+        if self.max_memory is not None and self.memory > self.max_memory:
+            return True
+
+        return False
@@ -1,26 +1,814 @@
-def query_netbox(req, url, params, secure=True, batch_size=500):
+import calendar
+import functools
+import logging
+import ipaddress
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-    offset = 0
-    keep_querying = True
+logger = logging.getLogger("resource-manager")
 
-    results = {"count": 0, "results": []}
+## Default number of pages fetched in parallel by query_netbox
+DEFAULT_CONCURRENCY = 4
 
-    while keep_querying:
+## Default paging mode used by query_netbox, offset or keyset
+DEFAULT_PAGING = "offset"
 
-        paging_params = "offset=%s&limit=%s" % (offset, batch_size)
-        api_url_params = paging_params + "&" + params
+## Default number of pools created in parallel by warm_up_pools
+DEFAULT_WARM_UP_WORKERS = 8
 
-        resp = req.get(url, params=api_url_params, verify=secure)
+## Number of seconds removed from the time of the last change seen in Netbox by sync(),
+## to get the changes committed while the previous synchronization was running
+SYNC_MARGIN = 60
 
-        resp.raise_for_status()
-        resp_dict = resp.json()
+NETBOX_TIME_RE = re.compile(
+    r"^(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(\.\d+)?(Z|[+-]\d{2}:?\d{2})?$"
+)
+
+
+class PrefixIndex(object):
+    """
+    Find which prefix contains an address with a binary search over the prefixes
+    Each prefix is stored with an item (a pool for example) returned by lookup()
+
+    If the prefixes are nested, lookup() returns the most specific prefix containing the address
+    and lookup_all() all of them
+    """
+
+    def __init__(self, prefixes=None):
+        """
+        args
+            prefixes (list): list of tuple (prefix, item)
+        """
+
+        self.keys = []
+        self.ends = []
+        self.max_ends = []
+        self.items = []
+
+        for prefix, item in prefixes or []:
+            self.add(prefix, item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, prefix, item):
+
+        net = ipaddress.ip_network(prefix)
+        key = (net.version, int(net.network_address), net.prefixlen)
+
+        idx = bisect_right(self.keys, key)
+        self.keys.insert(idx, key)
+        self.ends.insert(idx, key[1] + net.num_addresses)
+        self.max_ends.insert(idx, 0)
+        self.items.insert(idx, item)
+
+        ## max_ends[i] is the highest end of the prefixes of the same version up to i,
+        ## it tells lookup() when no previous prefix can contain the address
+        for i in range(idx, len(self.keys)):
+            max_end = self.ends[i]
+            if i > 0 and self.keys[i - 1][0] == self.keys[i][0]:
+                max_end = max(max_end, self.max_ends[i - 1])
+
+            if i > idx and self.max_ends[i] == max_end:
+                break
+            self.max_ends[i] = max_end
+
+    def lookup(self, version, address, prefixlen=None):
+        """
+        Return the item of the most specific prefix containing this address (int) or None
+        If prefixlen is defined, only the prefixes shorter than prefixlen are considered,
+        to find the parent of a prefix
+        """
+
+        ## Go back from the last prefix starting before the address
+        ## until one contains it, the nested prefixes are after their parent
+        idx = bisect_right(self.keys, (version, address, 129)) - 1
+
+        while (
+            idx >= 0 and self.keys[idx][0] == version and self.max_ends[idx] > address
+        ):
+            if address < self.ends[idx] and (
+                prefixlen is None or self.keys[idx][2] < prefixlen
+            ):
+                return self.items[idx]
+            idx -= 1
+
+        return None
+
+    def lookup_all(self, version, address):
+        """
+        Return the items of all prefixes containing this address (int),
+        from the most specific to the least specific
+        """
+
+        result = []
+
+        idx = bisect_right(self.keys, (version, address, 129)) - 1
+
+        while (
+            idx >= 0 and self.keys[idx][0] == version and self.max_ends[idx] > address
+        ):
+            if address < self.ends[idx]:
+                result.append(self.items[idx])
+            idx -= 1
+
+        return result
+
+
+def synchronized(func):
+    """
+    Decorator running a method of a pool with the lock of the pool (self.lock)
+    so the pool can be used by multiple threads
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def lock_current(pool):
+    """
+    Lock and return the current version of a pool,
+    the pool itself or the pool replacing it after a refresh (replaced_by)
+    """
+
+    while True:
+        with pool.lock:
+            if pool.replaced_by is None:
+                yield pool
+                return
+
+        pool = pool.replaced_by
+
+
+class SingleFlightCall(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Share a single execution of a function between all the threads
+    calling it with the same key at the same time
+
+    The first caller executes the function, the others wait for it
+    and get the same result (or the same exception)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = SingleFlightCall()
+
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+        return call.result
+
+
+## Requests to Netbox in progress, shared between all the threads
+NETBOX_REQUESTS = SingleFlight()
+
+
+def fetch_netbox(req, url, params, secure=True, timeout=None, revalidate=False):
+    """
+    Send a single GET request to the Netbox API and return the decoded response
+    If req has a cache (NetboxClient), the response is served from the cache when possible,
+    with revalidate the cached response is always checked with Netbox first
+
+    Concurrent requests for the same URL and params with the same session
+    share a single request and its decoded response
+    """
+
+    return NETBOX_REQUESTS.do(
+        (id(req), url, str(params), secure, revalidate),
+        _fetch_netbox,
+        req,
+        url,
+        params,
+        secure=secure,
+        timeout=timeout,
+        revalidate=revalidate,
+    )
+
+
+def _fetch_netbox(req, url, params, secure=True, timeout=None, revalidate=False):
+
+    cache = getattr(req, "cache", None)
+    if cache is not None:
+        return cache.fetch(
+            req, url, params, secure=secure, timeout=timeout, revalidate=revalidate
+        )
+
+    resp = req.get(url, params=params, verify=secure, timeout=timeout)
+
+    resp.raise_for_status()
+    return resp.json()
+
+
+def add_fields(params, fields, paging=None):
+    """
+    Add the list of fields to return to the params of a query
+    Netbox ignores this parameter if it doesn't support the selection of fields
+
+    The id is always requested in keyset mode since it's used to find the next page
+    """
+
+    fields = list(fields)
+    if paging == "keyset" and "id" not in fields:
+        fields.insert(0, "id")
+
+    return params + "&fields=" + ",".join(fields)
+
+
+def get_status(record):
+    """
+    Return the status of a record in lowercase or None if the status is not present
+    The status can be a dict with a value and a label or directly the value
+    """
+
+    status = record.get("status")
+
+    if isinstance(status, dict):
+        status = status.get("label") or status.get("value")
+
+    if status is None:
+        return None
+
+    return str(status).lower()
+
+
+def get_interface_identifier(record):
+    """
+    Return the identifier device::interface of the interface assigned to an IP
+    Both assigned_object and interface (Netbox < 2.9) are supported
+    Return None if the IP is not assigned to a device interface
+    """
+
+    interface = record.get("assigned_object") or record.get("interface")
+
+    if not isinstance(interface, dict):
+        return None
+    elif not isinstance(interface.get("device"), dict):
+        return None
+
+    return "{device}::{interface}".format(
+        device=interface["device"]["name"], interface=interface["name"]
+    )
+
+
+def match_value(value, expected):
+    """
+    Check if a value from Netbox matches an expected value (from a filter)
+    Nested objects (site, role ...) match with their slug, name or id
+    and choices (status, family ...) with their value
+    """
+
+    if isinstance(value, dict):
+        candidates = [
+            value.get("slug"),
+            value.get("name"),
+            value.get("id"),
+            value.get("value"),
+        ]
+    elif isinstance(value, list):
+        return any([match_value(item, expected) for item in value])
+    else:
+        candidates = [value]
+
+    return str(expected) in [str(c) for c in candidates if c is not None]
+
+
+## Fields of the objects sent by Netbox (webhook) checked for each filter of the API
+## the filters not listed here can't be checked without querying Netbox
+FILTER_FIELDS = {
+    "site": ["site"],
+    "site_id": ["site"],
+    "role": ["device_role", "role"],
+    "role_id": ["device_role", "role"],
+    "tag": ["tags"],
+    "status": ["status"],
+    "tenant": ["tenant"],
+    "tenant_id": ["tenant"],
+    "platform": ["platform"],
+    "platform_id": ["platform"],
+    "rack_id": ["rack"],
+    "vrf_id": ["vrf"],
+    "family": ["family"],
+}
+
+
+def match_filters(obj, filters):
+    """
+    Check if an object sent by Netbox matches a list of filters (dict of filter: value)
+
+    Return True if all filters match, False if one of them doesn't match
+    and None if a filter can't be checked with the fields of the object
+    """
+
+    result = True
+
+    for key, expected in filters.items():
+        fields = [f for f in FILTER_FIELDS.get(key, []) if f in obj]
+
+        if not fields:
+            result = None
+            continue
+
+        if not match_value(obj[fields[0]], expected):
+            return False
+
+    return result
+
+
+def get_page(
+    req, url, params, offset, batch_size, secure=True, timeout=None, revalidate=False
+):
+    """
+    Fetch a single page of results from the Netbox API
+    """
+
+    paging_params = "offset=%s&limit=%s" % (offset, batch_size)
+    api_url_params = paging_params + "&" + params
+
+    return fetch_netbox(
+        req,
+        url,
+        api_url_params,
+        secure=secure,
+        timeout=timeout,
+        revalidate=revalidate,
+    )
+
+
+def get_keyset_page(
+    req, url, params, last_id, batch_size, secure=True, timeout=None, revalidate=False
+):
+    """
+    Fetch a single page of results from the Netbox API, ordered by id
+    and starting after last_id
+    """
+
+    paging_params = "ordering=id&limit=%s" % batch_size
+    if last_id is not None:
+        paging_params += "&id__gt=%s" % last_id
+
+    api_url_params = paging_params + "&" + params
+
+    return fetch_netbox(
+        req,
+        url,
+        api_url_params,
+        secure=secure,
+        timeout=timeout,
+        revalidate=revalidate,
+    )
+
+
+def iter_netbox_pages(
+    req,
+    url,
+    params,
+    secure=True,
+    batch_size=500,
+    concurrency=None,
+    timeout=None,
+    paging=None,
+    fields=None,
+    revalidate=False,
+):
+    """
+    Generator returning all pages of a query from the Netbox API, in order
+
+    2 paging modes are supported
+     - offset: The first page is used to find the total number of results,
+               the next pages are fetched in parallel but no more than concurrency pages
+               are fetched in advance, so the memory used is bounded by a few pages
+     - keyset: The results are ordered by id and each page starts after the last id
+               of the previous one, the pages are fetched one by one but
+               the database doesn't have to skip all previous rows for each page.
+               If the server doesn't honor the ordering or the id filter,
+               the query continues in offset mode
+
+    args
+        concurrency (int): max number of pages fetched in parallel, 1 to disable
+        timeout (int): timeout of each request in seconds
+        paging (str): offset or keyset
+        fields (list): only request these fields for each result, all fields if None
+        revalidate (bool): don't serve the pages from the cache without checking with Netbox
+    """
+
+    if paging is None:
+        paging = DEFAULT_PAGING
+
+    if fields:
+        params = add_fields(params, fields, paging)
+
+    if paging == "keyset":
+        return _iter_keyset_pages(
+            req, url, params, secure, batch_size, timeout, revalidate=revalidate
+        )
+    elif paging == "offset":
+        return _iter_offset_pages(
+            req,
+            url,
+            params,
+            secure,
+            batch_size,
+            concurrency,
+            timeout,
+            revalidate=revalidate,
+        )
+
+    raise Exception("paging %s is not supported" % paging)
+
+
+def _iter_offset_pages(
+    req,
+    url,
+    params,
+    secure,
+    batch_size,
+    concurrency,
+    timeout,
+    offset=0,
+    revalidate=False,
+):
+
+    if concurrency is None:
+        concurrency = DEFAULT_CONCURRENCY
+
+    resp_dict = get_page(
+        req,
+        url,
+        params,
+        offset,
+        batch_size,
+        secure=secure,
+        timeout=timeout,
+        revalidate=revalidate,
+    )
+
+    offsets = range(offset + batch_size, int(resp_dict["count"]), batch_size)
+
+    yield resp_dict
+
+    if not offsets:
+        return
+
+    logger.debug(
+        "iter_netbox_pages(), will fetch %s more pages from %s" % (len(offsets), url)
+    )
+
+    def fetch(offset):
+        return get_page(
+            req,
+            url,
+            params,
+            offset,
+            batch_size,
+            secure=secure,
+            timeout=timeout,
+            revalidate=revalidate,
+        )
+
+    if concurrency <= 1:
+        for offset in offsets:
+            yield fetch(offset)
+
+        return
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(offsets))) as executor:
+        offsets = iter(offsets)
+        pending = deque(executor.submit(fetch, o) for o in islice(offsets, concurrency))
+
+        ## Keep the pages in order, a new page is requested each time one is consumed
+        while pending:
+            resp_dict = pending.popleft().result()
+
+            for offset in islice(offsets, 1):
+                pending.append(executor.submit(fetch, offset))
+
+            yield resp_dict
+
+
+def _iter_keyset_pages(req, url, params, secure, batch_size, timeout, revalidate=False):
+
+    last_id = None
+    nbr_results = 0
+
+    while True:
+        resp_dict = get_keyset_page(
+            req,
+            url,
+            params,
+            last_id,
+            batch_size,
+            secure=secure,
+            timeout=timeout,
+            revalidate=revalidate,
+        )
+
+        ids = [record.get("id") for record in resp_dict["results"]]
+
+        ## Make sure the server honored the ordering and the id filter
+        ## if not, continue in offset mode, ordered by id, after the results already returned
+        if (
+            None in ids
+            or ids != sorted(set(ids))
+            or (ids and last_id is not None and ids[0] <= last_id)
+        ):
+            logger.warning(
+                "keyset paging is not supported for %s, will use offset paging" % url
+            )
+
+            for resp_dict in _iter_offset_pages(
+                req,
+                url,
+                "ordering=id&" + params,
+                secure,
+                batch_size,
+                1,
+                timeout,
+                offset=nbr_results,
+                revalidate=revalidate,
+            ):
+                yield resp_dict
+
+            return
+
+        yield resp_dict
+
+        nbr_results += len(ids)
+        if len(ids) < batch_size:
+            return
+
+        last_id = ids[-1]
+
+
+def iter_netbox(
+    req,
+    url,
+    params,
+    secure=True,
+    batch_size=500,
+    concurrency=None,
+    timeout=None,
+    paging=None,
+    fields=None,
+    revalidate=False,
+):
+    """
+    Generator returning all results of a query from the Netbox API one by one
+    Only the pages currently processed are kept in memory
+    """
+
+    for resp_dict in iter_netbox_pages(
+        req,
+        url,
+        params,
+        secure=secure,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        timeout=timeout,
+        paging=paging,
+        fields=fields,
+        revalidate=revalidate,
+    ):
+        for record in resp_dict["results"]:
+            yield record
+
+
+def query_netbox(
+    req,
+    url,
+    params,
+    secure=True,
+    batch_size=500,
+    concurrency=None,
+    timeout=None,
+    paging=None,
+    fields=None,
+    revalidate=False,
+):
+    """
+    Fetch all results of a query from the Netbox API
+
+    The first page is used to find the total number of results,
+    the remaining pages are then fetched in parallel and reassembled in order
+
+    args
+        concurrency (int): max number of pages fetched in parallel, 1 to disable
+        timeout (int): timeout of each request in seconds
+        paging (str): offset or keyset, see iter_netbox_pages
+        fields (list): only request these fields for each result, see iter_netbox_pages
+        revalidate (bool): see iter_netbox_pages
+    """
+
+    results = {"count": None, "results": []}
+
+    for resp_dict in iter_netbox_pages(
+        req,
+        url,
+        params,
+        secure=secure,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        timeout=timeout,
+        paging=paging,
+        fields=fields,
+        revalidate=revalidate,
+    ):
+        ## Use the count of the first page, in keyset mode the next ones only count the remaining results
+        if results["count"] is None:
+            results["count"] = resp_dict["count"]
 
-        # TODO check for response code
-        results["count"] = resp_dict["count"]
         results["results"].extend(resp_dict["results"])
 
-        offset += batch_size
-        if int(resp_dict["count"]) < offset:
-            keep_querying = False
+    return results
+
+
+def format_time(timestamp=None):
+    """
+    Return a timestamp (now by default) in UTC, in the format expected by the Netbox filters
+    """
+
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+def parse_time(value):
+    """
+    Convert a time returned by Netbox (2020-04-02T09:12:44.089271Z) into a timestamp
+    Return None if the time is not valid
+    """
+
+    match = NETBOX_TIME_RE.match(str(value or ""))
+    if not match:
+        return None
+
+    date, hour, fraction, offset = match.groups()
+
+    timestamp = calendar.timegm(time.strptime(date + "T" + hour, "%Y-%m-%dT%H:%M:%S"))
+    timestamp += float(fraction or 0)
+
+    if offset and offset != "Z":
+        sign = -1 if offset[0] == "-" else 1
+        offset = offset[1:].replace(":", "")
+        timestamp -= sign * (int(offset[:2]) * 3600 + int(offset[2:]) * 60)
+
+    return timestamp
+
+
+class SyncWatermark(object):
+    """
+    Time from which sync() requests the changes done in Netbox
+
+    It's the time of the newest change returned by Netbox (last_updated or time in the changelog)
+    minus a safety margin, so it doesn't depend on the local clock.
+    The local time of the start of the synchronization is used only until Netbox returns a time
+    """
+
+    def __init__(self, margin=SYNC_MARGIN):
+
+        self.margin = margin
+        self.latest = None
+        self.started_at = time.time()
+
+    def start(self):
+        """
+        Save the local time of the start of a synchronization
+        """
+        self.started_at = time.time()
+
+    def update(self, value):
+        """
+        Save the time of a change returned by Netbox if it's the newest one
+        """
+
+        timestamp = parse_time(value)
+
+        if timestamp is not None and (self.latest is None or timestamp > self.latest):
+            self.latest = timestamp
+
+        return timestamp
+
+    def since(self):
+        """
+        Return the time to use for the next synchronization, formatted with format_time
+        """
+
+        latest = self.latest if self.latest is not None else self.started_at
+
+        return format_time(latest - self.margin)
+
+
+def get_deleted_ids(req, netbox, object_type, since, secure=True, watermark=None):
+    """
+    Return the ids of the objects of a given type deleted since a given time
+    from the changelog of Netbox, the changelog is never served from the cache
+
+    args
+        netbox (str): Netbox Server Address
+        object_type (str): type of object in the changelog (ipam.ipaddress, dcim.device ...)
+        since (str): time formatted with format_time
+        watermark (SyncWatermark): updated with the time of the changes
+    """
+
+    url = netbox + "/api/extras/object-changes/"
+    params = "changed_object_type=%s&action=delete&time_after=%s" % (
+        object_type,
+        since,
+    )
+
+    changes = iter_netbox(
+        req=req,
+        url=url,
+        params=params,
+        secure=secure,
+        fields=["id", "changed_object_id", "time"],
+        revalidate=True,
+    )
+
+    deleted_ids = set()
+    for change in changes:
+        deleted_ids.add(change["changed_object_id"])
+
+        if watermark is not None:
+            watermark.update(change.get("time"))
+
+    return deleted_ids
+
+
+def warm_up_pools(load_pool, keys, workers=DEFAULT_WARM_UP_WORKERS):
+    """
+    Call load_pool for each key with a pool of threads, to create the pools in parallel
+
+    args
+        load_pool (func): function creating the pool for a key
+        keys (list): keys of the pools to create
+        workers (int): number of pools created at the same time
+
+    return a dict with the result of each key
+        loaded (bool), time (time to load the pool in sec), error (str or None)
+    """
+
+    def load(key):
+        start = time.time()
+        error = None
+
+        try:
+            load_pool(key)
+        except Exception as err:
+            logger.warn("Unable to load the pool %s > %s" % (key, err))
+            error = str(err)
+
+        return {"loaded": error is None, "time": time.time() - start, "error": error}
+
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+        results = dict(zip(keys, executor.map(load, keys)))
+
+    logger.debug(
+        "%s pool(s) loaded, %s failed"
+        % (
+            len([r for r in results.values() if r["loaded"]]),
+            len([r for r in results.values() if not r["loaded"]]),
+        )
+    )
 
     return results
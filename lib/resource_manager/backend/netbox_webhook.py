@@ -0,0 +1,170 @@
+import logging
+import hashlib
+import hmac
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger("resource-manager")
+
+## Object types of the models supported, for the payloads that only include the name of the model
+OBJECT_TYPES = {
+    "ipaddress": "ipam.ipaddress",
+    "prefix": "ipam.prefix",
+    "device": "dcim.device",
+}
+
+
+def get_object_type(payload):
+    """
+    Return the type of object of a webhook payload (ipam.ipaddress, dcim.device ...)
+    Netbox >= 4.0 provides object_type, older versions only provide the name of the model
+    """
+
+    if payload.get("object_type"):
+        return payload["object_type"]
+
+    return OBJECT_TYPES.get(payload.get("model"))
+
+
+def get_signature(secret, body):
+    """
+    Return the signature of a payload, as sent by Netbox in the X-Hook-Signature header
+    """
+
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha512).hexdigest()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class NetboxWebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+
+        receiver = self.server.receiver
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if receiver.secret:
+            signature = get_signature(receiver.secret, body)
+            if not hmac.compare_digest(
+                signature, self.headers.get("X-Hook-Signature", "")
+            ):
+                logger.warn("NetboxWebhookReceiver, invalid signature, IGNORING")
+                return self._send(403, {"error": "invalid signature"})
+
+        try:
+            payload = json.loads(body.decode("utf-8"))
+            nbr_applied = receiver.handle_payload(payload)
+        except (ValueError, KeyError, TypeError) as err:
+            logger.warn("NetboxWebhookReceiver, invalid payload > %s" % err)
+            return self._send(400, {"error": "invalid payload"})
+
+        return self._send(200, {"applied": nbr_applied})
+
+    def _send(self, code, data):
+
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("NetboxWebhookReceiver, %s" % (format % args))
+
+
+class NetboxWebhookReceiver(object):
+    """
+    Small HTTP server receiving the webhooks of Netbox
+    for ipam.ipaddress, ipam.prefix and dcim.device
+
+    Each event is passed to the apply_event() method of all targets (managers or pools),
+    the events are applied one at a time
+    """
+
+    def __init__(self, targets=None, address="127.0.0.1", port=0, secret=None):
+        """
+        Inputs:
+            targets: list of managers or pools with an apply_event() method
+            address: address to listen on
+            port: port to listen on, a free port is picked if 0
+            secret: secret configured on the webhook in Netbox, to verify the signature
+        """
+
+        self.targets = list(targets or [])
+        self.secret = secret
+        self.lock = threading.Lock()
+        self.thread = None
+
+        self.server = ThreadingHTTPServer((address, port), NetboxWebhookHandler)
+        self.server.receiver = self
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def url(self):
+        return "http://%s:%s/" % self.server.server_address[:2]
+
+    def add_target(self, target):
+        self.targets.append(target)
+
+    def handle_payload(self, payload):
+        """
+        Apply a webhook payload to all targets
+        Return the number of pools that applied the event
+        """
+
+        object_type = get_object_type(payload)
+        event = payload["event"]
+        data = payload["data"]
+
+        if object_type not in OBJECT_TYPES.values():
+            logger.debug(
+                "NetboxWebhookReceiver, %s not supported, IGNORING" % object_type
+            )
+            return 0
+
+        nbr_applied = 0
+        with self.lock:
+            for target in self.targets:
+                nbr_applied += int(target.apply_event(object_type, event, data))
+
+        logger.debug(
+            "NetboxWebhookReceiver, %s %s %s applied to %s pool(s)"
+            % (object_type, data.get("id"), event, nbr_applied)
+        )
+
+        return nbr_applied
+
+    def start(self):
+        """
+        Start the server in a background thread
+        """
+
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.1}
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+        return True
+
+    def stop(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+        return True
@@ -0,0 +1,205 @@
+import logging
+import threading
+import requests
+
+logger = logging.getLogger("resource-manager")
+
+
+class NetboxWriteItem(object):
+    """
+    Object to create or update in Netbox, with the callbacks to execute once it has been written
+    """
+
+    def __init__(self, path, data, method="POST", on_success=None, on_error=None):
+
+        self.path = path
+        self.data = data
+        self.method = method
+        self.on_success = on_success
+        self.on_error = on_error
+
+        self.result = None
+        self.error = None
+
+
+class NetboxWriteQueue(object):
+    """
+    Collect the allocations to write back to Netbox and send them in batches
+    using the bulk create (POST) and bulk update (PATCH) of the API,
+    a list of objects is sent in a single request
+
+    Netbox applies a bulk request in a single transaction,
+    if some objects are rejected, they are marked as conflicts
+    and the other objects of the batch are sent again without them.
+    If the request fails for another reason (connection error, server error ...),
+    the objects stay in the queue and are sent again by the next flush
+    """
+
+    def __init__(self, req, netbox, secure=True, batch_size=100, timeout=None):
+        """
+        Inputs:
+            req: requests session or NetboxClient
+            netbox: Netbox Server Address http:1.2.3.4:4851
+            batch_size: max number of objects per request
+            timeout: timeout of each request in seconds
+        """
+
+        self.nb = req
+        self.nb_addr = netbox
+        self.verify_certs = secure
+        self.batch_size = max(int(batch_size), 1)
+        self.timeout = timeout
+
+        ## The pools add objects from multiple threads while another one may flush the queue
+        self.lock = threading.Lock()
+        self.pending = []
+        self.conflicts = []
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, path, data, method="POST", on_success=None, on_error=None):
+        """
+        Add an object to create (POST) or to update (PATCH, data must include the id)
+
+        args
+            path (str): path of the API endpoint, /api/ipam/ip-addresses/ for example
+            on_success (func): called with the item once written, item.result is the object returned by Netbox
+            on_error (func): called with the item if it has been rejected, item.error is the reason
+        """
+
+        if method not in ["POST", "PATCH"]:
+            raise Exception("method %s is not supported" % method)
+
+        item = NetboxWriteItem(
+            path, data, method=method, on_success=on_success, on_error=on_error
+        )
+        with self.lock:
+            self.pending.append(item)
+
+        return item
+
+    def flush(self):
+        """
+        Send all pending objects to Netbox, grouped by endpoint and method
+
+        return a dict with the number of objects written and rejected,
+        the objects that couldn't be sent are not counted, they are still in the queue
+        """
+
+        ## The objects added during the flush are kept for the next one
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        groups = {}
+        for item in pending:
+            groups.setdefault((item.method, item.path), []).append(item)
+
+        nbr_written = 0
+        nbr_conflicts = 0
+        for (method, path), items in groups.items():
+            for i in range(0, len(items), self.batch_size):
+                batch = items[i : i + self.batch_size]
+
+                written, conflicts = self._send_batch(method, path, batch)
+                nbr_written += written
+                nbr_conflicts += conflicts
+
+        logger.debug(
+            "NetboxWriteQueue, %s object(s) written and %s conflict(s)"
+            % (nbr_written, nbr_conflicts)
+        )
+
+        return {"written": nbr_written, "conflicts": nbr_conflicts}
+
+    def _send_batch(self, method, path, items):
+        """
+        Send a batch of objects in one request
+        The objects rejected by Netbox are removed and the others are sent again
+
+        return a tuple with the number of objects written and rejected
+        """
+
+        url = self.nb_addr + path
+        nbr_conflicts = 0
+
+        while items:
+            try:
+                resp = self.nb.request(
+                    method,
+                    url,
+                    json=[item.data for item in items],
+                    verify=self.verify_certs,
+                    timeout=self.timeout,
+                )
+            except requests.exceptions.RequestException as err:
+                self._retry(items, str(err))
+                return 0, nbr_conflicts
+
+            if resp.ok:
+                results = resp.json()
+                if not isinstance(results, list):
+                    results = [results]
+
+                for item, result in zip(items, results):
+                    item.result = result
+                    if item.on_success:
+                        item.on_success(item)
+
+                return len(items), nbr_conflicts
+
+            ## In case of validation errors, Netbox returns one error per object,
+            ## empty for the valid objects
+            errors = None
+            if resp.status_code == 400:
+                try:
+                    errors = resp.json()
+                except ValueError:
+                    errors = None
+
+            ## Only the objects rejected individually are conflicts
+            if (
+                not isinstance(errors, list)
+                or len(errors) != len(items)
+                or not any(errors)
+            ):
+                self._retry(items, "%s %s" % (resp.status_code, resp.text))
+                return 0, nbr_conflicts
+
+            valid = []
+            for item, error in zip(items, errors):
+                if error:
+                    self._mark_conflicts([item], error)
+                    nbr_conflicts += 1
+                else:
+                    valid.append(item)
+
+            items = valid
+
+        return 0, nbr_conflicts
+
+    def _retry(self, items, error):
+        """
+        Put back the objects at the beginning of the queue, to send them again with the next flush
+        """
+
+        logger.warn(
+            "NetboxWriteQueue, unable to write %s object(s) on %s, will try again > %s"
+            % (len(items), items[0].path, error)
+        )
+
+        with self.lock:
+            self.pending[0:0] = items
+
+    def _mark_conflicts(self, items, error):
+
+        for item in items:
+            logger.warn(
+                "NetboxWriteQueue, unable to write %s on %s > %s"
+                % (item.data, item.path, error)
+            )
+            item.error = error
+            self.conflicts.append(item)
+
+            if item.on_error:
+                item.on_error(item)
@@ -0,0 +1,176 @@
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from resource_manager.backend.netbox_asn_manager import NetboxAsnManager
+from resource_manager.backend.netbox_net_manager import NetboxNetManager
+from resource_manager.backend.netbox_utils import DEFAULT_WARM_UP_WORKERS
+
+logger = logging.getLogger("resource-manager")
+
+
+class ResourceManager(object):
+    """
+    Single entry point to resolve variables of any type (ASN, NET4, NET6 ...)
+
+    Each request is dispatched to the manager registered for its type,
+    a manager must provide supported_types() and resolve(var_type, var_params, identifier)
+    """
+
+    def __init__(self, managers=None):
+        """
+        Inputs:
+            managers: list of managers to register
+        """
+
+        self.managers = OrderedDict()
+
+        for manager in managers or []:
+            self.register(manager)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a ResourceManager with the managers available for the configuration
+        """
+
+        managers = []
+
+        if "netbox" in config.keys():
+            managers.append(NetboxAsnManager(config=config))
+            managers.append(NetboxNetManager(config=config))
+
+        return cls(managers=managers)
+
+    def register(self, manager, types=None):
+        """
+        Register a manager for the types it supports, or only for the types provided
+
+        args
+            manager: manager with a resolve() method
+            types (list): types to register, all types in manager.supported_types() by default
+        """
+
+        if types is None:
+            types = manager.supported_types()
+
+        for var_type in types:
+            if var_type.upper() in self.managers:
+                raise Exception("A manager is already registered for %s" % var_type)
+
+            self.managers[var_type.upper()] = manager
+
+        return True
+
+    def supported_types(self):
+        return list(self.managers.keys())
+
+    def get_manager(self, var_type):
+        """
+        Return the manager registered for a type or None
+        """
+        return self.managers.get(var_type.upper())
+
+    def resolve(self, var_type, var_params, identifier=None):
+
+        manager = self.get_manager(var_type)
+
+        if manager is None:
+            logger.warn("type %s not supported by ResourceManager" % var_type)
+            return False
+
+        return manager.resolve(var_type, var_params, identifier=identifier)
+
+    def resolve_many(self, requests, workers=DEFAULT_WARM_UP_WORKERS):
+        """
+        Resolve multiple variables at once
+
+        The requests are grouped per pool (type and params) and the identical requests are resolved once,
+        the groups are resolved in parallel so the pools needed are loaded concurrently
+        A request without identifier always gets a new resource, like with resolve()
+
+        args
+            requests (list): list of tuple (var_type, var_params, identifier)
+            workers (int): number of groups resolved at the same time
+
+        return a list with the result of each request, in the same order
+        """
+
+        groups = OrderedDict()
+        positions = []
+
+        for request in requests:
+            var_type, var_params, identifier = (tuple(request) + (None,))[:3]
+
+            group = groups.setdefault(
+                (var_type.upper(), var_params), {"identifiers": [], "index": {}}
+            )
+
+            if identifier is not None and identifier in group["index"]:
+                idx = group["index"][identifier]
+            else:
+                idx = len(group["identifiers"])
+                group["identifiers"].append(identifier)
+
+                if identifier is not None:
+                    group["index"][identifier] = idx
+
+            positions.append(((var_type.upper(), var_params), idx))
+
+        logger.debug(
+            "resolve_many(), %s request(s) in %s group(s)"
+            % (len(positions), len(groups))
+        )
+
+        def resolve_group(key):
+            var_type, var_params = key
+            identifiers = groups[key]["identifiers"]
+
+            manager = self.get_manager(var_type)
+
+            if manager is None:
+                logger.warn("type %s not supported by ResourceManager" % var_type)
+                return [False] * len(identifiers)
+
+            try:
+                if hasattr(manager, "resolve_many"):
+                    return manager.resolve_many(var_type, var_params, identifiers)
+
+                return [
+                    manager.resolve(var_type, var_params, identifier=identifier)
+                    for identifier in identifiers
+                ]
+
+            except Exception as err:
+                logger.warn(
+                    "Something went wrong while resolving %s %s > %s"
+                    % (var_type, var_params, err)
+                )
+                return [False] * len(identifiers)
+
+        keys = list(groups.keys())
+        if not keys:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+            results = dict(zip(keys, executor.map(resolve_group, keys)))
+
+        return [results[key][idx] for key, idx in positions]
+
+    def flush(self):
+        """
+        Save the allocations in the backends of all managers with a write back
+
+        return a dict with the number of objects written and rejected
+        """
+
+        total = {"written": 0, "conflicts": 0}
+
+        for manager in set(self.managers.values()):
+            if not hasattr(manager, "flush"):
+                continue
+
+            for key, value in manager.flush().items():
+                total[key] = total.get(key, 0) + value
+
+        return total
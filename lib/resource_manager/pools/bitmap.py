@@ -0,0 +1,143 @@
+from array import array
+from collections import defaultdict
+
+WORD_SIZE = 64
+WORD_FULL = (1 << WORD_SIZE) - 1
+
+
+class Bitmap(object):
+    """
+    Fixed size bitmap stored in an array of 64 bits words
+    A bit set to 1 indicates that the position is used
+
+    To find the next available position, full words are skipped entirely
+    and the first zero of a word is found with integer bit operations.
+    """
+
+    def __init__(self, size):
+
+        self.size = int(size)
+        self.words = array("Q", bytes(8 * ((self.size + WORD_SIZE - 1) // WORD_SIZE)))
+        self.nbr_set = 0
+
+        ## Index of the first word that may still have a bit available
+        self.hint = 0
+
+        ## Lowest start used to search, the bits before it are ignored to move the hint
+        self.floor = None
+
+    def test(self, idx):
+        """
+        Return True if the bit at this position is set
+        """
+        return bool(self.words[idx // WORD_SIZE] >> (idx % WORD_SIZE) & 1)
+
+    def set(self, idx):
+        """
+        Set the bit at this position
+        Return False if the bit was already set
+        """
+        word_idx = idx // WORD_SIZE
+        mask = 1 << (idx % WORD_SIZE)
+
+        if self.words[word_idx] & mask:
+            return False
+
+        self.words[word_idx] |= mask
+        self.nbr_set += 1
+        return True
+
+    def set_many(self, indexes):
+        """
+        Set multiple bits at once, each word is updated only once
+        Return the number of bits that were not already set
+        """
+        masks = defaultdict(int)
+        for idx in indexes:
+            masks[idx // WORD_SIZE] |= 1 << (idx % WORD_SIZE)
+
+        nbr_new = 0
+        for word_idx, mask in masks.items():
+            nbr_new += bin(mask & ~self.words[word_idx]).count("1")
+            self.words[word_idx] |= mask
+
+        self.nbr_set += nbr_new
+        return nbr_new
+
+    def clear(self, idx):
+        """
+        Clear the bit at this position
+        Return False if the bit was not set
+        """
+        word_idx = idx // WORD_SIZE
+        mask = 1 << (idx % WORD_SIZE)
+
+        if not self.words[word_idx] & mask:
+            return False
+
+        self.words[word_idx] &= ~mask & WORD_FULL
+        self.nbr_set -= 1
+
+        if word_idx < self.hint:
+            self.hint = word_idx
+
+        return True
+
+    def find_first_zero(self, start=0, end=None):
+        """
+        Return the position of the first bit not set in [start, end)
+        Return None if all bits are set
+        """
+
+        if end is None or end > self.size:
+            end = self.size
+
+        if self.floor is None or start < self.floor:
+            self.floor = start
+            self.hint = min(self.hint, start // WORD_SIZE)
+
+        ## All words before the hint are full, start directly from it if possible
+        from_hint = start // WORD_SIZE <= self.hint
+        if from_hint:
+            start = max(start, self.hint * WORD_SIZE)
+
+        word_idx = start // WORD_SIZE
+        if word_idx >= len(self.words) or start >= end:
+            return None
+
+        ## Ignore the bits located before start in the first word
+        word = self.words[word_idx] | ((1 << (start % WORD_SIZE)) - 1)
+
+        while word == WORD_FULL:
+            ## The hint only moves past the words full from the floor,
+            ## not the ones that look full because of the bits before start
+            if from_hint and self._is_full(word_idx):
+                self.hint = word_idx + 1
+            else:
+                from_hint = False
+
+            word_idx += 1
+
+            if word_idx >= len(self.words) or word_idx * WORD_SIZE >= end:
+                return None
+
+            word = self.words[word_idx]
+
+        ## Isolate the lowest bit not set
+        idx = word_idx * WORD_SIZE + (~word & (word + 1)).bit_length() - 1
+
+        if idx >= end:
+            return None
+
+        return idx
+
+    def _is_full(self, word_idx):
+        """
+        Return True if all bits of a word located after the floor are set
+        """
+        word = self.words[word_idx]
+
+        if word_idx == self.floor // WORD_SIZE:
+            word |= (1 << (self.floor % WORD_SIZE)) - 1
+
+        return word == WORD_FULL
@@ -0,0 +1,177 @@
+import heapq
+from collections import defaultdict
+
+
+class BuddyAllocator(object):
+    """
+    Manage the free blocks of a network with a buddy system
+
+    Each free block is identified by its network address as an integer and its prefix length.
+    The free blocks are stored in a set per prefix length,
+    a heap per prefix length is used to find the lowest free block quickly.
+    The heaps are cleaned up lazily, the sets are the reference:
+    the stale entries are popped once they reach the top of the heap
+    and the heap is rebuilt once they outnumber the free blocks.
+    """
+
+    def __init__(self, min_prefixlen, max_prefixlen):
+        """
+        args
+            min_prefixlen (int): prefix length of the biggest free block
+            max_prefixlen (int): 32 for IPv4 and 128 for IPv6
+        """
+
+        self.min_prefixlen = min_prefixlen
+        self.max_prefixlen = max_prefixlen
+
+        self.free = defaultdict(set)
+        self.heaps = defaultdict(list)
+
+        ## Addresses present in each heap, including the stale ones
+        self.queued = defaultdict(set)
+
+    def block_size(self, prefixlen):
+        """
+        Return the number of addresses in a block of this prefix length
+        """
+        return 1 << (self.max_prefixlen - prefixlen)
+
+    def get_supernet(self, address, prefixlen):
+        """
+        Return the network address of the block of this prefix length that contains address
+        """
+        return address & ~(self.block_size(prefixlen) - 1)
+
+    def get_buddy(self, address, prefixlen):
+        """
+        Return the network address of the other half of the parent block
+        """
+        return address ^ self.block_size(prefixlen)
+
+    def contains(self, address, prefixlen):
+        return address in self.free[prefixlen]
+
+    def count(self, prefixlen):
+        return len(self.free[prefixlen])
+
+    def add(self, address, prefixlen):
+        """
+        Add a block into the list of free blocks
+        """
+        if address in self.free[prefixlen]:
+            return False
+
+        self.free[prefixlen].add(address)
+
+        ## A stale entry is valid again, no need to push the address a second time
+        if address not in self.queued[prefixlen]:
+            self.queued[prefixlen].add(address)
+            heapq.heappush(self.heaps[prefixlen], address)
+
+        return True
+
+    def remove(self, address, prefixlen):
+        """
+        Remove a block from the list of free blocks
+        """
+        if address not in self.free[prefixlen]:
+            return False
+
+        self.free[prefixlen].remove(address)
+        self._cleanup(prefixlen)
+        return True
+
+    def lowest(self, prefixlen):
+        """
+        Return the network address of the lowest free block of this prefix length
+        Return None if no block of this size is available
+        """
+        heap = self.heaps[prefixlen]
+
+        ## The top of the heap is never stale, see _cleanup
+        if not heap:
+            return None
+
+        return heap[0]
+
+    def _cleanup(self, prefixlen):
+        """
+        Pop the stale entries from the top of the heap
+        and rebuild the heap once the stale entries outnumber the free blocks
+        """
+        free = self.free[prefixlen]
+        heap = self.heaps[prefixlen]
+        queued = self.queued[prefixlen]
+
+        while heap and heap[0] not in free:
+            queued.discard(heapq.heappop(heap))
+
+        if len(heap) > 2 * len(free):
+            ## A sorted list is a valid heap
+            heap[:] = sorted(free)
+            queued.clear()
+            queued.update(free)
+
+    def find_free_supernet(self, address, prefixlen):
+        """
+        Return the closest free block that contains the block provided
+        as a tuple (address, prefixlen) or None if there is none
+        """
+        for length in range(prefixlen - 1, self.min_prefixlen - 1, -1):
+            supernet = self.get_supernet(address, length)
+            if supernet in self.free[length]:
+                return (supernet, length)
+
+        return None
+
+    def split(self, address, prefixlen, target, target_prefixlen):
+        """
+        Split a free block until a free block of target_prefixlen is available for target
+        The other half of each level is added to the list of free blocks
+        """
+        self.remove(address, prefixlen)
+
+        for length in range(prefixlen + 1, target_prefixlen + 1):
+            block = self.get_supernet(target, length)
+            self.add(self.get_buddy(block, length), length)
+
+        self.add(target, target_prefixlen)
+        return True
+
+    def release(self, address, prefixlen):
+        """
+        Give a block back to the list of free blocks
+        The block is merged with its buddy as long as the buddy is free as well
+        Return the (address, prefixlen) of the resulting free block
+        """
+        while prefixlen > self.min_prefixlen:
+            buddy = self.get_buddy(address, prefixlen)
+
+            if not self.remove(buddy, prefixlen):
+                break
+
+            prefixlen -= 1
+            address = self.get_supernet(address, prefixlen)
+
+        self.add(address, prefixlen)
+        return (address, prefixlen)
+
+    def allocate(self, prefixlen):
+        """
+        Find the lowest free block of this prefix length, splitting a bigger one if needed
+        The block is removed from the list of free blocks and its address is returned
+        Return None if no block can be allocated
+        """
+        for length in range(prefixlen, self.min_prefixlen - 1, -1):
+            address = self.lowest(length)
+
+            if address is None:
+                continue
+
+            if length != prefixlen:
+                self.split(address, length, address, prefixlen)
+
+            self.remove(address, prefixlen)
+            return address
+
+        return None
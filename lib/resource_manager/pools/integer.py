@@ -3,6 +3,8 @@ import os
 import inspect
 from collections import defaultdict
 
+from resource_manager.pools.intervals import IntervalSet
+
 logger = logging.getLogger("resource_manager")
 
 
@@ -21,7 +23,10 @@ class IntegerPool(object):
         self.range_end = int(end)
         self.nbr_integer = self.range_end - self.range_start
         self.nbr_available = self.nbr_integer
-        self.padding = "{:0%s}" % len(str(self.nbr_integer))
+
+        ## Free integers are tracked as a sorted set of intervals
+        ## Reserved integers are stored in a dict using their native value as the key
+        self.free = IntervalSet(self.range_start, self.range_end)
 
         self.int_by_key = {}
         self.int_by_id = {}
@@ -36,38 +41,19 @@ class IntegerPool(object):
         else:
             logger.setLevel(logging.INFO)
 
-    def _get_key(self, integer):
-        """
-        Return the internal id of an integer
-        Integer are stored in a dict with a padding system
-
-        The padding system allow to manage large pool without pre-allocation all values
-        """
-
-        clean_int = int(integer)
-        int_diff = clean_int - self.range_start
-        return self.padding.format(int_diff)
-
-    def _get_value(self, key):
-        """
-        Return the value of an integer from its internal key
-        Integer are stored in a dict with a padding system
-        """
-        return int(key) + self.range_start
-
     def reserve(self, integer, identifier=None):
         """
         Reserve an integer from the Pool
         Optionally, indicate an identifier for this integer to be able to retrieve it later
         """
 
-        if int(integer) < self.range_start and int(integer) > self.range_end:
+        int_key = int(integer)
+
+        if int_key < self.range_start or int_key >= self.range_end:
             # the integer is NOT part of the range
             return False
 
-        int_key = self._get_key(integer)
-
-        if int_key in self.int_by_key.keys():
+        if int_key in self.int_by_key:
 
             # If integer is already reserved, check the owner
             if self.int_by_key[int_key] == identifier:
@@ -75,14 +61,7 @@ class IntegerPool(object):
             else:
                 return False
 
-        if identifier:
-            self.int_by_key[int_key] = identifier
-            self.int_by_id[identifier] = int_key
-            self.nbr_available -= 1
-
-        else:
-            self.int_by_key[int_key] = True
-            self.nbr_available -= 1
+        self._allocate(int_key, identifier)
 
         return True
 
@@ -95,23 +74,96 @@ class IntegerPool(object):
         """
 
         if identifier:
-            if identifier in self.int_by_id.keys():
-                return self._get_value(self.int_by_id[identifier])
+            if identifier in self.int_by_id:
+                return self.int_by_id[identifier]
+
+        int_key = self.free.first()
+
+        if int_key is None:
+            # No more integer available
+            return None
 
-        for id in range(0, self.nbr_integer):
-            id2str = self.padding.format(id)
+        self._allocate(int_key, identifier)
 
-            if id2str in self.int_by_key.keys():
+        return int_key
+
+    def get_many(self, identifiers):
+        """
+        Get an integer for each identifier in a single pass
+        Identifiers that already have an integer associated get the same one back,
+        the others get the next available integers in order
+
+        Return a dict identifier > integer (None if the pool is full)
+        """
+
+        result = {}
+
+        for identifier in identifiers:
+            if identifier in result:
                 continue
 
-            # if this id is available, reserve it
-            if identifier:
-                self.int_by_key[id2str] = identifier
-                self.int_by_id[identifier] = id2str
-                self.nbr_available -= 1
-                return self._get_value(id2str)
+            result[identifier] = self.get(identifier=identifier)
 
-            else:
-                self.int_by_key[id2str] = True
-                self.nbr_available -= 1
-                return self._get_value(id2str)
+        return result
+
+    def reserve_many(self, items):
+        """
+        Reserve multiple integers from the Pool
+        items is a list of tuple (integer, identifier), identifier can be None
+
+        Return a list of True/False, in the same order as items
+        """
+
+        return [
+            self.reserve(integer, identifier=identifier)
+            for integer, identifier in items
+        ]
+
+    def release(self, integer=None, identifier=None):
+        """
+        Release an integer previously reserved, either by integer or by identifier
+
+        return True/False
+        """
+
+        if identifier:
+            if identifier not in self.int_by_id:
+                logger.debug("No reservation found for identifier %s" % identifier)
+                return False
+
+            int_key = self.int_by_id[identifier]
+
+        elif integer is not None:
+            int_key = int(integer)
+
+        else:
+            return False
+
+        if int_key not in self.int_by_key:
+            logger.debug("%s is not reserved, nothing to release" % int_key)
+            return False
+
+        owner = self.int_by_key.pop(int_key)
+        if owner is not True:
+            del self.int_by_id[owner]
+
+        self.free.add(int_key, int_key + 1)
+
+        self.nbr_available += 1
+
+        return True
+
+    def _allocate(self, int_key, identifier=None):
+        """
+        Mark an integer as reserved and remove it from the free intervals
+        """
+
+        self.free.remove(int_key)
+
+        if identifier:
+            self.int_by_key[int_key] = identifier
+            self.int_by_id[identifier] = int_key
+        else:
+            self.int_by_key[int_key] = True
+
+        self.nbr_available -= 1
@@ -0,0 +1,288 @@
+from bisect import bisect_right
+
+## Maximum number of fragments per chunk before it gets split in two
+CHUNK_SIZE = 512
+
+
+class IntervalSet(object):
+    """
+    Sorted set of integers stored as disjoint half-open intervals [start, end)
+
+    Memory is proportional to the number of fragments, not to the number of integers,
+    which makes it possible to track the free space of very large ranges.
+    Fragments are kept in sorted chunks of at most 2 * CHUNK_SIZE entries,
+    with the first start of each chunk in a separate index,
+    so a lookup is two binary searches and an insert or a delete only shifts one chunk.
+    """
+
+    def __init__(self, start=None, end=None):
+
+        self.chunk_starts = []
+        self.chunk_ends = []
+        self.mins = []
+        self.nbr_fragments = 0
+
+        if start is not None and end is not None:
+            self.add(start, end)
+
+    def __len__(self):
+        """
+        Return the number of fragments
+        """
+        return self.nbr_fragments
+
+    def __contains__(self, value):
+
+        chunk, idx = self._locate(value)
+        return idx >= 0 and value < self.chunk_ends[chunk][idx]
+
+    def __iter__(self):
+        """
+        Iterate over all fragments as (start, end) tuples
+        """
+        fragments = []
+        for starts, ends in zip(self.chunk_starts, self.chunk_ends):
+            fragments.extend(zip(starts, ends))
+
+        return iter(fragments)
+
+    def size(self):
+        """
+        Return the number of integers in the set
+        """
+        return sum(
+            sum(ends) - sum(starts)
+            for starts, ends in zip(self.chunk_starts, self.chunk_ends)
+        )
+
+    def first(self):
+        """
+        Return the smallest integer of the set or None if the set is empty
+        """
+        if not self.mins:
+            return None
+
+        return self.mins[0]
+
+    def add(self, start, end):
+        """
+        Add all integers in [start, end) to the set, merging adjacent fragments
+        """
+
+        if start >= end:
+            return False
+
+        ## Extend the left neighbour if it overlaps or touches the new interval
+        chunk, idx = self._locate(start)
+        if idx >= 0 and self.chunk_ends[chunk][idx] >= start:
+            start = self.chunk_starts[chunk][idx]
+            end = max(end, self.chunk_ends[chunk][idx])
+            self._pop(chunk, idx)
+
+        ## Absorb all fragments that start inside the new interval
+        while True:
+            chunk, idx = self._locate(end)
+            if idx < 0 or self.chunk_starts[chunk][idx] < start:
+                break
+
+            end = max(end, self.chunk_ends[chunk][idx])
+            self._pop(chunk, idx)
+
+        self._insert(start, end)
+
+        return True
+
+    def remove(self, value):
+        """
+        Remove a single integer from the set
+        Return False if the integer was not part of the set
+        """
+
+        chunk, idx = self._locate(value)
+        if idx < 0:
+            return False
+
+        starts = self.chunk_starts[chunk]
+        ends = self.chunk_ends[chunk]
+
+        start = starts[idx]
+        end = ends[idx]
+
+        if value >= end:
+            return False
+
+        if start == value and end == value + 1:
+            self._pop(chunk, idx)
+        elif start == value:
+            starts[idx] = value + 1
+            if idx == 0:
+                self.mins[chunk] = value + 1
+        elif end == value + 1:
+            ends[idx] = value
+        else:
+            ends[idx] = value
+            starts.insert(idx + 1, value + 1)
+            ends.insert(idx + 1, end)
+            self.nbr_fragments += 1
+            self._split(chunk)
+
+        return True
+
+    def remove_range(self, start, end):
+        """
+        Remove all integers in [start, end) from the set
+        Return the number of integers that were part of the set
+        """
+
+        removed = 0
+
+        if start >= end:
+            return removed
+
+        ## Cut the fragment that overlaps the start of the range
+        chunk, idx = self._locate(start)
+        if idx >= 0 and self.chunk_ends[chunk][idx] > start:
+            frag_start = self.chunk_starts[chunk][idx]
+            frag_end = self.chunk_ends[chunk][idx]
+
+            if frag_end <= end and frag_start < start:
+                ## Most common case, shrink the fragment in place
+                self.chunk_ends[chunk][idx] = start
+                removed += frag_end - start
+            else:
+                self._pop(chunk, idx)
+                if frag_start < start:
+                    self._insert(frag_start, start)
+                if frag_end > end:
+                    self._insert(end, frag_end)
+                removed += min(frag_end, end) - start
+
+        ## Drop or cut all fragments that start inside the range
+        while True:
+            chunk, idx = self._locate(end - 1)
+            if idx < 0 or self.chunk_starts[chunk][idx] < start:
+                break
+
+            frag_start = self.chunk_starts[chunk][idx]
+            frag_end = self.chunk_ends[chunk][idx]
+
+            if frag_end > end:
+                self.chunk_starts[chunk][idx] = end
+                if idx == 0:
+                    self.mins[chunk] = end
+            else:
+                self._pop(chunk, idx)
+
+            removed += min(frag_end, end) - frag_start
+
+        return removed
+
+    def remove_many(self, values):
+        """
+        Remove multiple integers from the set in a single pass
+        Consecutive integers are removed as one range
+
+        Return the number of integers that were part of the set
+        """
+
+        removed = 0
+        run_start = None
+        run_end = None
+
+        for value in sorted(set(values)):
+            if value == run_end:
+                run_end += 1
+                continue
+
+            if run_start is not None:
+                removed += self.remove_range(run_start, run_end)
+
+            run_start = value
+            run_end = value + 1
+
+        if run_start is not None:
+            removed += self.remove_range(run_start, run_end)
+
+        return removed
+
+    def _locate(self, value):
+        """
+        Find the last fragment starting at or before value
+        Return a tuple (chunk, idx), idx is -1 if there is none
+        """
+
+        chunk = bisect_right(self.mins, value) - 1
+
+        if chunk < 0:
+            return 0, -1
+
+        return chunk, bisect_right(self.chunk_starts[chunk], value) - 1
+
+    def _insert(self, start, end):
+        """
+        Insert a new fragment, it must not overlap any existing fragment
+        """
+
+        self.nbr_fragments += 1
+
+        if not self.mins:
+            self.chunk_starts.append([start])
+            self.chunk_ends.append([end])
+            self.mins.append(start)
+            return
+
+        chunk = max(bisect_right(self.mins, start) - 1, 0)
+        starts = self.chunk_starts[chunk]
+        ends = self.chunk_ends[chunk]
+
+        idx = bisect_right(starts, start)
+        starts.insert(idx, start)
+        ends.insert(idx, end)
+        self.mins[chunk] = starts[0]
+
+        self._split(chunk)
+
+    def _pop(self, chunk, idx):
+        """
+        Delete a fragment, merging its chunk with the next one once it gets too small
+        """
+
+        self.nbr_fragments -= 1
+
+        starts = self.chunk_starts[chunk]
+        ends = self.chunk_ends[chunk]
+
+        del starts[idx]
+        del ends[idx]
+
+        if not starts:
+            del self.chunk_starts[chunk]
+            del self.chunk_ends[chunk]
+            del self.mins[chunk]
+            return
+
+        self.mins[chunk] = starts[0]
+
+        if len(starts) < CHUNK_SIZE // 2 and chunk + 1 < len(self.mins):
+            starts.extend(self.chunk_starts.pop(chunk + 1))
+            ends.extend(self.chunk_ends.pop(chunk + 1))
+            del self.mins[chunk + 1]
+
+            self._split(chunk)
+
+    def _split(self, chunk):
+        """
+        Split a chunk in two halves once it gets too big
+        """
+
+        starts = self.chunk_starts[chunk]
+        ends = self.chunk_ends[chunk]
+
+        if len(starts) <= 2 * CHUNK_SIZE:
+            return
+
+        self.chunk_starts.insert(chunk + 1, starts[CHUNK_SIZE:])
+        self.chunk_ends.insert(chunk + 1, ends[CHUNK_SIZE:])
+        self.mins.insert(chunk + 1, starts[CHUNK_SIZE])
+        del starts[CHUNK_SIZE:]
+        del ends[CHUNK_SIZE:]
@@ -2,12 +2,17 @@ import ipaddress
 import logging
 from collections import defaultdict, OrderedDict
 
+from resource_manager.pools.buddy import BuddyAllocator
+
 logger = logging.getLogger("resource-manager")
 
 
 class PrefixesPool(object):
     """
     Class to automatically manage Prefixes and help to carve out sub-prefixes
+
+    The available subnets are managed with a buddy allocator,
+    each available subnet is stored as an integer in a set per prefix length
     """
 
     def __init__(self, network):
@@ -21,13 +26,138 @@ class PrefixesPool(object):
         else:
             self.mask_smallest = 128
 
-        self.available_subnets = defaultdict(list)
+        self.buddy = BuddyAllocator(self.mask_biggest, self.mask_smallest)
         self.sub_by_key = OrderedDict()
         self.sub_by_id = OrderedDict()
 
         ## Save the top level available subnet
-        for subnet in list(self.network.subnets(new_prefix=self.mask_biggest)):
-            self.available_subnets[self.mask_biggest].append(str(subnet))
+        nwk_int = int(self.network.network_address)
+        self.buddy.add(nwk_int, self.mask_biggest)
+        self.buddy.add(
+            self.buddy.get_buddy(nwk_int, self.mask_biggest), self.mask_biggest
+        )
+
+    @classmethod
+    def from_reservations(cls, network, reservations):
+        """
+        Create a PrefixesPool from a list of existing reservations in one pass
+
+        The reservations are sorted once and the list of available subnets is computed
+        from the space between them, instead of splitting the supernets for each reservation.
+        Subnets already covered by a previous reservation and duplicate identifiers are skipped
+
+        args
+            network (str)
+            reservations (list): list of tuple (subnet, identifier), identifier can be None
+        """
+
+        pool = cls(network)
+        pool.buddy = BuddyAllocator(pool.mask_biggest, pool.mask_smallest)
+
+        nwk_start = int(pool.network.network_address)
+        nwk_end = nwk_start + pool.network.num_addresses
+
+        subnets = []
+        for subnet, identifier in reservations:
+            sub = ipaddress.ip_network(subnet)
+
+            if sub.version != pool.network.version:
+                logger.debug("%s is not part of this network, SKIPPING" % (subnet))
+                continue
+            elif int(sub.prefixlen) <= int(pool.network.prefixlen):
+                logger.debug(
+                    "%s do not have the right size (%s,%s), SKIPPING"
+                    % (subnet, sub.prefixlen, pool.network.prefixlen)
+                )
+                continue
+
+            sub_int = int(sub.network_address)
+            if sub_int < nwk_start or sub_int >= nwk_end:
+                logger.debug("%s is not part of this network, SKIPPING" % (subnet))
+                continue
+
+            subnets.append((sub_int, sub.prefixlen, str(sub), identifier))
+
+        ## Sort by address and size, a subnet always comes after the subnets containing it
+        subnets.sort(key=lambda item: (item[0], item[1]))
+
+        cursor = nwk_start
+        for sub_int, prefixlen, sub, identifier in subnets:
+
+            if sub_int < cursor:
+                if sub in pool.sub_by_key.keys() and not identifier:
+                    continue
+
+                logger.warn(
+                    "%s (id=%s) overlaps with an existing reservation, SKIPPING"
+                    % (sub, identifier)
+                )
+                continue
+
+            if identifier and identifier in pool.sub_by_id.keys():
+                logger.warn(
+                    "this identifier (%s) is already used but for a different resource (%s)"
+                    % (identifier, pool.sub_by_id[identifier])
+                )
+                continue
+
+            pool._add_available_range(cursor, sub_int)
+
+            if identifier:
+                pool.sub_by_id[identifier] = sub
+                pool.sub_by_key[sub] = identifier
+            else:
+                pool.sub_by_key[sub] = None
+
+            cursor = sub_int + pool.buddy.block_size(prefixlen)
+
+        pool._add_available_range(cursor, nwk_end)
+
+        return pool
+
+    def _add_available_range(self, start, end):
+        """
+        Add all addresses between start and end into the list of available subnets
+        using the biggest subnets possible
+
+        args
+            start (int)
+            end (int)
+        """
+        while start < end:
+
+            ## Find the biggest subnet aligned on start that fits before end
+            prefixlen = self.mask_biggest
+            while (
+                start & (self.buddy.block_size(prefixlen) - 1)
+                or start + self.buddy.block_size(prefixlen) > end
+            ):
+                prefixlen += 1
+
+            self.buddy.add(start, prefixlen)
+            start += self.buddy.block_size(prefixlen)
+
+        return True
+
+    @property
+    def available_subnets(self):
+        """
+        Return the list of available subnets per prefix length, sorted by address
+
+        Only meant for inspection, the list is rebuilt from the buddy allocator at each call
+        """
+        tmp = defaultdict(list)
+        for i in range(self.mask_biggest, self.mask_smallest + 1):
+            for address in sorted(self.buddy.free[i]):
+                tmp[i].append(str(self._get_network(address, i)))
+
+        return tmp
+
+    def _get_network(self, address, prefixlen):
+        """
+        Return an ipaddress.ip_network object from a network address as an integer
+        """
+        return ipaddress.ip_network((address, prefixlen))
 
     def reserve(self, subnet, identifier=None):
         """
@@ -80,12 +210,13 @@ class PrefixesPool(object):
 
         ## Check if the subnet itself is available
         ## if available reserve and return
-        if subnet in self.available_subnets[sub.prefixlen]:
+        sub_int = int(sub.network_address)
+        if self.buddy.contains(sub_int, sub.prefixlen):
             if identifier:
-                self.sub_by_id[identifier] = subnet
-                self.sub_by_key[subnet] = identifier
+                self.sub_by_id[identifier] = str(sub)
+                self.sub_by_key[str(sub)] = identifier
             else:
-                self.sub_by_key[subnet] = None
+                self.sub_by_key[str(sub)] = None
 
             self.remove_subnet_from_available_list(sub)
             return True
@@ -99,12 +230,14 @@ class PrefixesPool(object):
         ## start at sublen and check all available subnet
         ### increase 1 by 1 until we find the closer supernet available
         ### break it down and keep track of the other available subnets
+        supernet = self.buddy.find_free_supernet(sub_int, sub.prefixlen)
+
+        if not supernet:
+            logger.debug("%s is not available, SKIPPING" % (subnet))
+            return False
 
-        for sublen in range(sub.prefixlen - 1, self.network.prefixlen, -1):
-            supernet = sub.supernet(new_prefix=sublen)
-            if str(supernet) in self.available_subnets[sublen]:
-                self.split_supernet(supernet, sub)
-                return self.reserve(subnet, identifier=identifier)
+        self.buddy.split(supernet[0], supernet[1], sub_int, sub.prefixlen)
+        return self.reserve(subnet, identifier=identifier)
 
     def get(self, size, identifier=None):
         """
@@ -122,35 +255,64 @@ class PrefixesPool(object):
                 return False
 
         logger.debug("Nothing found, will allocate a new /%s Subnet" % clean_size)
-        if len(self.available_subnets[clean_size]) != 0:
-            sub = self.available_subnets[clean_size][0]
-            self.reserve(subnet=sub, identifier=identifier)
-            return ipaddress.ip_network(sub)
-
-        logger.debug("No /%s available, will create one" % clean_size)
-        ## if a subnet of this size is not available
-        ## we need to find the closest subnet available and split it
-        for i in range(clean_size - 1, self.mask_biggest - 1, -1):
-
-            if len(self.available_subnets[i]) != 0:
-                supernet = ipaddress.ip_network(self.available_subnets[i][0])
-                logger.debug("%s available, will split it" % str(supernet))
-                subs = supernet.subnets(new_prefix=clean_size)
-                sub = next(subs)
-                self.split_supernet(supernet, sub)
-                self.reserve(subnet=str(sub), identifier=identifier)
-                return sub
-            else:
-                logger.debug("No /%s available, will continue searching" % i)
 
-        # No more subnet available
-        return False
+        ## Pick the lowest available subnet of this size
+        ## if none is available, the closest bigger subnet available will be split
+        sub_int = self.buddy.allocate(clean_size)
+
+        if sub_int is None:
+            # No more subnet available
+            return False
+
+        sub = self._get_network(sub_int, clean_size)
+
+        if identifier:
+            self.sub_by_id[identifier] = str(sub)
+            self.sub_by_key[str(sub)] = identifier
+        else:
+            self.sub_by_key[str(sub)] = None
+
+        return sub
+
+    def release(self, subnet=None, identifier=None):
+        """
+        Release a subnet previously reserved, either by subnet or by identifier
+        The subnet is merged back with its neighbors to rebuild the biggest subnet possible
+
+        return True/False
+        """
+
+        if identifier:
+            if identifier not in self.sub_by_id.keys():
+                logger.debug("No reservation found for identifier %s" % identifier)
+                return False
+
+            sub = ipaddress.ip_network(self.sub_by_id[identifier])
+
+        elif subnet:
+            sub = ipaddress.ip_network(subnet)
+
+        else:
+            return False
+
+        if str(sub) not in self.sub_by_key.keys():
+            logger.debug("%s is not reserved, nothing to release" % str(sub))
+            return False
+
+        owner = self.sub_by_key.pop(str(sub))
+        if owner:
+            del self.sub_by_id[owner]
+
+        logger.debug("Will release %s (id=%s)" % (str(sub), owner))
+        self.buddy.release(int(sub.network_address), sub.prefixlen)
+
+        return True
 
     def get_nbr_available_subnets(self):
 
         tmp = {}
         for i in range(self.mask_biggest, self.mask_smallest + 1):
-            tmp[i] = len(self.available_subnets[i])
+            tmp[i] = self.buddy.count(i)
 
         return tmp
 
@@ -182,30 +344,12 @@ class PrefixesPool(object):
         ### TODO ensure that subnet is part of supernet
         logger.debug("will create %s out of %s " % (str(subnet), str(supernet)))
 
-        parent_net = supernet
-        for i in range(supernet.prefixlen + 1, subnet.prefixlen + 1):
-
-            tmp_net = list(parent_net.subnets(new_prefix=i))
-
-            if i == subnet.prefixlen:
-                for net in tmp_net:
-                    logger.debug("Add %s into list of available subnet" % str(net))
-                    self.available_subnets[i].append(str(net))
-            else:
-                if subnet.subnet_of(tmp_net[0]):
-                    parent = 0
-                    other = 1
-                else:
-                    parent = 1
-                    other = 0
-
-                parent_net = tmp_net[parent]
-                logger.debug(
-                    "Add %s into list of available subnet" % str(tmp_net[other])
-                )
-                self.available_subnets[i].append(str(tmp_net[other]))
-
-        self.remove_subnet_from_available_list(supernet)
+        self.buddy.split(
+            int(supernet.network_address),
+            supernet.prefixlen,
+            int(subnet.network_address),
+            subnet.prefixlen,
+        )
         return True
 
     def remove_subnet_from_available_list(self, subnet):
@@ -216,17 +360,9 @@ class PrefixesPool(object):
             subnet (ipnetwork)
         """
 
-        ## todo check if subnet is an IP network object
-
-        try:
-            idx = self.available_subnets[subnet.prefixlen].index(str(subnet))
-
-            # if idx:
+        if self.buddy.remove(int(subnet.network_address), subnet.prefixlen):
             logger.debug("Subnet %s is not available anymore" % str(subnet))
-            del self.available_subnets[subnet.prefixlen][idx]
             return True
-        except:
-            logger.warn(
-                "Unable to remove %s from list of available subnets" % str(subnet)
-            )
-            return False
+
+        logger.warn("Unable to remove %s from list of available subnets" % str(subnet))
+        return False
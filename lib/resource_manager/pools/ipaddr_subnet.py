@@ -1,9 +1,41 @@
 import ipaddress
 import logging
+import socket
+from array import array
+
+from resource_manager.pools.bitmap import Bitmap
+from resource_manager.pools.intervals import IntervalSet
 
 logger = logging.getLogger("resource-manager")
 
 
+def parse_addresses(addresses, version=4):
+    """
+    Convert a list of IP addresses into a list of integers
+    The mask is ignored if present and invalid addresses are converted to -1
+
+    inet_pton is used instead of ipaddress to keep the conversion fast for large batches
+    IPv4 addresses are returned in an array of 64 bits integers, IPv6 in a list
+
+    input:
+        ["10.0.0.1/24", "10.0.0.2"]
+    return:
+        array('q', [167772161, 167772162])
+    """
+
+    family = socket.AF_INET if version == 4 else socket.AF_INET6
+    result = array("q") if version == 4 else []
+
+    for address in addresses:
+        try:
+            packed = socket.inet_pton(family, address.split("/", 1)[0])
+            result.append(int.from_bytes(packed, "big"))
+        except (OSError, AttributeError):
+            result.append(-1)
+
+    return result
+
+
 class IpAddressPool(object):
     """
     This class manage the ip address allocation in a subnet
@@ -11,9 +43,17 @@ class IpAddressPool(object):
     If the same owner request an IP multiple time, the same IP will be returned
 
     The IPs are store with in a dict with a key that represent the ID of the IP in the subnet
+
+    3 storage modes are supported
+     - dict: each IP reserved is stored in a dict with a padded string as the key
+     - bitmap: each IP in the subnet is represented by 1 bit,
+               the identifiers are stored in a side table indexed by the ID of the IP
+     - sparse: the available IPs are stored as a sorted set of intervals,
+               the memory used is proportional to the number of IPs reserved not to the size of the subnet
+    By default, bitmap is used for IPv4 and sparse for IPv6
     """
 
-    def __init__(self, subnet):
+    def __init__(self, subnet, storage=None):
         self.subnet = ipaddress.ip_network(subnet)
 
         if (self.subnet.version == 4 and self.subnet.prefixlen == 31) or (
@@ -28,6 +68,97 @@ class IpAddressPool(object):
         self.ips_by_id = {}
         self.ips_by_identifier = {}
 
+        if storage is None:
+            storage = "bitmap" if self.subnet.version == 4 else "sparse"
+
+        if storage not in ["dict", "bitmap", "sparse"]:
+            raise Exception("storage %s is not supported for IpAddressPool" % storage)
+
+        self.storage = storage
+        self.bitmap = None
+        self.free = None
+
+        if self.storage == "bitmap":
+            self.bitmap = Bitmap(self.num_addresses + 2)
+        elif self.storage == "sparse":
+            self.free = IntervalSet(1, self.num_addresses + 1)
+
+    def _get_key(self, ip_id):
+        """
+        Return the internal key of an IP from its ID in the subnet
+        """
+        if self.storage == "dict":
+            return self.padding.format(ip_id)
+
+        return ip_id
+
+    def _get_owner(self, ip_id):
+        """
+        Return the identifier associated with an IP
+        True if the IP is reserved without identifier and None if the IP is available
+        """
+        if self.storage == "bitmap":
+            if not self.bitmap.test(ip_id):
+                return None
+
+            return self.ips_by_id.get(ip_id, True)
+
+        elif self.storage == "sparse":
+            ## The network and broadcast addresses are not part of the free intervals
+            ## they are reserved only if they have been explicitly marked as such
+            if not 1 <= ip_id <= self.num_addresses:
+                return self.ips_by_id.get(ip_id)
+
+            if ip_id in self.free:
+                return None
+
+            return self.ips_by_id.get(ip_id, True)
+
+        return self.ips_by_id.get(self._get_key(ip_id))
+
+    def _set_owner(self, ip_id, identifier=None):
+        """
+        Mark an IP as reserved, optionally with an identifier
+        """
+        ip_key = self._get_key(ip_id)
+
+        if self.storage in ["bitmap", "sparse"]:
+            if self.storage == "bitmap":
+                self.bitmap.set(ip_id)
+            else:
+                self.free.remove(ip_id)
+
+            if identifier:
+                self.ips_by_id[ip_key] = identifier
+            elif self.storage == "sparse" and not 1 <= ip_id <= self.num_addresses:
+                self.ips_by_id[ip_key] = True
+            else:
+                self.ips_by_id.pop(ip_key, None)
+
+        elif identifier:
+            self.ips_by_id[ip_key] = identifier
+        else:
+            self.ips_by_id[ip_key] = True
+
+        if identifier:
+            self.ips_by_identifier[identifier] = ip_key
+
+    def _get_next_available(self, start=1):
+        """
+        Return the ID of the next IP available after start or None if the subnet is full
+        """
+        if self.storage == "bitmap":
+            return self.bitmap.find_first_zero(start, self.num_addresses + 1)
+
+        elif self.storage == "sparse":
+            return self.free.first()
+
+        for ip_id in range(start, self.num_addresses + 1):
+            if self.padding.format(ip_id) not in self.ips_by_id:
+                return ip_id
+
+        return None
+
     def get(self, identifier=None, id=None, only_if_exist=False):
         """
         Get an IP from the Subnet
@@ -57,50 +188,39 @@ class IpAddressPool(object):
 
         ### If id is provided, pick this IP
         if id:
-            id2str = self.padding.format(id)
+            owner = self._get_owner(id)
 
             ## Check if this IP is already reserved with an Identifier
-            if id2str in self.ips_by_id.keys() and isinstance(
-                self.ips_by_id[id2str], str
-            ):
-                if identifier and self.ips_by_id[id2str] == identifier:
+            if isinstance(owner, str):
+                if identifier and owner == identifier:
                     return self.subnet[id]
 
-                elif identifier and self.ips_by_id[id2str] != identifier:
+                elif identifier and owner != identifier:
                     logger.warning(
                         "The Ip with id %s is already reserved under a different Identifier (%s / %s) "
-                        % (id, identifier, self.ips_by_id[id2str])
+                        % (id, identifier, owner)
                     )
                     return False
                 elif not identifier:
                     logger.warning(
                         "The Ip with id %s is already reserved with the Identifier (%s) "
-                        % (id, self.ips_by_id[id2str])
+                        % (id, owner)
                     )
                     return False
 
-            if identifier:
-                self.ips_by_id[id2str] = identifier
-                self.ips_by_identifier[identifier] = id2str
-            else:
-                self.ips_by_id[id2str] = True
+            self._set_owner(id, identifier)
 
             return self.subnet[id]
 
         ### If no IP were allocated, pick the next one
-        for ip_id in range(1, self.num_addresses + 1):
-            id2str = self.padding.format(ip_id)
+        ip_id = self._get_next_available()
 
-            if id2str in self.ips_by_id.keys():
-                continue
+        if ip_id is None:
+            return None
 
-            if identifier:
-                self.ips_by_id[id2str] = identifier
-                self.ips_by_identifier[identifier] = id2str
-            else:
-                self.ips_by_id[id2str] = True
+        self._set_owner(ip_id, identifier)
 
-            return self.subnet[ip_id]
+        return self.subnet[ip_id]
 
     def reserve(self, ip_address, identifier=None):
         """
@@ -113,12 +233,148 @@ class IpAddressPool(object):
         ip = ipaddress.ip_interface(ip_address)
         ip_nbr = int(ip)
         ip_diff = ip_nbr - self.nwk_int
-        ip_id = self.padding.format(ip_diff)
+
+        if ip_diff < 0 or ip_diff >= self.subnet.num_addresses:
+            logger.warning("%s is not part of %s" % (ip_address, self.subnet))
+            return False
+
+        self._set_owner(ip_diff, identifier)
+
+        return True
+
+    def release(self, ip_address=None, identifier=None):
+        """
+        Release an IP previously reserved, either by IP address or by identifier
+
+        return True/False
+        """
 
         if identifier:
-            self.ips_by_id[ip_id] = identifier
-            self.ips_by_identifier[identifier] = ip_id
+            if identifier not in self.ips_by_identifier.keys():
+                logger.debug("No reservation found for identifier %s" % identifier)
+                return False
+
+            ip_id = int(self.ips_by_identifier[identifier])
+
+        elif ip_address:
+            ip_id = int(ipaddress.ip_interface(ip_address)) - self.nwk_int
+
+            if ip_id < 0 or ip_id >= self.subnet.num_addresses:
+                logger.warning("%s is not part of %s" % (ip_address, self.subnet))
+                return False
+
+        else:
+            return False
+
+        owner = self._get_owner(ip_id)
+
+        if owner is None:
+            logger.debug("%s is not reserved, nothing to release" % self.subnet[ip_id])
+            return False
+
+        ip_key = self._get_key(ip_id)
+
+        if self.storage == "bitmap":
+            self.bitmap.clear(ip_id)
+        elif self.storage == "sparse" and 1 <= ip_id <= self.num_addresses:
+            self.free.add(ip_id, ip_id + 1)
+
+        self.ips_by_id.pop(ip_key, None)
+
+        if owner is not True and self.ips_by_identifier.get(owner) == ip_key:
+            del self.ips_by_identifier[owner]
+
+        return True
+
+    def get_many(self, identifiers):
+        """
+        Get an IP for each identifier
+        Identifiers that already have an IP associated get the same one back,
+        the others get the next available IPs in a single pass over the subnet
+
+        Return a dict identifier > IP (None if the subnet is full)
+        """
+
+        result = {}
+        ip_id = 1
+
+        for identifier in identifiers:
+            if identifier in result:
+                continue
+            elif identifier in self.ips_by_identifier.keys():
+                ip_key = self.ips_by_identifier[identifier]
+                result[identifier] = self.subnet[int(ip_key)]
+                continue
+
+            ## Continue the search where the previous one stopped
+            if ip_id is not None:
+                ip_id = self._get_next_available(start=ip_id)
+
+            if ip_id is None:
+                result[identifier] = None
+                continue
+
+            self._set_owner(ip_id, identifier)
+            result[identifier] = self.subnet[ip_id]
+
+        return result
+
+    def reserve_many(self, items):
+        """
+        Indicate that multiple Ip addresses are already reserved
+        items is a list of tuple (ip_address, identifier), identifier can be None
+
+        All addresses are parsed at once and the addresses without identifier
+        are deduplicated and reserved in a single operation, after the others.
+        An address reserved without identifier keeps its identifier if it already has one,
+        whatever the position of the items in the list
+
+        Return a list of True/False, in the same order as items
+        """
+
+        result = []
+        anonymous = []
+
+        addresses = parse_addresses([item[0] for item in items], self.subnet.version)
+
+        for (ip_address, identifier), ip_nbr in zip(items, addresses):
+            ip_diff = ip_nbr - self.nwk_int
+
+            if ip_nbr < 0 or ip_diff < 0 or ip_diff >= self.subnet.num_addresses:
+                logger.warning("%s is not part of %s" % (ip_address, self.subnet))
+                result.append(False)
+                continue
+
+            if identifier:
+                self._set_owner(ip_diff, identifier)
+            else:
+                anonymous.append(ip_diff)
+
+            result.append(True)
+
+        self._set_many(set(anonymous))
+
+        return result
+
+    def _set_many(self, ip_ids):
+        """
+        Mark multiple IPs as reserved without identifier
+        The IPs already reserved keep their identifier
+        """
+        if self.storage == "bitmap":
+            self.bitmap.set_many(ip_ids)
+
+        elif self.storage == "sparse":
+            self.free.remove_many(
+                ip_id for ip_id in ip_ids if 1 <= ip_id <= self.num_addresses
+            )
+
+            for ip_id in ip_ids:
+                if not 1 <= ip_id <= self.num_addresses:
+                    self.ips_by_id.setdefault(ip_id, True)
+
         else:
-            self.ips_by_id[ip_id] = True
+            for ip_id in ip_ids:
+                self.ips_by_id.setdefault(self.padding.format(ip_id), True)
 
         return True
@@ -4,6 +4,9 @@ import os
 import inspect
 from collections import defaultdict, OrderedDict
 
+logger = logging.getLogger("resource-manager")
+
+
 ### -------------------------------------------------------
 ### Support Function
 ### -------------------------------------------------------
@@ -364,3 +367,88 @@ class ListPool(object):
                 self.item_by_value[item] = True
                 self.nbr_item_available -= 1
                 return item
+
+    def get_many(self, identifiers):
+        """
+        Get an item for each identifier
+        Identifiers that already have an item associated get the same one back,
+        the others get the next available items in a single pass over the list
+
+        Return a dict identifier > item (None if the pool is full)
+        """
+
+        result = {}
+        new_identifiers = []
+
+        for identifier in identifiers:
+            if identifier in result:
+                continue
+            elif identifier in self.item_by_identifier.keys():
+                result[identifier] = self.item_by_identifier[identifier]
+            else:
+                result[identifier] = None
+                new_identifiers.append(identifier)
+
+        if not new_identifiers:
+            return result
+
+        ## Continue the search where the previous one stopped
+        items = iter(self.item_by_value.keys())
+
+        for identifier in new_identifiers:
+            item = next((i for i in items if self.item_by_value[i] == False), None)
+
+            if item is None:
+                # No more item available
+                break
+
+            if identifier:
+                self.item_by_value[item] = identifier
+                self.item_by_identifier[identifier] = item
+            else:
+                self.item_by_value[item] = True
+
+            self.nbr_item_available -= 1
+            result[identifier] = item
+
+        return result
+
+    def reserve_many(self, items):
+        """
+        Reserve multiple items from the Pool
+        items is a list of tuple (item, identifier), identifier can be None
+
+        Return a list of True/False, in the same order as items
+        """
+
+        return [self.reserve(item, identifier=identifier) for item, identifier in items]
+
+    def release(self, item=None, identifier=None):
+        """
+        Release an item previously reserved, either by item or by identifier
+
+        return True/False
+        """
+
+        if identifier:
+            if identifier not in self.item_by_identifier.keys():
+                logger.debug("No reservation found for identifier %s" % identifier)
+                return False
+
+            item = self.item_by_identifier[identifier]
+
+        elif item is None:
+            return False
+
+        if self.item_by_value.get(item, False) == False:
+            logger.debug("%s is not reserved, nothing to release" % item)
+            return False
+
+        owner = self.item_by_value[item]
+        if owner is not True:
+            del self.item_by_identifier[owner]
+
+        self.item_by_value[item] = False
+        self.nbr_item_available += 1
+
+        return True
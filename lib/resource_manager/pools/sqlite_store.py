@@ -0,0 +1,498 @@
+import hashlib
+import ipaddress
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from resource_manager.pools.integer import IntegerPool
+from resource_manager.pools.ipaddr_prefixes import PrefixesPool
+from resource_manager.pools.ipaddr_subnet import IpAddressPool
+from resource_manager.pools.list import ListPool, expand_list
+
+logger = logging.getLogger("resource-manager")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    name TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS allocations (
+    pool TEXT NOT NULL,
+    value TEXT NOT NULL,
+    identifier TEXT,
+    PRIMARY KEY (pool, value)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS allocations_identifier ON allocations (pool, identifier);
+"""
+
+
+class SqliteStore(object):
+    """
+    SQLite database storing the allocations of multiple pools
+
+    The database is opened in WAL mode so multiple processes can share it,
+    the readers are not blocked by a writer and each write is done in its own transaction
+    """
+
+    def __init__(self, path, timeout=30):
+        """
+        Inputs:
+            path: path of the database file, created if it doesn't exist
+            timeout: number of seconds to wait for a lock held by another process
+        """
+
+        self.path = path
+        self.lock = threading.RLock()
+
+        self.conn = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def execute(self, query, params=()):
+        """
+        Execute a query outside of a transaction and return all rows
+        """
+
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Execute multiple queries in a single transaction
+        The database is locked for writing until the end of the transaction
+        """
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+            self.conn.execute("COMMIT")
+
+    def close(self):
+        self.conn.close()
+
+
+class SqlitePool(object):
+    """
+    Pool saving its allocations in a SqliteStore
+
+    The allocations are kept in a native pool (IntegerPool, IpAddressPool ...) built from the database,
+    each new allocation is done in a transaction, if another process modified the pool in the meantime
+    the native pool is rebuilt from the database first.
+    The lookup of an identifier already allocated is a query on the index of the database
+    """
+
+    pool_type = None
+
+    def __init__(self, store, name):
+
+        self.store = store
+        self.name = name
+        self.version = None
+        self.pool = None
+
+    def _get_spec(self):
+        """
+        Return a string describing the pool, to ensure it's not used with a different definition
+        """
+        raise NotImplementedError
+
+    def _create_pool(self):
+        raise NotImplementedError
+
+    def _to_value(self, value):
+        """
+        Convert a value of the pool into the string saved in the database
+        """
+        return str(value)
+
+    def _from_value(self, value):
+        """
+        Convert a string from the database into a value of the pool
+        """
+        return value
+
+    def _build(self, rows):
+        """
+        Create the native pool from the allocations saved in the database
+        """
+
+        pool = self._create_pool()
+        pool.reserve_many(rows)
+
+        return pool
+
+    def _sync(self, conn):
+        """
+        Rebuild the native pool if the pool has been modified by another process
+        Must be called in a transaction
+        """
+
+        row = conn.execute(
+            "SELECT type, spec, version FROM pools WHERE name = ?", (self.name,)
+        ).fetchone()
+
+        if row is None:
+            conn.execute(
+                "INSERT INTO pools (name, type, spec, version) VALUES (?, ?, ?, 0)",
+                (self.name, self.pool_type, self._get_spec()),
+            )
+            row = (self.pool_type, self._get_spec(), 0)
+
+        elif (row[0], row[1]) != (self.pool_type, self._get_spec()):
+            raise Exception(
+                "The pool %s already exists in %s with a different definition"
+                % (self.name, self.store.path)
+            )
+
+        if self.pool is not None and row[2] == self.version:
+            return False
+
+        rows = conn.execute(
+            "SELECT value, identifier FROM allocations WHERE pool = ?", (self.name,)
+        ).fetchall()
+
+        self.pool = self._build(rows)
+        self.version = row[2]
+
+        logger.debug(
+            "SqlitePool, %s loaded with %s allocation(s)" % (self.name, len(rows))
+        )
+
+        return True
+
+    @contextmanager
+    def _update(self):
+        """
+        Transaction to modify the pool, the native pool is rebuilt if needed
+        and the version of the pool is increased at the end of the transaction if something changed
+        """
+
+        try:
+            with self.store.transaction() as conn:
+                self._sync(conn)
+                changes = conn.total_changes
+
+                yield conn
+
+                if conn.total_changes != changes:
+                    conn.execute(
+                        "UPDATE pools SET version = version + 1 WHERE name = ?",
+                        (self.name,),
+                    )
+                    self.version += 1
+
+        except BaseException:
+            ## The native pool may have changed, it will be rebuilt next time
+            self.version = None
+            raise
+
+    def _save(self, conn, value, identifier=None):
+
+        ## A plain INSERT, a conflict must fail the transaction instead of replacing another row
+        conn.execute(
+            "INSERT INTO allocations (pool, value, identifier) VALUES (?, ?, ?)",
+            (self.name, self._to_value(value), identifier or None),
+        )
+
+    def _delete(self, conn, value):
+
+        conn.execute(
+            "DELETE FROM allocations WHERE pool = ? AND value = ?",
+            (self.name, self._to_value(value)),
+        )
+
+    def lookup(self, identifier):
+        """
+        Return the value allocated to an identifier or None
+        """
+
+        with self.store.lock:
+            return self._lookup(self.store.conn, identifier)
+
+    def _lookup(self, conn, identifier):
+
+        row = conn.execute(
+            "SELECT value FROM allocations WHERE pool = ? AND identifier = ?",
+            (self.name, identifier),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        return self._from_value(row[0])
+
+    def load(self):
+        """
+        Load the native pool from the database
+        """
+
+        with self.store.transaction() as conn:
+            self._sync(conn)
+
+        return self.pool
+
+    def _get(self, identifier=None, **kwargs):
+        """
+        Allocate a new value with the native pool and save it
+        """
+
+        with self._update() as conn:
+            ## Another process may have allocated a value to this identifier in the meantime
+            exists = identifier and self._lookup(conn, identifier) is not None
+
+            value = self.pool.get(identifier=identifier, **kwargs)
+
+            if not exists and value is not None and value is not False:
+                self._save(conn, value, identifier)
+
+        return value
+
+    def _get_owner(self, conn, value):
+        """
+        Return a tuple (allocated, identifier) for a value, identifier is None for an anonymous allocation
+        """
+
+        row = conn.execute(
+            "SELECT identifier FROM allocations WHERE pool = ? AND value = ?",
+            (self.name, self._to_value(value)),
+        ).fetchone()
+
+        if row is None:
+            return False, None
+
+        return True, row[0]
+
+    def _reserve(self, value, identifier=None):
+        """
+        Reserve a value, rejected if the identifier already has a different value
+        or if the value is already allocated to another identifier
+        """
+
+        with self._update() as conn:
+            current = self._lookup(conn, identifier) if identifier else None
+            allocated, owner = self._get_owner(conn, value)
+
+            if current is not None:
+                reserved = self._to_value(current) == self._to_value(value)
+
+                if not reserved:
+                    logger.warn(
+                        "this identifier (%s) is already used but for a different resource (%s)"
+                        % (identifier, current)
+                    )
+
+            ## The database is the reference, the native pool may accept a value already saved
+            elif allocated:
+                reserved = owner == (identifier or None)
+
+                if not reserved:
+                    logger.warn(
+                        "%s is already allocated to a different identifier (%s)"
+                        % (value, owner)
+                    )
+
+            else:
+                reserved = self.pool.reserve(value, identifier=identifier)
+
+                if reserved:
+                    self._save(conn, value, identifier)
+
+        return reserved
+
+    def _release(self, value=None, identifier=None):
+
+        with self._update() as conn:
+            if identifier:
+                value = self._lookup(conn, identifier)
+
+            released = False
+            if value is not None:
+                released = self.pool.release(value)
+
+            if released:
+                self._delete(conn, value)
+
+        return released
+
+
+class SqliteIntegerPool(SqlitePool):
+    """
+    IntegerPool with its allocations saved in a SqliteStore
+    """
+
+    pool_type = "integer"
+
+    def __init__(self, store, name, start, end):
+
+        super(SqliteIntegerPool, self).__init__(store, name)
+
+        self.range_start = int(start)
+        self.range_end = int(end)
+
+    def _get_spec(self):
+        return "%s-%s" % (self.range_start, self.range_end)
+
+    def _create_pool(self):
+        return IntegerPool(self.name, self.range_start, self.range_end)
+
+    def _to_value(self, value):
+        return str(int(value))
+
+    def _from_value(self, value):
+        return int(value)
+
+    def get(self, identifier=None):
+
+        if identifier:
+            integer = self.lookup(identifier)
+            if integer is not None:
+                return integer
+
+        return self._get(identifier=identifier)
+
+    def reserve(self, integer, identifier=None):
+        return self._reserve(int(integer), identifier=identifier)
+
+    def release(self, integer=None, identifier=None):
+        return self._release(integer, identifier=identifier)
+
+
+class SqliteListPool(SqlitePool):
+    """
+    ListPool with its allocations saved in a SqliteStore
+    """
+
+    pool_type = "list"
+
+    def __init__(self, store, name, items_list):
+
+        super(SqliteListPool, self).__init__(store, name)
+
+        self.items_list = list(items_list)
+
+    def _get_spec(self):
+        return hashlib.sha1(
+            json.dumps(expand_list(self.items_list)).encode("utf-8")
+        ).hexdigest()
+
+    def _create_pool(self):
+        return ListPool(self.name, self.items_list)
+
+    def get(self, identifier=None):
+
+        if identifier:
+            item = self.lookup(identifier)
+            if item is not None:
+                return item
+
+        return self._get(identifier=identifier)
+
+    def reserve(self, item, identifier=None):
+        return self._reserve(item, identifier=identifier)
+
+    def release(self, item=None, identifier=None):
+        return self._release(item, identifier=identifier)
+
+
+class SqliteIpAddressPool(SqlitePool):
+    """
+    IpAddressPool with its allocations saved in a SqliteStore
+    The addresses are saved without mask
+    """
+
+    pool_type = "ipaddress"
+
+    def __init__(self, store, subnet, name=None, storage=None):
+
+        self.subnet = ipaddress.ip_network(subnet)
+        self.storage = storage
+
+        super(SqliteIpAddressPool, self).__init__(
+            store, name or "ipaddress:%s" % self.subnet
+        )
+
+    def _get_spec(self):
+        return str(self.subnet)
+
+    def _create_pool(self):
+        return IpAddressPool(str(self.subnet), storage=self.storage)
+
+    def _to_value(self, value):
+        return str(ipaddress.ip_interface(str(value)).ip)
+
+    def _from_value(self, value):
+        return ipaddress.ip_address(value)
+
+    def get(self, identifier=None, id=None):
+
+        if identifier:
+            ip = self.lookup(identifier)
+            if ip is not None:
+                return ip
+
+        return self._get(identifier=identifier, id=id)
+
+    def reserve(self, ip_address, identifier=None):
+        return self._reserve(ip_address, identifier=identifier)
+
+    def release(self, ip_address=None, identifier=None):
+        return self._release(ip_address, identifier=identifier)
+
+
+class SqlitePrefixesPool(SqlitePool):
+    """
+    PrefixesPool with its allocations saved in a SqliteStore
+    """
+
+    pool_type = "prefixes"
+
+    def __init__(self, store, network, name=None):
+
+        self.network = ipaddress.ip_network(network)
+
+        super(SqlitePrefixesPool, self).__init__(
+            store, name or "prefixes:%s" % self.network
+        )
+
+    def _get_spec(self):
+        return str(self.network)
+
+    def _create_pool(self):
+        return PrefixesPool(str(self.network))
+
+    def _build(self, rows):
+        return PrefixesPool.from_reservations(str(self.network), rows)
+
+    def _to_value(self, value):
+        return str(ipaddress.ip_network(str(value)))
+
+    def _from_value(self, value):
+        return ipaddress.ip_network(value)
+
+    def get(self, size, identifier=None):
+
+        if identifier:
+            net = self.lookup(identifier)
+            if net is not None:
+                return net if net.prefixlen == int(size) else False
+
+        return self._get(identifier=identifier, size=size)
+
+    def reserve(self, subnet, identifier=None):
+        return self._reserve(subnet, identifier=identifier)
+
+    def release(self, subnet=None, identifier=None):
+        return self._release(subnet, identifier=identifier)
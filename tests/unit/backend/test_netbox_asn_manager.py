@@ -1,9 +1,13 @@
 import unittest
+import tempfile
+import time
 import requests_mock
 import yaml
 import pytest
 from os import path
 
+from concurrent.futures import ThreadPoolExecutor
+
 from resource_manager.backend.netbox_asn_manager import NetboxAsnManager
 
 here = path.abspath(path.dirname(__file__))
@@ -33,6 +37,22 @@ class Test_NetboxAsnManager(unittest.TestCase):
         asn_manager = NetboxAsnManager(config=VALID_CONFIG_2)
         self.assertEqual(asn_manager.netbox_custom_field_name, "newname")
 
+    def test_import_pools_spec_from_file(self):
+
+        asn_manager = NetboxAsnManager(config=VALID_CONFIG_1)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml") as f:
+            f.write(
+                "test_range:\n  scope:\n    - site: test\n  range: [65001, 65100]\n"
+            )
+            f.flush()
+
+            self.assertTrue(asn_manager.import_pools_spec_from_file(f.name))
+
+        self.assertEqual(
+            asn_manager.asn_pools_spec["test_range"]["range"], [65001, 65100]
+        )
+
     @requests_mock.mock()
     def test_basic(self, m):
 
@@ -64,6 +84,178 @@ class Test_NetboxAsnManager(unittest.TestCase):
             65010,
         )
 
+    @requests_mock.mock()
+    def test_concurrent_resolve(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+
+        def slow_devices(request, context):
+            time.sleep(0.1)
+            return test02_1["response"]
+
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"], json=slow_devices
+        )
+
+        asn_manager = NetboxAsnManager(config=VALID_CONFIG_1)
+        asn_manager.add_pool_specification(
+            name="test_range",
+            spec={"scope": [{"site": "test"}], "range": [65001, 65100]},
+        )
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(
+                executor.map(
+                    lambda name: asn_manager.resolve("ASN", "test_range", name),
+                    ["device1", "new1", "new2", "device10", "new1"],
+                )
+            )
+
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(results[0], 65001)
+        self.assertEqual(results[3], 65010)
+        self.assertEqual(sorted(results[1:3]), [65003, 65004])
+        self.assertEqual(results[4], results[1])
+
+    @requests_mock.mock()
+    def test_concurrent_get(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        asn_manager = NetboxAsnManager(config=VALID_CONFIG_1)
+        asn_manager.add_pool_specification(
+            name="test_range",
+            spec={"scope": [{"site": "test"}], "range": [65001, 65100]},
+        )
+
+        names = ["new%s" % i for i in range(90)] * 2
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(
+                executor.map(
+                    lambda name: asn_manager.resolve("ASN", "test_range", name), names
+                )
+            )
+
+        ## Each name gets its own ASN, the same one for the 2 requests
+        self.assertEqual(len(set(results[:90])), 90)
+        self.assertEqual(results[:90], results[90:])
+        self.assertNotIn(65001, results)
+        self.assertNotIn(65010, results)
+
+    @requests_mock.mock()
+    def test_warm_up(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+        m.get("http://mock/api/dcim/devices/?site=broken", status_code=500)
+
+        asn_manager = NetboxAsnManager(config=VALID_CONFIG_1)
+        for name in ["range1", "range2"]:
+            asn_manager.add_pool_specification(
+                name=name, spec={"scope": [{"site": "test"}], "range": [65001, 65100]}
+            )
+        asn_manager.add_pool_specification(
+            name="broken", spec={"scope": [{"site": "broken"}], "range": [1, 10]}
+        )
+
+        results = asn_manager.warm_up(workers=2)
+
+        self.assertEqual(sorted(results.keys()), ["broken", "range1", "range2"])
+        self.assertTrue(results["range1"]["loaded"])
+        self.assertTrue(results["range2"]["loaded"])
+        self.assertGreaterEqual(results["range1"]["time"], 0)
+        self.assertFalse(results["broken"]["loaded"])
+        self.assertIsNotNone(results["broken"]["error"])
+
+        self.assertEqual(sorted(asn_manager.asn_pools.keys()), ["range1", "range2"])
+        self.assertEqual(list(asn_manager.failed_pools.keys()), ["broken"])
+
+        ## The pools are already loaded
+        nbr_calls = m.call_count
+        self.assertEqual(asn_manager.resolve("ASN", "range1", "device1"), 65001)
+        self.assertEqual(m.call_count, nbr_calls)
+
+        results = asn_manager.warm_up(names=["unknown"])
+        self.assertFalse(results["unknown"]["loaded"])
+
+    @requests_mock.mock()
+    def test_pool_ttl(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        asn_manager = NetboxAsnManager(
+            config={"netbox": {"address": "http://mock", "pool_ttl": 0}}
+        )
+        asn_manager.add_pool_specification(
+            name="test_range",
+            spec={"scope": [{"site": "test"}], "range": [65001, 65100]},
+        )
+
+        self.assertEqual(asn_manager.resolve("ASN", "test_range", "device1"), 65001)
+
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json={
+                "count": 1,
+                "results": [{"id": 1, "name": "device1", "custom_fields": {}}],
+            },
+        )
+
+        ## The stale pool is used until the new one is loaded
+        self.assertEqual(asn_manager.resolve("ASN", "test_range", "device1"), 65001)
+        asn_manager.asn_pools.join()
+
+        self.assertEqual(asn_manager.resolve("ASN", "test_range", "new"), 65001)
+        asn_manager.asn_pools.join()
+
+    @requests_mock.mock()
+    def test_pool_ttl_allocations(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        asn_manager = NetboxAsnManager(
+            config={"netbox": {"address": "http://mock", "pool_ttl": 0}}
+        )
+        asn_manager.add_pool_specification(
+            name="test_range",
+            spec={"scope": [{"site": "test"}], "range": [65001, 65100]},
+        )
+
+        ## new1 is allocated on the stale pool while the new one is loaded from Netbox
+        stale_pool = asn_manager._get_pool("test_range")
+        self.assertEqual(asn_manager.resolve("ASN", "test_range", "new1"), 65003)
+        asn_manager.asn_pools.join()
+
+        pool = asn_manager.asn_pools["test_range"]
+        self.assertIsNot(pool, stale_pool)
+        self.assertTrue(pool.has_unsaved())
+
+        self.assertEqual(asn_manager.resolve("ASN", "test_range", "new1"), 65003)
+        self.assertEqual(asn_manager.resolve("ASN", "test_range", "new2"), 65004)
+        asn_manager.asn_pools.join()
+
+        ## The stale pool forwards the requests to the new one
+        self.assertEqual(stale_pool.get(identifier="new3"), 65005)
+        self.assertEqual(asn_manager.resolve("ASN", "test_range", "new3"), 65005)
+        asn_manager.asn_pools.join()
+
 
 def load_fixture(name):
-    return yaml.load(open(here + "/" + FIXTURE_DIR + name + ".json"))
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
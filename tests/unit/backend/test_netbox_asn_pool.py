@@ -100,7 +100,210 @@ class Test_NetboxAsnPool(unittest.TestCase):
         self.assertEqual(pool.get(identifier="device1"), 65001)
         self.assertEqual(pool.get(identifier="device10"), 65010)
 
+    @requests_mock.mock()
+    def test_sync(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test"}],
+            asn_range=[65001, 65100],
+        )
+
+        m.get(
+            "http://mock/api/extras/object-changes/?changed_object_type=dcim.device&action=delete",
+            json={"count": 1, "results": [{"id": 100, "changed_object_id": 2}]},
+        )
+        m.get(
+            "http://mock/api/dcim/devices/",
+            json={
+                "count": 3,
+                "results": [
+                    {"id": 1, "name": "device1", "custom_fields": {"ASN": 65001}},
+                    {"id": 10, "name": "device10", "custom_fields": {"ASN": 65020}},
+                    {"id": 11, "name": "device11", "custom_fields": {"ASN": 65002}},
+                ],
+            },
+        )
+
+        self.assertTrue(pool.sync())
+        self.assertIn("last_updated__gte", m.last_request.qs)
+
+        self.assertEqual(pool.get(identifier="device1"), 65001)
+        self.assertEqual(pool.get(identifier="device10"), 65020)
+        self.assertEqual(pool.get(identifier="device11"), 65002)
+        self.assertEqual(pool.get(identifier="device12"), 65003)
+        self.assertEqual(pool.get(identifier="device13"), 65004)
+
+    @requests_mock.mock()
+    def test_sync_server_time(self, m):
+
+        m.get(
+            "http://mock/api/dcim/devices/?offset=0&limit=500&is_network_device=True&site=test",
+            json={
+                "count": 1,
+                "results": [
+                    {
+                        "id": 1,
+                        "name": "device1",
+                        "custom_fields": {"ASN": 65001},
+                        "last_updated": "2020-04-02T09:12:44.089271Z",
+                    }
+                ],
+            },
+        )
+
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test"}],
+            asn_range=[65001, 65100],
+        )
+
+        ## The watermark comes from the time of the devices, minus the safety margin
+        self.assertEqual(pool.last_sync, "2020-04-02T09:11:44Z")
+
+        ## new1 got an ASN locally while another one was assigned to it in Netbox
+        self.assertEqual(pool.get(identifier="new1"), 65002)
+
+        m.get(
+            "http://mock/api/extras/object-changes/?changed_object_type=dcim.device&action=delete",
+            json={
+                "count": 1,
+                "results": [
+                    {"id": 100, "changed_object_id": 3, "time": "2020-04-02T10:00:00Z"}
+                ],
+            },
+        )
+        m.get(
+            "http://mock/api/dcim/devices/",
+            json={
+                "count": 1,
+                "results": [
+                    {
+                        "id": 2,
+                        "name": "new1",
+                        "custom_fields": {"ASN": 65050},
+                        "last_updated": "2020-04-02T09:30:00Z",
+                    }
+                ],
+            },
+        )
+
+        self.assertTrue(pool.sync())
+        self.assertEqual(
+            m.last_request.qs["last_updated__gte"], ["2020-04-02t09:11:44z"]
+        )
+        self.assertEqual(pool.last_sync, "2020-04-02T09:59:00Z")
+
+        self.assertEqual(pool.get(identifier="new1"), 65050)
+        self.assertEqual(pool.get(identifier="new2"), 65002)
+
+    @requests_mock.mock()
+    def test_apply_event_scope(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get("http://mock/api/dcim/devices/", json=test02_1["response"])
+
+        payload = load_fixture("test06_2_webhook_dcim_device")
+        payload["data"]["custom_fields"]["ASN"] = 65010
+
+        ## role is sent as device_role by Netbox
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test", "role": "leaf"}],
+            asn_range=[65001, 65100],
+        )
+
+        self.assertFalse(pool.apply_event("dcim.device", "updated", payload["data"]))
+        self.assertEqual(pool.get(identifier="device10"), 65010)
+        self.assertEqual(pool.get(), 65003)
+
+        ## The filter can't be checked with the webhook, the ASN is kept
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test", "manufacturer": "arista"}],
+            asn_range=[65001, 65100],
+        )
+
+        self.assertFalse(pool.apply_event("dcim.device", "updated", payload["data"]))
+        self.assertEqual(pool.get(identifier="device10"), 65010)
+
+        ## The device doesn't have the tag anymore
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test", "tag": "spine"}],
+            asn_range=[65001, 65100],
+        )
+
+        self.assertTrue(pool.apply_event("dcim.device", "updated", payload["data"]))
+        self.assertEqual(pool.get(identifier="new"), 65003)
+        self.assertTrue(pool.pool.reserve(65010, identifier="other"))
+
+    @requests_mock.mock()
+    def test_duplicate_asn(self, m):
+
+        m.get(
+            "http://mock/api/dcim/devices/",
+            json={
+                "count": 2,
+                "results": [
+                    {"id": 1, "name": "device1", "custom_fields": {"ASN": 65001}},
+                    {"id": 2, "name": "device2", "custom_fields": {"ASN": 65001}},
+                ],
+            },
+        )
+
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test"}],
+            asn_range=[65001, 65100],
+        )
+
+        ## device2 and device3 use the ASN of device1, removing them must not release it
+        device3 = {"id": 3, "name": "device3", "custom_fields": {"ASN": 65001}}
+        self.assertTrue(pool.apply_event("dcim.device", "updated", device3))
+        self.assertFalse(pool.apply_event("dcim.device", "deleted", {"id": 2}))
+        self.assertFalse(pool.apply_event("dcim.device", "deleted", {"id": 3}))
+
+        self.assertEqual(pool.get(), 65002)
+        self.assertEqual(pool.get(identifier="device1"), 65001)
+
+    @requests_mock.mock()
+    def test_get_many(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test"}],
+            asn_range=[65001, 65100],
+        )
+
+        self.assertEqual(
+            pool.get_many(["device1", "new1", None, "new1", None, "device10"]),
+            [65001, 65003, 65004, 65003, 65005, 65010],
+        )
+        self.assertEqual(pool.local, {65003: "new1", 65004: None, 65005: None})
+        self.assertEqual(pool.get(identifier="new1"), 65003)
+
 
 def load_fixture(name):
 
-    return yaml.load(open(here + "/" + FIXTURE_DIR + name + ".json"))
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
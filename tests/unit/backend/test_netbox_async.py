@@ -0,0 +1,146 @@
+import asyncio
+import unittest
+import requests
+import requests_mock
+import yaml
+from os import path
+
+from resource_manager.backend.netbox_async import (
+    query_netbox_async,
+    create_netbox_asn_pool,
+)
+from resource_manager.backend.netbox_asn_manager import NetboxAsnManager
+from resource_manager.backend.netbox_net_manager import NetboxNetManager
+
+here = path.abspath(path.dirname(__file__))
+
+FIXTURE_DIR = "fixtures/"
+
+VALID_CONFIG_1 = {"netbox": {"address": "http://mock"}}
+
+
+class Test_NetboxAsync(unittest.TestCase):
+    @requests_mock.mock()
+    def test_query_netbox_async(self, m):
+
+        for offset in range(0, 25, 10):
+            m.get(
+                "http://mock/api/dcim/devices/?offset=%s&limit=10&site=test" % offset,
+                json={
+                    "count": 25,
+                    "results": [{"id": i} for i in range(offset, min(offset + 10, 25))],
+                },
+            )
+
+        resp = asyncio.run(
+            query_netbox_async(
+                req=requests.session(),
+                url="http://mock/api/dcim/devices/",
+                params="site=test",
+                batch_size=10,
+            )
+        )
+
+        self.assertEqual(resp["count"], 25)
+        self.assertEqual([r["id"] for r in resp["results"]], list(range(0, 25)))
+
+    @requests_mock.mock()
+    def test_query_netbox_async_keyset(self, m):
+
+        m.get(
+            "http://mock/api/dcim/devices/?ordering=id&limit=10&site=test",
+            json={"count": 15, "results": [{"id": i} for i in range(0, 10)]},
+        )
+        m.get(
+            "http://mock/api/dcim/devices/?ordering=id&limit=10&id__gt=9&site=test",
+            json={"count": 5, "results": [{"id": i} for i in range(10, 15)]},
+        )
+
+        resp = asyncio.run(
+            query_netbox_async(
+                req=requests.session(),
+                url="http://mock/api/dcim/devices/",
+                params="site=test",
+                batch_size=10,
+                paging="keyset",
+            )
+        )
+
+        self.assertEqual(resp["count"], 15)
+        self.assertEqual([r["id"] for r in resp["results"]], list(range(0, 15)))
+
+    @requests_mock.mock()
+    def test_create_asn_pool(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        pool = asyncio.run(
+            create_netbox_asn_pool(
+                netbox="http://mock",
+                name="test_range",
+                scope=[{"site": "test"}],
+                asn_range=[65001, 65100],
+            )
+        )
+
+        self.assertEqual(pool.get(), 65003)
+
+    @requests_mock.mock()
+    def test_asn_manager_resolve_async(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        asn_manager = NetboxAsnManager(config=VALID_CONFIG_1)
+        asn_manager.add_pool_specification(
+            name="test_range",
+            spec={"scope": [{"site": "test"}], "range": [65001, 65100]},
+        )
+
+        async def resolve_all():
+            return await asyncio.gather(
+                asn_manager.resolve_async("ASN", "test_range", identifier="device1"),
+                asn_manager.resolve_async("ASN", "test_range", identifier="new1"),
+                asn_manager.resolve_async("ASN", "test_range", identifier="new2"),
+                asn_manager.resolve_async("ASN", "unknown_range"),
+            )
+
+        results = asyncio.run(resolve_all())
+
+        self.assertEqual(results[0], 65001)
+        self.assertEqual(sorted(results[1:3]), [65003, 65004])
+        self.assertFalse(results[3])
+        self.assertEqual(m.call_count, 1)
+
+    @requests_mock.mock()
+    def test_net_manager_resolve_async(self, m):
+
+        test03_1 = load_fixture("test03_1_ipam_prefixes")
+        test03_2 = load_fixture("test03_2_ipam_prefixes")
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_1["params"],
+            json=test03_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_2["params"],
+            json=test03_2["response"],
+        )
+
+        nnm = NetboxNetManager(config=VALID_CONFIG_1)
+
+        result = asyncio.run(
+            nnm.resolve_async(var_type="NET4", var_params="loopback/26")
+        )
+        self.assertEqual(str(result), "10.10.0.64/26")
+
+
+def load_fixture(name):
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
@@ -0,0 +1,170 @@
+import os
+import unittest
+import shutil
+import tempfile
+import threading
+import requests_mock
+
+from resource_manager.backend.netbox_asn_pool import NetboxAsnPool
+from resource_manager.backend.netbox_cache import NetboxCache
+from resource_manager.backend.netbox_client import NetboxClient
+from resource_manager.backend.netbox_utils import query_netbox
+
+URL = "http://mock/api/dcim/devices/"
+
+
+class Test_NetboxCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def query(self, client):
+        return query_netbox(req=client, url=URL, params="site=test")
+
+    @requests_mock.mock()
+    def test_fresh_entry(self, m):
+
+        m.get(URL, json={"count": 1, "results": [{"id": 1}]})
+
+        client = NetboxClient("http://mock", cache=NetboxCache(self.path, ttl=60))
+        self.assertEqual(self.query(client)["results"], [{"id": 1}])
+
+        ## A new client using the same directory doesn't query Netbox again
+        client = NetboxClient("http://mock", cache=NetboxCache(self.path, ttl=60))
+        self.assertEqual(self.query(client)["results"], [{"id": 1}])
+
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(client.cache.hits, 1)
+
+    @requests_mock.mock()
+    def test_revalidate_etag(self, m):
+
+        m.get(
+            URL,
+            json={"count": 1, "results": [{"id": 1}]},
+            headers={"ETag": '"v1"'},
+        )
+
+        cache = NetboxCache(self.path, ttl=0)
+        client = NetboxClient("http://mock", cache=cache)
+        self.query(client)
+
+        m.get(URL, status_code=304)
+        self.assertEqual(self.query(client)["results"], [{"id": 1}])
+
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(m.last_request.headers["If-None-Match"], '"v1"')
+        self.assertEqual(cache.revalidations, 1)
+
+    @requests_mock.mock()
+    def test_modified(self, m):
+
+        m.get(
+            URL,
+            json={"count": 1, "results": [{"id": 1}]},
+            headers={"ETag": '"v1"'},
+        )
+
+        client = NetboxClient("http://mock", cache=NetboxCache(self.path, ttl=0))
+        self.query(client)
+
+        m.get(
+            URL,
+            json={"count": 1, "results": [{"id": 2}]},
+            headers={"ETag": '"v2"'},
+        )
+        self.assertEqual(self.query(client)["results"], [{"id": 2}])
+
+        entry = client.cache.load(URL, "offset=0&limit=500&site=test")
+        self.assertEqual(entry["etag"], '"v2"')
+
+    @requests_mock.mock()
+    def test_key_params(self, m):
+
+        m.get(URL + "?site=test", json={"count": 1, "results": [{"id": 1}]})
+        m.get(URL + "?site=other", json={"count": 1, "results": [{"id": 2}]})
+
+        client = NetboxClient("http://mock", cache=NetboxCache(self.path, ttl=60))
+
+        self.assertEqual(self.query(client)["results"], [{"id": 1}])
+        resp = query_netbox(req=client, url=URL, params="site=other")
+        self.assertEqual(resp["results"], [{"id": 2}])
+
+    def test_concurrent_save(self):
+
+        cache = NetboxCache(self.path, ttl=60)
+
+        def save(i):
+            for _ in range(20):
+                cache.save(URL, "site=test", {"results": [{"id": i}]})
+
+        threads = [threading.Thread(target=save, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn(
+            cache.load(URL, "site=test")["data"]["results"][0]["id"], range(8)
+        )
+        self.assertEqual([f for f in os.listdir(self.path) if f.endswith(".tmp")], [])
+
+    def test_from_config(self):
+
+        client = NetboxClient.from_config(
+            {"address": "http://mock", "cache_dir": self.path, "cache_ttl": 10}
+        )
+
+        self.assertEqual(client.cache.path, self.path)
+        self.assertEqual(client.cache.ttl, 10)
+        self.assertIsNone(NetboxClient.from_config({"address": "http://mock"}).cache)
+
+    @requests_mock.mock()
+    def test_sync_revalidate(self, m):
+
+        m.get(
+            URL,
+            json={
+                "count": 1,
+                "results": [
+                    {
+                        "id": 1,
+                        "name": "device1",
+                        "custom_fields": {"ASN": 65001},
+                        "last_updated": "2020-04-02T09:12:44Z",
+                    }
+                ],
+            },
+        )
+
+        client = NetboxClient("http://mock", cache=NetboxCache(self.path, ttl=60))
+        pool = NetboxAsnPool(
+            netbox="http://mock",
+            name="test_range",
+            scope=[{"site": "test"}],
+            asn_range=[65001, 65100],
+            client=client,
+        )
+
+        m.get(
+            "http://mock/api/extras/object-changes/", json={"count": 0, "results": []}
+        )
+        m.get(URL, json={"count": 0, "results": []})
+        self.assertTrue(pool.sync())
+
+        ## The second sync uses the same query, it must not be served from the cache
+        m.get(
+            URL,
+            json={
+                "count": 1,
+                "results": [
+                    {"id": 2, "name": "device2", "custom_fields": {"ASN": 65002}}
+                ],
+            },
+        )
+        self.assertTrue(pool.sync())
+
+        self.assertEqual(pool.get(identifier="device3"), 65003)
+        self.assertEqual(pool.get(identifier="device2"), 65002)
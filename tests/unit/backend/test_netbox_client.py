@@ -0,0 +1,68 @@
+import unittest
+import requests_mock
+import yaml
+from os import path
+
+from resource_manager.backend.netbox_client import NetboxClient
+from resource_manager.backend.netbox_asn_manager import NetboxAsnManager
+from resource_manager.backend.netbox_utils import query_netbox
+
+here = path.abspath(path.dirname(__file__))
+
+FIXTURE_DIR = "fixtures/"
+
+
+class Test_NetboxClient(unittest.TestCase):
+    def test_from_config(self):
+
+        client = NetboxClient.from_config(
+            {"address": "http://mock", "pool_maxsize": 32, "keep_alive": False}
+        )
+
+        self.assertEqual(client.address, "http://mock")
+        self.assertEqual(client.adapter._pool_maxsize, 32)
+        self.assertIs(client.session.get_adapter("https://mock"), client.adapter)
+        self.assertEqual(client.session.headers["Connection"], "close")
+
+    @requests_mock.mock()
+    def test_query_netbox(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        client = NetboxClient("http://mock", timeout=5)
+        resp = query_netbox(
+            req=client,
+            url="http://mock/api/dcim/devices/",
+            params="is_network_device=True&site=test",
+        )
+
+        self.assertEqual(resp["count"], 3)
+        self.assertEqual(m.last_request.timeout, 5)
+
+    @requests_mock.mock()
+    def test_shared_by_manager(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+
+        asn_manager = NetboxAsnManager(config={"netbox": {"address": "http://mock"}})
+        for name in ["range1", "range2"]:
+            asn_manager.add_pool_specification(
+                name=name, spec={"scope": [{"site": "test"}], "range": [65001, 65100]}
+            )
+            asn_manager.resolve(var_type="ASN", var_params=name)
+
+        self.assertIs(asn_manager.asn_pools["range1"].nb, asn_manager.client)
+        self.assertIs(asn_manager.asn_pools["range2"].nb, asn_manager.client)
+
+
+def load_fixture(name):
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
@@ -105,7 +105,166 @@ class Test_NetboxIpPool(unittest.TestCase):
         self.assertEqual(str(pool.get(id=1)), "10.10.0.1/26")
         self.assertEqual(pool.get(id=2), False)  ## Already Reserved
 
+    @requests_mock.mock()
+    def test_parent_batch(self, m):
+
+        test_1 = load_fixture("test05_1_ipam_prefixes")
+        test_2 = load_fixture("test05_2_ipam_ipaddresses")
+        test_3 = load_fixture("test05_3_ipam_ipaddresses")
+
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test_1["params"],
+            json=test_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/ip-addresses/?offset=0&limit=500&parent=10.10.0.0%2f30&parent=10.10.1.0%2f30&fields=id,address,status,assigned_object,interface,last_updated",
+            json={
+                "count": 2,
+                "results": test_2["response"]["results"]
+                + test_3["response"]["results"],
+            },
+            complete_qs=True,
+        )
+
+        pool = NetboxIpPool(
+            netbox="http://mock",
+            site="test",
+            role="loopback",
+            family=4,
+            parent_batch_size=10,
+        )
+
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(str(pool.get()), "10.10.0.1/30")
+        self.assertEqual(str(pool.get()), "10.10.1.2/30")
+        self.assertEqual(str(pool.get(identifier="lb1::int1")), "10.10.0.2/30")
+
+    @requests_mock.mock()
+    def test_nested_prefixes(self, m):
+
+        m.get(
+            "http://mock/api/ipam/prefixes/",
+            json={
+                "count": 2,
+                "results": [
+                    {"id": 1, "prefix": "10.0.0.0/29"},
+                    {"id": 2, "prefix": "10.0.0.0/30"},
+                ],
+            },
+        )
+        m.get(
+            "http://mock/api/ipam/ip-addresses/",
+            json={
+                "count": 1,
+                "results": [{"id": 10, "address": "10.0.0.1/30", "status": "active"}],
+            },
+        )
+
+        pool = NetboxIpPool(
+            netbox="http://mock",
+            site="test",
+            role="loopback",
+            family=4,
+            parent_batch_size=10,
+        )
+
+        ## 10.0.0.1 is part of both prefixes
+        self.assertEqual(str(pool.get()), "10.0.0.2/29")
+        self.assertIsNone(pool.subnets[1].get())
+
+        self.assertTrue(pool.apply_event("ipam.ipaddress", "deleted", {"id": 10}))
+        self.assertIsNone(pool.subnets[0]._get_owner(1))
+        self.assertIsNone(pool.subnets[1]._get_owner(1))
+
+    @requests_mock.mock()
+    def test_slim_records(self, m):
+
+        test_1 = load_fixture("test04_1_ipam_prefixes")
+
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test_1["params"],
+            json=test_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/ip-addresses/?offset=0&limit=500&parent=10.10.0.0%2f26&fields=id,address,status,assigned_object,interface,last_updated",
+            json={
+                "count": 3,
+                "results": [
+                    {
+                        "id": 1,
+                        "address": "10.10.0.1/26",
+                        "status": "active",
+                        "assigned_object": {
+                            "name": "int1",
+                            "device": {"id": 1, "name": "lb1"},
+                        },
+                    },
+                    {"id": 2, "address": "10.10.0.2/26", "status": "deprecated"},
+                    {"id": 3, "address": "10.10.0.3/26"},
+                ],
+            },
+        )
+
+        pool = NetboxIpPool(
+            netbox="http://mock", site="test", role="loopback", family=4
+        )
+
+        self.assertEqual(str(pool.get(identifier="lb1::int1")), "10.10.0.1/26")
+        self.assertEqual(str(pool.get()), "10.10.0.2/26")
+        self.assertEqual(str(pool.get()), "10.10.0.4/26")
+
+    @requests_mock.mock()
+    def test_sync(self, m):
+
+        test_1 = load_fixture("test04_1_ipam_prefixes")
+        test_2 = load_fixture("test04_2_ipam_ipaddresses")
+
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test_1["params"],
+            json=test_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/ip-addresses/?%s" % test_2["params"],
+            json=test_2["response"],
+        )
+
+        pool = NetboxIpPool(
+            netbox="http://mock", site="test", role="loopback", family=4
+        )
+
+        m.get(
+            "http://mock/api/extras/object-changes/?changed_object_type=ipam.ipaddress&action=delete",
+            json={"count": 1, "results": [{"id": 100, "changed_object_id": 1}]},
+        )
+        m.get(
+            "http://mock/api/ipam/ip-addresses/",
+            json={
+                "count": 2,
+                "results": [
+                    {"id": 2, "address": "10.10.0.4/26", "status": "deprecated"},
+                    {
+                        "id": 3,
+                        "address": "10.10.0.1/26",
+                        "status": "active",
+                        "assigned_object": {
+                            "name": "int1",
+                            "device": {"id": 1, "name": "lb1"},
+                        },
+                    },
+                ],
+            },
+        )
+
+        self.assertTrue(pool.sync())
+        self.assertIn("last_updated__gte", m.last_request.qs)
+
+        self.assertEqual(str(pool.get(identifier="lb1::int1")), "10.10.0.1/26")
+        self.assertEqual(str(pool.get()), "10.10.0.2/26")
+        self.assertEqual(str(pool.get()), "10.10.0.3/26")
+        self.assertEqual(str(pool.get()), "10.10.0.4/26")
+
 
 def load_fixture(name):
 
-    return yaml.load(open(here + "/" + FIXTURE_DIR + name + ".json"))
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
@@ -75,6 +75,36 @@ class Test_NetboxNetManager(unittest.TestCase):
             "10.10.1.0/24",
         )
 
+    @requests_mock.mock()
+    def test_warm_up(self, m):
+
+        test03_1 = load_fixture("test03_1_ipam_prefixes")
+        test03_2 = load_fixture("test03_2_ipam_prefixes")
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_1["params"],
+            json=test03_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_2["params"],
+            json=test03_2["response"],
+        )
+
+        nnm = NetboxNetManager(config=VALID_CONFIG_1)
+        results = nnm.warm_up(["loopback/26", "loopback/24", "loopback/abc"])
+
+        self.assertTrue(results["loopback/26"]["loaded"])
+        self.assertTrue(results["loopback/24"]["loaded"])
+        self.assertFalse(results["loopback/abc"]["loaded"])
+        self.assertEqual(sorted(nnm.net_pools.keys()), ["loopback/24", "loopback/26"])
+
+        nbr_calls = m.call_count
+        self.assertEqual(
+            str(nnm.resolve("NET4", "loopback/26", identifier="first")),
+            "10.10.0.0/26",
+        )
+        self.assertEqual(m.call_count, nbr_calls)
+
 
 def load_fixture(name):
-    return yaml.load(open(here + "/" + FIXTURE_DIR + name + ".json"))
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
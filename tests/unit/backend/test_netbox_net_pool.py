@@ -56,7 +56,187 @@ class Test_NetboxNetPool(unittest.TestCase):
         self.assertEqual(str(pool.get(size=26, identifier="fourth")), "10.10.0.192/26")
         self.assertEqual(str(pool.get(size=24, identifier="fifth")), "10.10.1.0/24")
 
+    @requests_mock.mock()
+    def test_get_many(self, m):
+
+        test01_1 = load_fixture("test01_1_ipam_prefixes")
+        test01_2 = load_fixture("test01_2_ipam_prefixes")
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test01_1["params"],
+            json=test01_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test01_2["params"],
+            json=test01_2["response"],
+        )
+
+        pool = NetboxNetPool(
+            netbox="http://mock", site="test", role="loopback", family=4
+        )
+
+        self.assertEqual(
+            [str(net) for net in pool.get_many(26, ["first", "new1", None, "new1"])],
+            ["10.10.0.0/26", "10.10.0.64/26", "10.10.0.192/26", "10.10.0.64/26"],
+        )
+        self.assertEqual(str(pool.get(size=26, identifier="new1")), "10.10.0.64/26")
+
+    @requests_mock.mock()
+    def test_merge(self, m):
+
+        test01_1 = load_fixture("test01_1_ipam_prefixes")
+        test01_2 = load_fixture("test01_2_ipam_prefixes")
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test01_1["params"],
+            json=test01_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test01_2["params"],
+            json=test01_2["response"],
+        )
+
+        stale_pool = NetboxNetPool(
+            netbox="http://mock", site="test", role="loopback", family=4
+        )
+        self.assertEqual(
+            str(stale_pool.get(size=26, identifier="new1")), "10.10.0.64/26"
+        )
+        self.assertTrue(stale_pool.has_unsaved())
+
+        ## The pool loaded again from Netbox gets the prefixes allocated by the stale one
+        pool = NetboxNetPool(
+            netbox="http://mock", site="test", role="loopback", family=4
+        )
+        self.assertTrue(pool.merge(stale_pool))
+
+        self.assertEqual(str(pool.get(size=26, identifier="new1")), "10.10.0.64/26")
+        self.assertEqual(str(pool.get(size=26, identifier="new2")), "10.10.0.192/26")
+        self.assertEqual(
+            str(stale_pool.get(size=26, identifier="new2")), "10.10.0.192/26"
+        )
+        self.assertEqual(sorted(pool.unsaved), ["10.10.0.192/26", "10.10.0.64/26"])
+
+    @requests_mock.mock()
+    def test_parent_batch(self, m):
+
+        m.get(
+            "http://mock/api/ipam/prefixes/?offset=0&limit=500&role=loopback&family=4&status=0&fields=id,prefix,description,last_updated",
+            json={
+                "count": 2,
+                "results": [
+                    {"id": 1, "prefix": "10.10.0.0/16", "description": ""},
+                    {"id": 2, "prefix": "10.20.0.0/16", "description": ""},
+                ],
+            },
+            complete_qs=True,
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?offset=0&limit=500&parent=10.10.0.0/16&parent=10.20.0.0/16&family=4&fields=id,prefix,description,last_updated",
+            json={
+                "count": 4,
+                "results": [
+                    {"id": 3, "prefix": "10.10.0.0/26", "description": "first"},
+                    {"id": 4, "prefix": "10.20.0.0/24", "description": "second"},
+                    {"id": 5, "prefix": "10.20.0.0/26", "description": "nested"},
+                    {"id": 6, "prefix": "10.30.0.0/24", "description": "other"},
+                ],
+            },
+            complete_qs=True,
+        )
+
+        pool = NetboxNetPool(
+            netbox="http://mock", role="loopback", family=4, parent_batch_size=10
+        )
+
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(len(pool.prefixes), 2)
+        self.assertEqual(str(pool.get(size=26, identifier="first")), "10.10.0.0/26")
+        self.assertEqual(str(pool.get(size=24, identifier="second")), "10.20.0.0/24")
+        self.assertEqual(str(pool.get(size=26)), "10.10.0.64/26")
+        self.assertFalse(pool.prefixes[1].check_if_already_allocated("nested"))
+
+    @requests_mock.mock()
+    def test_parent_batch_nested(self, m):
+
+        m.get(
+            "http://mock/api/ipam/prefixes/?offset=0&limit=500&role=loopback&family=4&status=0&fields=id,prefix,description,last_updated",
+            json={
+                "count": 2,
+                "results": [
+                    {"id": 1, "prefix": "10.10.0.0/16", "description": ""},
+                    {"id": 2, "prefix": "10.10.1.0/24", "description": ""},
+                ],
+            },
+            complete_qs=True,
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?offset=0&limit=500&parent=10.10.0.0/16&parent=10.10.1.0/24&family=4&fields=id,prefix,description,last_updated",
+            json={
+                "count": 5,
+                "results": [
+                    {"id": 1, "prefix": "10.10.0.0/16", "description": ""},
+                    {"id": 3, "prefix": "10.10.0.0/24", "description": "first"},
+                    {"id": 2, "prefix": "10.10.1.0/24", "description": ""},
+                    {"id": 4, "prefix": "10.10.1.0/26", "description": "inner"},
+                    {"id": 5, "prefix": "10.10.2.0/24", "description": "outer"},
+                ],
+            },
+            complete_qs=True,
+        )
+
+        pool = NetboxNetPool(
+            netbox="http://mock", role="loopback", family=4, parent_batch_size=10
+        )
+
+        outer, inner = pool.prefixes
+        self.assertEqual(str(outer.sub_by_id["outer"]), "10.10.2.0/24")
+        self.assertEqual(str(outer.sub_by_id["first"]), "10.10.0.0/24")
+        self.assertIn("10.10.1.0/24", outer.sub_by_key)
+        self.assertEqual(str(inner.sub_by_id["inner"]), "10.10.1.0/26")
+        self.assertEqual(str(pool.get(size=24, identifier="outer")), "10.10.2.0/24")
+        self.assertEqual(str(pool.get(size=24)), "10.10.3.0/24")
+
+    @requests_mock.mock()
+    def test_sync(self, m):
+
+        test03_1 = load_fixture("test03_1_ipam_prefixes")
+        test03_2 = load_fixture("test03_2_ipam_prefixes")
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_1["params"],
+            json=test03_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_2["params"],
+            json=test03_2["response"],
+        )
+
+        pool = NetboxNetPool(netbox="http://mock", role="loopback", family=4)
+
+        m.get(
+            "http://mock/api/extras/object-changes/?changed_object_type=ipam.prefix&action=delete",
+            json={"count": 1, "results": [{"id": 100, "changed_object_id": 1}]},
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/",
+            json={
+                "count": 2,
+                "results": [
+                    {"id": 2, "prefix": "10.10.0.128/26", "description": "third"},
+                    {"id": 3, "prefix": "10.10.0.64/26", "description": "second"},
+                ],
+            },
+        )
+
+        self.assertTrue(pool.sync())
+        self.assertIn("last_updated__gte", m.last_request.qs)
+
+        self.assertNotIn("first", pool.prefixes[0].sub_by_id)
+        self.assertEqual(str(pool.get(size=26, identifier="second")), "10.10.0.64/26")
+        self.assertEqual(str(pool.get(size=26, identifier="third")), "10.10.0.128/26")
+        self.assertEqual(str(pool.get(size=26, identifier="new")), "10.10.0.0/26")
+        self.assertEqual(str(pool.get(size=26, identifier="other")), "10.10.0.192/26")
+
 
 def load_fixture(name):
 
-    return yaml.load(open(here + "/" + FIXTURE_DIR + name + ".json"))
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
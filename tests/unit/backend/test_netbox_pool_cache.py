@@ -0,0 +1,165 @@
+import unittest
+import threading
+
+from resource_manager.backend.netbox_pool_cache import NetboxPoolCache, get_size
+
+
+class Pool(object):
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+
+
+class Loader(object):
+    def __init__(self, fail_after=None):
+        self.calls = 0
+        self.fail_after = fail_after
+        self.lock = threading.Lock()
+
+    def __call__(self, name):
+        with self.lock:
+            self.calls += 1
+
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise Exception("Netbox not available")
+
+        return Pool(name, self.calls)
+
+
+class Test_NetboxPoolCache(unittest.TestCase):
+    def test_load(self):
+
+        loader = Loader()
+        cache = NetboxPoolCache(loader)
+
+        pool = cache.load("pool1", "pool1")
+        self.assertEqual(pool.name, "pool1")
+        self.assertIs(cache.load("pool1", "pool1"), pool)
+        self.assertIs(cache["pool1"], pool)
+
+        self.assertEqual(loader.calls, 1)
+        self.assertIn("pool1", cache)
+        self.assertEqual(cache.keys(), ["pool1"])
+        self.assertEqual(cache.values(), [pool])
+
+        with self.assertRaises(KeyError):
+            cache["pool2"]
+
+    def test_stale_while_revalidate(self):
+
+        loader = Loader()
+        cache = NetboxPoolCache(loader, ttl=0)
+
+        pool = cache.load("pool1", "pool1")
+
+        ## The stale pool is returned while the new one is loaded
+        self.assertIs(cache.load("pool1", "pool1"), pool)
+        cache.join()
+
+        self.assertEqual(cache["pool1"].version, 2)
+        self.assertEqual(cache.refreshes, 1)
+
+    def test_refresh_error(self):
+
+        loader = Loader(fail_after=1)
+        cache = NetboxPoolCache(loader, ttl=0)
+
+        pool = cache.load("pool1", "pool1")
+        cache.load("pool1", "pool1")
+        cache.join()
+
+        self.assertIs(cache["pool1"], pool)
+        self.assertEqual(cache.refreshes, 0)
+
+    def test_refresh_merge(self):
+
+        merged = []
+        cache = NetboxPoolCache(
+            Loader(), ttl=0, merge=lambda stale, pool: merged.append((stale, pool))
+        )
+
+        pool = cache.load("pool1", "pool1")
+        cache.load("pool1", "pool1")
+        cache.join()
+
+        self.assertEqual(merged, [(pool, cache["pool1"])])
+        self.assertEqual(cache["pool1"].version, 2)
+
+    def test_refresh_merge_error(self):
+
+        def merge(stale, pool):
+            raise Exception("conflict")
+
+        cache = NetboxPoolCache(Loader(), ttl=0, merge=merge)
+
+        pool = cache.load("pool1", "pool1")
+        cache.load("pool1", "pool1")
+        cache.join()
+
+        self.assertIs(cache["pool1"], pool)
+        self.assertEqual(cache.refreshes, 0)
+
+    def test_refresh_reloader(self):
+
+        reloaded = []
+
+        def reloader(name):
+            reloaded.append(name)
+            return "new " + name
+
+        cache = NetboxPoolCache(Loader(), ttl=0, reloader=reloader)
+
+        cache.load("pool1", "pool1")
+        cache.load("pool1", "pool1")
+        cache.join()
+
+        self.assertEqual(reloaded, ["pool1"])
+        self.assertEqual(cache["pool1"], "new pool1")
+
+    def test_max_pools(self):
+
+        cache = NetboxPoolCache(Loader(), max_pools=2)
+
+        cache.load("pool1", "pool1")
+        cache.load("pool2", "pool2")
+        cache.load("pool1", "pool1")
+        cache.load("pool3", "pool3")
+
+        self.assertEqual(sorted(cache.keys()), ["pool1", "pool3"])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_can_evict(self):
+
+        cache = NetboxPoolCache(
+            Loader(), max_pools=2, can_evict=lambda pool: pool.name != "pool1"
+        )
+
+        for name in ["pool1", "pool2", "pool3", "pool4"]:
+            cache.load(name, name)
+
+        self.assertEqual(cache.keys(), ["pool1", "pool4"])
+        self.assertEqual(cache.evictions, 2)
+
+        ## No pool can be evicted, the cache goes over its limit
+        cache.can_evict = lambda pool: False
+        cache.load("pool5", "pool5")
+
+        self.assertEqual(len(cache), 3)
+
+    def test_max_memory(self):
+
+        cache = NetboxPoolCache(Loader(), max_memory=250, sizeof=lambda pool: 100)
+
+        for name in ["pool1", "pool2", "pool3"]:
+            cache.load(name, name)
+
+        self.assertEqual(cache.keys(), ["pool2", "pool3"])
+        self.assertEqual(cache.memory, 200)
+
+    def test_get_size(self):
+
+        shared = list(range(0, 1000))
+        pool = Pool("pool1", shared)
+
+        self.assertGreater(get_size(pool), get_size(Pool("pool1", [])))
+        self.assertLess(get_size(pool, exclude=[shared]), get_size(Pool("pool1", [])))
@@ -0,0 +1,406 @@
+import unittest
+import time
+import threading
+import requests
+import requests_mock
+
+from resource_manager.backend.netbox_utils import (
+    query_netbox,
+    iter_netbox,
+    add_fields,
+    get_status,
+    get_interface_identifier,
+    match_filters,
+    parse_time,
+    PrefixIndex,
+    SingleFlight,
+    SyncWatermark,
+)
+
+
+def register_pages(m, url, params, nbr_results, batch_size):
+
+    for offset in range(0, nbr_results, batch_size):
+        results = [
+            {"id": i} for i in range(offset, min(offset + batch_size, nbr_results))
+        ]
+        m.get(
+            "%s?offset=%s&limit=%s&%s" % (url, offset, batch_size, params),
+            json={"count": nbr_results, "results": results},
+        )
+
+
+def register_keyset_pages(m, url, params, ids, batch_size):
+
+    last_id = None
+    for i in range(0, len(ids) + 1, batch_size):
+        page = ids[i : i + batch_size]
+        query = "ordering=id&limit=%s" % batch_size
+        if last_id is not None:
+            query += "&id__gt=%s" % last_id
+
+        m.get(
+            "%s?%s&%s" % (url, query, params),
+            json={"count": len(ids) - i, "results": [{"id": id} for id in page]},
+            complete_qs=True,
+        )
+
+        if len(page) < batch_size:
+            break
+
+        last_id = page[-1]
+
+
+class Test_QueryNetbox(unittest.TestCase):
+    @requests_mock.mock()
+    def test_single_page(self, m):
+
+        register_pages(m, "http://mock/api/dcim/devices/", "site=test", 3, 10)
+
+        resp = query_netbox(
+            req=requests.session(),
+            url="http://mock/api/dcim/devices/",
+            params="site=test",
+            batch_size=10,
+        )
+
+        self.assertEqual(resp["count"], 3)
+        self.assertEqual(len(resp["results"]), 3)
+        self.assertEqual(m.call_count, 1)
+
+    @requests_mock.mock()
+    def test_concurrent_pages(self, m):
+
+        register_pages(m, "http://mock/api/dcim/devices/", "site=test", 95, 10)
+
+        resp = query_netbox(
+            req=requests.session(),
+            url="http://mock/api/dcim/devices/",
+            params="site=test",
+            batch_size=10,
+            concurrency=4,
+            timeout=5,
+        )
+
+        self.assertEqual(resp["count"], 95)
+        self.assertEqual([r["id"] for r in resp["results"]], list(range(0, 95)))
+        self.assertEqual(m.call_count, 10)
+
+    @requests_mock.mock()
+    def test_sequential_pages(self, m):
+
+        register_pages(m, "http://mock/api/dcim/devices/", "site=test", 20, 10)
+
+        resp = query_netbox(
+            req=requests.session(),
+            url="http://mock/api/dcim/devices/",
+            params="site=test",
+            batch_size=10,
+            concurrency=1,
+        )
+
+        self.assertEqual([r["id"] for r in resp["results"]], list(range(0, 20)))
+        self.assertEqual(m.call_count, 2)
+
+
+class Test_IterNetbox(unittest.TestCase):
+    @requests_mock.mock()
+    def test_iter_in_order(self, m):
+
+        register_pages(m, "http://mock/api/ipam/ip-addresses/", "parent=x", 95, 10)
+
+        records = iter_netbox(
+            req=requests.session(),
+            url="http://mock/api/ipam/ip-addresses/",
+            params="parent=x",
+            batch_size=10,
+            concurrency=3,
+        )
+
+        self.assertEqual([r["id"] for r in records], list(range(0, 95)))
+        self.assertEqual(m.call_count, 10)
+
+    @requests_mock.mock()
+    def test_iter_bounded(self, m):
+
+        register_pages(m, "http://mock/api/ipam/ip-addresses/", "parent=x", 95, 10)
+
+        records = iter_netbox(
+            req=requests.session(),
+            url="http://mock/api/ipam/ip-addresses/",
+            params="parent=x",
+            batch_size=10,
+            concurrency=2,
+        )
+
+        ## Consume the first 2 pages only
+        for i in range(0, 15):
+            next(records)
+
+        records.close()
+
+        self.assertLessEqual(m.call_count, 4)
+
+
+class Test_KeysetPaging(unittest.TestCase):
+    @requests_mock.mock()
+    def test_keyset_pages(self, m):
+
+        ids = list(range(5, 100, 4))
+        register_keyset_pages(
+            m, "http://mock/api/ipam/ip-addresses/", "parent=x", ids, 10
+        )
+
+        resp = query_netbox(
+            req=requests.session(),
+            url="http://mock/api/ipam/ip-addresses/",
+            params="parent=x",
+            batch_size=10,
+            paging="keyset",
+        )
+
+        self.assertEqual(resp["count"], len(ids))
+        self.assertEqual([r["id"] for r in resp["results"]], ids)
+        self.assertEqual(m.call_count, 3)
+
+    @requests_mock.mock()
+    def test_keyset_exact_pages(self, m):
+
+        ids = list(range(1, 21))
+        register_keyset_pages(
+            m, "http://mock/api/ipam/ip-addresses/", "parent=x", ids, 10
+        )
+
+        records = iter_netbox(
+            req=requests.session(),
+            url="http://mock/api/ipam/ip-addresses/",
+            params="parent=x",
+            batch_size=10,
+            paging="keyset",
+        )
+
+        self.assertEqual([r["id"] for r in records], ids)
+        self.assertEqual(m.call_count, 3)
+
+    @requests_mock.mock()
+    def test_keyset_fallback_to_offset(self, m):
+
+        url = "http://mock/api/ipam/ip-addresses/"
+
+        ## The server ignores the id filter and returns the first page again
+        first_page = {"count": 25, "results": [{"id": i} for i in range(0, 10)]}
+        m.get(url + "?ordering=id&limit=10&parent=x", json=first_page, complete_qs=True)
+        m.get(
+            url + "?ordering=id&limit=10&id__gt=9&parent=x",
+            json=first_page,
+            complete_qs=True,
+        )
+        register_pages(m, url, "ordering=id&parent=x", 25, 10)
+
+        resp = query_netbox(
+            req=requests.session(),
+            url=url,
+            params="parent=x",
+            batch_size=10,
+            paging="keyset",
+        )
+
+        self.assertEqual(resp["count"], 25)
+        self.assertEqual([r["id"] for r in resp["results"]], list(range(0, 25)))
+        self.assertEqual(m.call_count, 4)
+
+    def test_unknown_paging(self):
+
+        with self.assertRaises(Exception):
+            query_netbox(
+                req=requests.session(),
+                url="http://mock/api/ipam/ip-addresses/",
+                params="parent=x",
+                paging="cursor",
+            )
+
+
+class Test_Fields(unittest.TestCase):
+    @requests_mock.mock()
+    def test_query_fields(self, m):
+
+        m.get(
+            "http://mock/api/dcim/devices/?offset=0&limit=10&site=test&fields=id,name",
+            json={"count": 1, "results": [{"id": 1, "name": "dev1"}]},
+            complete_qs=True,
+        )
+
+        resp = query_netbox(
+            req=requests.session(),
+            url="http://mock/api/dcim/devices/",
+            params="site=test",
+            batch_size=10,
+            fields=["id", "name"],
+        )
+
+        self.assertEqual(resp["results"], [{"id": 1, "name": "dev1"}])
+
+    def test_add_fields(self):
+
+        self.assertEqual(add_fields("site=test", ["name"]), "site=test&fields=name")
+        self.assertEqual(
+            add_fields("site=test", ["name"], paging="keyset"),
+            "site=test&fields=id,name",
+        )
+
+    def test_get_status(self):
+
+        self.assertEqual(
+            get_status({"status": {"value": 1, "label": "Active"}}), "active"
+        )
+        self.assertEqual(get_status({"status": {"value": "reserved"}}), "reserved")
+        self.assertEqual(get_status({"status": "deprecated"}), "deprecated")
+        self.assertIsNone(get_status({"address": "10.0.0.1/32"}))
+
+    def test_get_interface_identifier(self):
+
+        interface = {"name": "int1", "device": {"name": "dev1"}}
+
+        self.assertEqual(
+            get_interface_identifier({"assigned_object": interface}), "dev1::int1"
+        )
+        self.assertEqual(
+            get_interface_identifier({"interface": interface}), "dev1::int1"
+        )
+        self.assertIsNone(
+            get_interface_identifier({"assigned_object": {"name": "eth0"}})
+        )
+        self.assertIsNone(get_interface_identifier({"interface": None}))
+
+
+class Test_SingleFlight(unittest.TestCase):
+    @requests_mock.mock()
+    def test_concurrent_queries(self, m):
+
+        def slow_page(request, context):
+            time.sleep(0.1)
+            return {"count": 1, "results": [{"id": 1}]}
+
+        m.get("http://mock/api/dcim/devices/?site=test", json=slow_page)
+        m.get("http://mock/api/dcim/devices/?site=other", json=slow_page)
+
+        session = requests.session()
+        results = []
+
+        def query(params):
+            results.append(
+                query_netbox(
+                    req=session, url="http://mock/api/dcim/devices/", params=params
+                )
+            )
+
+        threads = [
+            threading.Thread(target=query, args=(params,))
+            for params in ["site=test"] * 4 + ["site=other"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0]["results"], [{"id": 1}])
+
+    def test_error(self):
+
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            flight.do("key", fail)
+
+        self.assertEqual(flight.calls, {})
+        self.assertEqual(flight.do("key", lambda: 1), 1)
+
+
+class Test_MatchFilters(unittest.TestCase):
+    def test_match_filters(self):
+
+        dev = {
+            "site": {"id": 1, "slug": "test"},
+            "device_role": {"id": 2, "slug": "leaf"},
+            "status": {"value": "active", "label": "Active"},
+            "tags": [{"slug": "evpn"}],
+        }
+
+        self.assertTrue(match_filters(dev, {"site": "test", "role": "leaf"}))
+        self.assertTrue(match_filters(dev, {"site_id": 1, "tag": "evpn"}))
+        self.assertTrue(match_filters(dev, {"status": "active"}))
+        self.assertFalse(match_filters(dev, {"role": "spine"}))
+        self.assertFalse(match_filters(dev, {"region": "eu", "tag": "mpls"}))
+        self.assertIsNone(match_filters(dev, {"site": "test", "region": "eu"}))
+        self.assertIsNone(match_filters({"name": "device1"}, {"site": "test"}))
+
+
+class Test_PrefixIndex(unittest.TestCase):
+    def test_lookup(self):
+
+        index = PrefixIndex(
+            [("10.0.1.0/24", "second"), ("10.0.0.0/24", "first"), ("::/64", "v6")]
+        )
+
+        self.assertEqual(index.lookup(4, 167772161), "first")
+        self.assertEqual(index.lookup(4, 167772417), "second")
+        self.assertIsNone(index.lookup(4, 167772929))
+        self.assertIsNone(index.lookup(4, 1))
+        self.assertEqual(index.lookup(6, 1), "v6")
+
+    def test_lookup_nested(self):
+
+        index = PrefixIndex(
+            [
+                ("10.0.1.0/24", "inner"),
+                ("10.0.0.0/16", "outer"),
+                ("10.0.1.128/25", "innermost"),
+                ("10.1.0.0/24", "other"),
+            ]
+        )
+
+        ## 10.0.2.5, the closest lower prefix is 10.0.1.128/25
+        self.assertEqual(index.lookup(4, 167772677), "outer")
+        ## 10.0.1.5 and 10.0.1.200
+        self.assertEqual(index.lookup(4, 167772421), "inner")
+        self.assertEqual(index.lookup(4, 167772616), "innermost")
+        ## 10.0.1.0, only the prefixes shorter than /24
+        self.assertEqual(index.lookup(4, 167772416, prefixlen=24), "outer")
+        self.assertIsNone(index.lookup(4, 167772416, prefixlen=16))
+        ## 10.0.255.255 and 10.1.0.5
+        self.assertEqual(index.lookup(4, 167837695), "outer")
+        self.assertEqual(index.lookup(4, 167837701), "other")
+
+        ## 10.0.1.200 and 10.0.2.5
+        self.assertEqual(
+            index.lookup_all(4, 167772616), ["innermost", "inner", "outer"]
+        )
+        self.assertEqual(index.lookup_all(4, 167772677), ["outer"])
+        self.assertEqual(index.lookup_all(4, 1), [])
+
+
+class Test_SyncWatermark(unittest.TestCase):
+    def test_parse_time(self):
+
+        self.assertEqual(parse_time("2020-04-02T09:12:44Z"), 1585818764)
+        self.assertEqual(parse_time("2020-04-02T09:12:44.5Z"), 1585818764.5)
+        self.assertEqual(parse_time("2020-04-02T11:12:44+02:00"), 1585818764)
+        self.assertIsNone(parse_time(None))
+        self.assertIsNone(parse_time("yesterday"))
+
+    def test_since(self):
+
+        watermark = SyncWatermark(margin=60)
+        watermark.started_at = 0
+        self.assertEqual(watermark.since(), "1969-12-31T23:59:00Z")
+
+        ## The newest time returned by Netbox is used, not the local clock
+        watermark.update("2020-04-02T09:12:44.089271Z")
+        watermark.update("2020-04-02T09:10:00Z")
+        watermark.update(None)
+        self.assertEqual(watermark.since(), "2020-04-02T09:11:44Z")
@@ -0,0 +1,156 @@
+import unittest
+import json
+import requests_mock
+import yaml
+from os import path
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from resource_manager.backend.netbox_asn_manager import NetboxAsnManager
+from resource_manager.backend.netbox_ip_pool import NetboxIpPool
+from resource_manager.backend.netbox_net_pool import NetboxNetPool
+from resource_manager.backend.netbox_webhook import (
+    NetboxWebhookReceiver,
+    get_object_type,
+    get_signature,
+)
+
+here = path.abspath(path.dirname(__file__))
+
+FIXTURE_DIR = "fixtures/"
+
+
+def post(url, payload, signature=None):
+
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if signature:
+        headers["X-Hook-Signature"] = signature
+
+    resp = urlopen(Request(url, data=body, headers=headers))
+
+    return json.loads(resp.read().decode("utf-8"))
+
+
+class Test_NetboxWebhook(unittest.TestCase):
+    @requests_mock.mock()
+    def setUp(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        test03_1 = load_fixture("test03_1_ipam_prefixes")
+        test03_2 = load_fixture("test03_2_ipam_prefixes")
+        test04_1 = load_fixture("test04_1_ipam_prefixes")
+        test04_2 = load_fixture("test04_2_ipam_ipaddresses")
+
+        for test, url in [
+            (test02_1, "http://mock/api/dcim/devices/"),
+            (test03_1, "http://mock/api/ipam/prefixes/"),
+            (test03_2, "http://mock/api/ipam/prefixes/"),
+            (test04_1, "http://mock/api/ipam/prefixes/"),
+            (test04_2, "http://mock/api/ipam/ip-addresses/"),
+        ]:
+            m.get("%s?%s" % (url, test["params"]), json=test["response"])
+
+        self.asn_manager = NetboxAsnManager(
+            config={"netbox": {"address": "http://mock"}}
+        )
+        self.asn_manager.add_pool_specification(
+            name="range1", spec={"scope": [{"site": "test"}], "range": [65001, 65100]}
+        )
+        self.asn_manager.resolve(var_type="ASN", var_params="range1")
+
+        self.ip_pool = NetboxIpPool(
+            netbox="http://mock", site="test", role="loopback", family=4
+        )
+        self.net_pool = NetboxNetPool(netbox="http://mock", role="loopback", family=4)
+
+        self.receiver = NetboxWebhookReceiver(
+            targets=[self.asn_manager, self.ip_pool, self.net_pool]
+        )
+        self.receiver.start()
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def test_ipaddress(self):
+
+        payload = load_fixture("test06_1_webhook_ipam_ipaddress")
+
+        self.assertEqual(post(self.receiver.url, payload), {"applied": 1})
+        self.assertEqual(str(self.ip_pool.get(identifier="lb2::int1")), "10.10.0.1/26")
+
+        ## Delete the IP from the initial load
+        payload = {"event": "deleted", "model": "ipaddress", "data": {"id": 1}}
+
+        self.assertEqual(post(self.receiver.url, payload), {"applied": 1})
+        self.assertEqual(str(self.ip_pool.get()), "10.10.0.2/26")
+
+    def test_device(self):
+
+        payload = load_fixture("test06_2_webhook_dcim_device")
+
+        self.assertEqual(post(self.receiver.url, payload), {"applied": 1})
+        self.assertEqual(
+            self.asn_manager.resolve("ASN", "range1", identifier="device10"), 65020
+        )
+
+        ## device2 is moved to another site
+        payload["data"]["id"] = 2
+        payload["data"]["name"] = "device2"
+        payload["data"]["site"] = {"id": 2, "name": "Other", "slug": "other"}
+        payload["data"]["custom_fields"]["ASN"] = 65002
+
+        self.assertEqual(post(self.receiver.url, payload), {"applied": 1})
+        self.assertEqual(
+            self.asn_manager.resolve("ASN", "range1", identifier="new"), 65002
+        )
+
+    def test_prefix(self):
+
+        payload = load_fixture("test06_3_webhook_ipam_prefix")
+
+        self.assertEqual(post(self.receiver.url, payload), {"applied": 1})
+        self.assertNotIn("first", self.net_pool.prefixes[0].sub_by_id)
+        self.assertTrue(
+            self.net_pool.prefixes[0].reserve("10.10.0.0/26", identifier="new")
+        )
+
+    def test_not_supported(self):
+
+        payload = {"event": "created", "model": "site", "data": {"id": 1}}
+        self.assertEqual(post(self.receiver.url, payload), {"applied": 0})
+
+        with self.assertRaises(HTTPError) as err:
+            urlopen(Request(self.receiver.url, data=b"{not json"))
+
+        self.assertEqual(err.exception.code, 400)
+
+    def test_signature(self):
+
+        self.receiver.secret = "secret"
+        payload = load_fixture("test06_3_webhook_ipam_prefix")
+
+        with self.assertRaises(HTTPError) as err:
+            post(self.receiver.url, payload, signature="invalid")
+
+        self.assertEqual(err.exception.code, 403)
+
+        signature = get_signature("secret", json.dumps(payload).encode("utf-8"))
+        self.assertEqual(
+            post(self.receiver.url, payload, signature=signature), {"applied": 1}
+        )
+
+    def test_object_type(self):
+
+        self.assertEqual(get_object_type({"model": "prefix"}), "ipam.prefix")
+        self.assertEqual(
+            get_object_type({"model": "device", "object_type": "dcim.device"}),
+            "dcim.device",
+        )
+        self.assertIsNone(get_object_type({"model": "site"}))
+
+
+def load_fixture(name):
+
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
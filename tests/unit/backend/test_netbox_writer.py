@@ -0,0 +1,299 @@
+import threading
+import unittest
+import requests
+import requests_mock
+import yaml
+from os import path
+
+from resource_manager.backend.netbox_writer import NetboxWriteQueue
+from resource_manager.backend.netbox_ip_pool import NetboxIpPool
+from resource_manager.backend.netbox_asn_manager import NetboxAsnManager
+from resource_manager.backend.netbox_net_manager import NetboxNetManager
+
+here = path.abspath(path.dirname(__file__))
+
+FIXTURE_DIR = "fixtures/"
+
+
+def bulk_create(request, context):
+    return [dict(item, id=i + 1) for i, item in enumerate(request.json())]
+
+
+class Test_NetboxWriteQueue(unittest.TestCase):
+    @requests_mock.mock()
+    def test_batches(self, m):
+
+        m.post("http://mock/api/ipam/ip-addresses/", json=bulk_create)
+
+        queue = NetboxWriteQueue(requests.session(), "http://mock", batch_size=100)
+        written = []
+
+        for i in range(0, 250):
+            queue.add(
+                "/api/ipam/ip-addresses/",
+                {"address": "10.0.%s.%s/32" % (i // 256, i % 256)},
+                on_success=written.append,
+            )
+
+        self.assertEqual(len(queue), 250)
+        self.assertEqual(queue.flush(), {"written": 250, "conflicts": 0})
+        self.assertEqual(len(queue), 0)
+
+        self.assertEqual(m.call_count, 3)
+        self.assertEqual([len(r.json()) for r in m.request_history], [100, 100, 50])
+        self.assertEqual(written[0].result["id"], 1)
+
+    @requests_mock.mock()
+    def test_conflicts(self, m):
+
+        m.patch(
+            "http://mock/api/dcim/devices/",
+            [
+                {"status_code": 400, "json": [{}, {"id": ["Not found"]}, {}]},
+                {"json": bulk_create},
+            ],
+        )
+
+        queue = NetboxWriteQueue(requests.session(), "http://mock")
+        rejected = []
+
+        for dev_id in [1, 2, 3]:
+            queue.add(
+                "/api/dcim/devices/",
+                {"id": dev_id, "custom_fields": {"ASN": 65000 + dev_id}},
+                method="PATCH",
+                on_error=rejected.append,
+            )
+
+        self.assertEqual(queue.flush(), {"written": 2, "conflicts": 1})
+
+        self.assertEqual(m.call_count, 2)
+        self.assertEqual([item["id"] for item in m.last_request.json()], [1, 3])
+        self.assertEqual(rejected[0].data["id"], 2)
+        self.assertEqual(rejected[0].error, {"id": ["Not found"]})
+        self.assertEqual(queue.conflicts, rejected)
+
+    @requests_mock.mock()
+    def test_concurrent_add(self, m):
+
+        m.post("http://mock/api/ipam/prefixes/", json=bulk_create)
+
+        queue = NetboxWriteQueue(requests.session(), "http://mock")
+
+        def add_prefixes(start):
+            for i in range(start, start + 200):
+                queue.add("/api/ipam/prefixes/", {"prefix": "10.%s.0.0/24" % i})
+
+        threads = [threading.Thread(target=add_prefixes, args=(i,)) for i in [0, 200]]
+        for thread in threads:
+            thread.start()
+
+        written = 0
+        while any(thread.is_alive() for thread in threads):
+            written += queue.flush()["written"]
+
+        for thread in threads:
+            thread.join()
+
+        written += queue.flush()["written"]
+
+        self.assertEqual(written, 400)
+        self.assertEqual(len(queue), 0)
+
+    @requests_mock.mock()
+    def test_server_error(self, m):
+
+        m.post(
+            "http://mock/api/ipam/prefixes/",
+            [
+                {"status_code": 500, "text": "error"},
+                {"exc": requests.exceptions.ConnectTimeout},
+                {"json": bulk_create},
+            ],
+        )
+
+        queue = NetboxWriteQueue(requests.session(), "http://mock")
+        rejected = []
+        queue.add(
+            "/api/ipam/prefixes/", {"prefix": "10.0.0.0/24"}, on_error=rejected.append
+        )
+        queue.add(
+            "/api/ipam/prefixes/", {"prefix": "10.0.1.0/24"}, on_error=rejected.append
+        )
+
+        ## The objects are kept in the queue until Netbox accepts or rejects them
+        self.assertEqual(queue.flush(), {"written": 0, "conflicts": 0})
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.flush(), {"written": 0, "conflicts": 0})
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.flush(), {"written": 2, "conflicts": 0})
+        self.assertEqual(len(queue), 0)
+
+        self.assertEqual(m.call_count, 3)
+        self.assertEqual(rejected, [])
+        self.assertEqual(queue.conflicts, [])
+
+    @requests_mock.mock()
+    def test_ip_pool(self, m):
+
+        test_1 = load_fixture("test04_1_ipam_prefixes")
+        test_2 = load_fixture("test04_2_ipam_ipaddresses")
+
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test_1["params"],
+            json=test_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/ip-addresses/?%s" % test_2["params"],
+            json=test_2["response"],
+        )
+        m.post(
+            "http://mock/api/ipam/ip-addresses/",
+            [
+                {"status_code": 400, "json": [{}, {"address": ["Duplicate"]}]},
+                {"json": bulk_create},
+            ],
+        )
+
+        queue = NetboxWriteQueue(requests.session(), "http://mock")
+        pool = NetboxIpPool(
+            netbox="http://mock",
+            site="test",
+            role="loopback",
+            family=4,
+            write_queue=queue,
+        )
+
+        self.assertEqual(str(pool.get(identifier="lb5::int1")), "10.10.0.1/26")
+        self.assertEqual(str(pool.get(identifier="lb3::int1")), "10.10.0.3/26")
+        self.assertEqual(str(pool.get(identifier="lb5::int1")), "10.10.0.1/26")
+
+        self.assertEqual(queue.flush(), {"written": 1, "conflicts": 1})
+        self.assertEqual(
+            m.last_request.json(),
+            [
+                {
+                    "address": "10.10.0.1/26",
+                    "status": "active",
+                    "description": "lb5::int1",
+                }
+            ],
+        )
+        self.assertEqual(pool.ips_by_netbox_id[1], "10.10.0.1/26")
+
+        ## The IP rejected has been released
+        self.assertEqual(str(pool.get()), "10.10.0.3/26")
+
+    @requests_mock.mock()
+    def test_asn_manager(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+        m.patch("http://mock/api/dcim/devices/", json=bulk_create)
+
+        asn_manager = NetboxAsnManager(
+            config={"netbox": {"address": "http://mock", "write_back": True}}
+        )
+        asn_manager.add_pool_specification(
+            name="range1", spec={"scope": [{"site": "test"}], "range": [65001, 65100]}
+        )
+
+        self.assertEqual(
+            asn_manager.resolve("ASN", "range1", identifier="device1"), 65001
+        )
+        self.assertEqual(
+            asn_manager.resolve("ASN", "range1", identifier="device3"), 65003
+        )
+
+        self.assertEqual(asn_manager.flush(), {"written": 0, "conflicts": 0})
+
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json={
+                "count": 1,
+                "results": [{"id": 3, "name": "device3", "custom_fields": {}}],
+            },
+        )
+        asn_manager.add_pool_specification(
+            name="range2", spec={"scope": [{"site": "test"}], "range": [65001, 65100]}
+        )
+
+        self.assertEqual(
+            asn_manager.resolve("ASN", "range2", identifier="device3"), 65001
+        )
+        self.assertEqual(asn_manager.flush(), {"written": 1, "conflicts": 0})
+        self.assertEqual(
+            m.last_request.json(), [{"id": 3, "custom_fields": {"ASN": 65001}}]
+        )
+
+    @requests_mock.mock()
+    def test_net_manager(self, m):
+
+        test03_1 = load_fixture("test03_1_ipam_prefixes")
+        test03_2 = load_fixture("test03_2_ipam_prefixes")
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_1["params"],
+            json=test03_1["response"],
+        )
+        m.get(
+            "http://mock/api/ipam/prefixes/?%s" % test03_2["params"],
+            json=test03_2["response"],
+        )
+        m.post(
+            "http://mock/api/ipam/prefixes/",
+            [
+                {"status_code": 400, "json": [{}, {"prefix": ["Duplicate"]}]},
+                {"json": bulk_create},
+            ],
+        )
+
+        net_manager = NetboxNetManager(
+            config={"netbox": {"address": "http://mock", "write_back": True}}
+        )
+
+        self.assertEqual(
+            str(net_manager.resolve("NET4", "loopback/26", identifier="new1")),
+            "10.10.0.64/26",
+        )
+
+        ## The pools share the write queue and the client of the manager
+        pool = net_manager.net_pools["loopback/26"]
+        self.assertIs(pool.write_queue, net_manager.write_queue)
+        self.assertIs(net_manager.write_queue.nb, net_manager.client)
+        self.assertEqual(
+            str(net_manager.resolve("NET4", "loopback/26", identifier="new2")),
+            "10.10.0.192/26",
+        )
+        self.assertEqual(
+            str(net_manager.resolve("NET4", "loopback/26", identifier="first")),
+            "10.10.0.0/26",
+        )
+
+        self.assertEqual(net_manager.flush(), {"written": 1, "conflicts": 1})
+        self.assertEqual(
+            m.last_request.json(),
+            [
+                {
+                    "prefix": "10.10.0.64/26",
+                    "status": "active",
+                    "role": {"slug": "loopback"},
+                    "description": "new1",
+                }
+            ],
+        )
+        self.assertEqual(pool.prefixes_by_netbox_id[1], ("10.10.0.64/26", "new1"))
+
+        ## The prefix rejected has been released
+        self.assertEqual(
+            str(net_manager.resolve("NET4", "loopback/26", identifier="new3")),
+            "10.10.0.192/26",
+        )
+
+
+def load_fixture(name):
+
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)
@@ -0,0 +1,72 @@
+import unittest
+
+from resource_manager.pools.bitmap import Bitmap
+
+
+class Test_Bitmap(unittest.TestCase):
+    def test_set_clear(self):
+
+        bitmap = Bitmap(100)
+
+        self.assertTrue(bitmap.set(70))
+        self.assertFalse(bitmap.set(70))
+        self.assertTrue(bitmap.test(70))
+        self.assertEqual(bitmap.nbr_set, 1)
+
+        self.assertTrue(bitmap.clear(70))
+        self.assertFalse(bitmap.clear(70))
+        self.assertFalse(bitmap.test(70))
+
+    def test_set_many(self):
+
+        bitmap = Bitmap(200)
+        bitmap.set(3)
+
+        self.assertEqual(bitmap.set_many([1, 2, 3, 64, 199, 2]), 4)
+        self.assertEqual(bitmap.nbr_set, 5)
+        self.assertTrue(bitmap.test(199))
+        self.assertEqual(bitmap.find_first_zero(), 0)
+
+    def test_find_first_zero(self):
+
+        bitmap = Bitmap(130)
+
+        for i in range(0, 129):
+            bitmap.set(i)
+
+        self.assertEqual(bitmap.find_first_zero(), 129)
+        self.assertEqual(bitmap.hint, 2)
+
+        bitmap.clear(5)
+        self.assertEqual(bitmap.find_first_zero(), 5)
+        self.assertEqual(bitmap.find_first_zero(start=6), 129)
+        self.assertIsNone(bitmap.find_first_zero(start=6, end=129))
+
+    def test_hint_with_start(self):
+
+        bitmap = Bitmap(300)
+
+        for i in range(1, 200):
+            bitmap.set(i)
+
+        ## The bit 0 is never searched, the hint moves past the first word
+        self.assertEqual(bitmap.find_first_zero(start=1), 200)
+        self.assertEqual(bitmap.hint, 3)
+
+        bitmap.set(200)
+        self.assertEqual(bitmap.find_first_zero(start=1), 201)
+        self.assertEqual(bitmap.find_first_zero(start=250), 250)
+        self.assertEqual(bitmap.hint, 3)
+
+        ## A search from a lower start moves the hint back
+        self.assertEqual(bitmap.find_first_zero(), 0)
+        self.assertEqual(bitmap.hint, 0)
+
+    def test_full(self):
+
+        bitmap = Bitmap(64)
+
+        for i in range(0, 64):
+            bitmap.set(i)
+
+        self.assertIsNone(bitmap.find_first_zero())
@@ -0,0 +1,58 @@
+import unittest
+
+from resource_manager.pools.buddy import BuddyAllocator
+
+
+class Test_BuddyAllocator(unittest.TestCase):
+    def test_allocate_lowest(self):
+
+        buddy = BuddyAllocator(min_prefixlen=25, max_prefixlen=32)
+        buddy.add(0, 25)
+        buddy.add(128, 25)
+
+        self.assertEqual(buddy.allocate(27), 0)
+        self.assertEqual(buddy.allocate(27), 32)
+        self.assertEqual(buddy.allocate(26), 64)
+        self.assertEqual(buddy.allocate(25), 128)
+        self.assertIsNone(buddy.allocate(25))
+        self.assertIsNone(buddy.allocate(32))
+
+    def test_split(self):
+
+        buddy = BuddyAllocator(min_prefixlen=25, max_prefixlen=32)
+        buddy.add(128, 25)
+
+        buddy.split(128, 25, 192, 27)
+
+        self.assertEqual(buddy.free[25], set())
+        self.assertEqual(buddy.free[26], {128})
+        self.assertEqual(buddy.free[27], {192, 224})
+
+    def test_find_free_supernet(self):
+
+        buddy = BuddyAllocator(min_prefixlen=25, max_prefixlen=32)
+        buddy.add(128, 25)
+
+        self.assertEqual(buddy.find_free_supernet(200, 30), (128, 25))
+        self.assertIsNone(buddy.find_free_supernet(8, 30))
+
+    def test_heap_cleanup(self):
+
+        buddy = BuddyAllocator(min_prefixlen=24, max_prefixlen=32)
+        for address in range(0, 256, 4):
+            buddy.add(address, 30)
+
+        ## Removing and adding back the same blocks must not grow the heap
+        for _ in range(10):
+            for address in range(0, 256, 8):
+                buddy.remove(address, 30)
+            for address in range(0, 256, 8):
+                buddy.add(address, 30)
+
+        self.assertEqual(len(buddy.heaps[30]), 64)
+
+        for address in range(0, 252, 4):
+            buddy.remove(address, 30)
+
+        self.assertEqual(buddy.heaps[30], [252])
+        self.assertEqual(buddy.lowest(30), 252)
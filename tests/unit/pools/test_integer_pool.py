@@ -44,6 +44,76 @@ class Test_Validate_Integer_Range(unittest.TestCase):
         self.assertEqual(ipool.get(identifier="first"), 102)
         self.assertEqual(ipool.get(), 99)
 
+    def test_reserve_out_of_range(self):
+
+        ipool = IntegerPool("test", start=99, end=110)
+
+        self.assertEqual(ipool.reserve(integer=98), False)
+        self.assertEqual(ipool.reserve(integer=111), False)
+
+        ## The end of the range is not part of the pool
+        self.assertEqual(ipool.reserve(integer=110), False)
+        self.assertEqual(ipool.nbr_available, 11)
+
+    def test_pool_full(self):
+
+        ipool = IntegerPool("test", start=1, end=3)
+
+        self.assertEqual(ipool.get(), 1)
+        self.assertEqual(ipool.get(), 2)
+        self.assertIsNone(ipool.get())
+        self.assertEqual(ipool.nbr_available, 0)
+
+    def test_large_range(self):
+
+        ipool = IntegerPool("test", start=4200000000, end=4294967294)
+
+        self.assertEqual(ipool.reserve(integer=4200000000), True)
+        self.assertEqual(ipool.reserve(integer=4200000002, identifier="dev2"), True)
+
+        self.assertEqual(ipool.get(identifier="dev1"), 4200000001)
+        self.assertEqual(ipool.get(), 4200000003)
+        self.assertEqual(ipool.get(identifier="dev2"), 4200000002)
+        self.assertEqual(len(ipool.free), 1)
+
+    def test_get_many(self):
+
+        ipool = IntegerPool("test", start=1, end=5)
+        ipool.reserve(integer=2, identifier="second")
+
+        self.assertEqual(
+            ipool.get_many(["first", "second", "third", "first", "fourth", "fifth"]),
+            {"first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": None},
+        )
+
+    def test_reserve_many(self):
+
+        ipool = IntegerPool("test", start=1, end=10)
+
+        self.assertEqual(
+            ipool.reserve_many([(2, "first"), (3, None), (2, "other"), (20, None)]),
+            [True, True, False, False],
+        )
+        self.assertEqual(ipool.get(identifier="first"), 2)
+        self.assertEqual(ipool.get(), 1)
+
+    def test_release(self):
+
+        ipool = IntegerPool("test", start=1, end=10)
+        ipool.reserve(integer=1, identifier="first")
+        ipool.reserve(integer=2)
+        ipool.reserve(integer=3, identifier="third")
+
+        self.assertTrue(ipool.release(integer=2))
+        self.assertFalse(ipool.release(integer=2))
+        self.assertTrue(ipool.release(identifier="first"))
+        self.assertFalse(ipool.release(identifier="first"))
+
+        self.assertEqual(ipool.nbr_available, 8)
+        self.assertEqual(ipool.get(identifier="new"), 1)
+        self.assertEqual(ipool.get(), 2)
+        self.assertEqual(ipool.get(identifier="third"), 3)
+
 
 def main():
     unittest.main()
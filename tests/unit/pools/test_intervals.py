@@ -0,0 +1,72 @@
+import unittest
+
+from resource_manager.pools.intervals import IntervalSet
+
+
+class Test_IntervalSet(unittest.TestCase):
+    def test_init(self):
+
+        iset = IntervalSet(10, 20)
+
+        self.assertEqual(len(iset), 1)
+        self.assertEqual(iset.size(), 10)
+        self.assertEqual(iset.first(), 10)
+        self.assertIn(19, iset)
+        self.assertNotIn(20, iset)
+
+    def test_remove_split(self):
+
+        iset = IntervalSet(0, 10)
+
+        self.assertTrue(iset.remove(5))
+        self.assertFalse(iset.remove(5))
+        self.assertEqual(list(iset), [(0, 5), (6, 10)])
+        self.assertNotIn(5, iset)
+        self.assertEqual(iset.size(), 9)
+
+    def test_add_merge(self):
+
+        iset = IntervalSet()
+        iset.add(0, 2)
+        iset.add(4, 6)
+        iset.add(8, 10)
+
+        self.assertEqual(len(iset), 3)
+
+        iset.add(2, 8)
+        self.assertEqual(list(iset), [(0, 10)])
+
+    def test_remove_range(self):
+
+        iset = IntervalSet(0, 10)
+        iset.add(12, 20)
+
+        self.assertEqual(iset.remove_range(5, 15), 8)
+        self.assertEqual(list(iset), [(0, 5), (15, 20)])
+        self.assertEqual(iset.remove_range(5, 15), 0)
+
+    def test_remove_many(self):
+
+        iset = IntervalSet(0, 10)
+
+        self.assertEqual(iset.remove_many([7, 2, 3, 4, 12, 3]), 4)
+        self.assertEqual(list(iset), [(0, 2), (5, 7), (8, 10)])
+
+    def test_many_fragments(self):
+
+        iset = IntervalSet(0, 10000)
+
+        ## Fragment the set in reverse order to go through many chunks
+        for value in range(9998, -1, -2):
+            self.assertTrue(iset.remove(value))
+
+        self.assertEqual(len(iset), 5000)
+        self.assertEqual(iset.size(), 5000)
+        self.assertEqual(iset.first(), 1)
+        self.assertNotIn(5000, iset)
+        self.assertIn(5001, iset)
+
+        for value in range(0, 10000, 2):
+            iset.add(value, value + 1)
+
+        self.assertEqual(list(iset), [(0, 10000)])
@@ -119,6 +119,31 @@ class Test_Validate_Get_Subnet(unittest.TestCase):
         self.assertEqual(str(sub.get(size=24)), "192.0.3.0/24")
         self.assertEqual(sub.get(size=24), False)
 
+    def test_v4_many_small(self):
+        sub = PrefixesPool("10.0.0.0/16")
+
+        for i in range(0, 1000):
+            sub.get(size=31)
+
+        self.assertEqual(str(sub.get(size=31, identifier="last")), "10.0.7.208/31")
+        self.assertEqual(str(sub.get(size=24)), "10.0.8.0/24")
+
+    def test_reserve_then_get_lowest(self):
+        sub = PrefixesPool("10.0.0.0/16")
+
+        self.assertEqual(sub.reserve("10.0.0.0/26"), True)
+        self.assertEqual(sub.reserve("10.0.0.128/26"), True)
+
+        self.assertEqual(str(sub.get(size=26)), "10.0.0.64/26")
+        self.assertEqual(str(sub.get(size=26)), "10.0.0.192/26")
+        self.assertEqual(str(sub.get(size=26)), "10.0.1.0/26")
+
+    def test_reserve_not_available(self):
+        sub = PrefixesPool("10.0.0.0/16")
+
+        self.assertEqual(sub.reserve("10.0.0.0/24"), True)
+        self.assertEqual(sub.reserve("10.0.0.0/26", identifier="nested"), False)
+
     @pytest.mark.long
     def test_v6_no_owner(self):
         sub = PrefixesPool("2620:135:6000:fffe::/64")
@@ -158,6 +183,98 @@ class Test_Validate_Reserve(unittest.TestCase):
         self.assertEqual(str(sub.get(size=24)), "192.192.2.0/24")
 
 
+class Test_Validate_Release(unittest.TestCase):
+    def test_release_by_subnet(self):
+        sub = PrefixesPool("192.168.0.0/16")
+
+        self.assertEqual(str(sub.get(size=24)), "192.168.0.0/24")
+        self.assertEqual(sub.release("192.168.0.0/24"), True)
+        self.assertEqual(sub.release("192.168.0.0/24"), False)
+
+        self.assertEqual(sub.get_nbr_available_subnets()[17], 2)
+        self.assertEqual(str(sub.get(size=17)), "192.168.0.0/17")
+
+    def test_release_by_identifier(self):
+        sub = PrefixesPool("192.168.0.0/16")
+
+        self.assertEqual(str(sub.get(size=24, identifier="first")), "192.168.0.0/24")
+        self.assertEqual(sub.release(identifier="first"), True)
+        self.assertFalse(sub.check_if_already_allocated(identifier="first"))
+        self.assertEqual(sub.release(identifier="first"), False)
+
+    def test_release_merge(self):
+        sub = PrefixesPool("192.168.0.0/24")
+
+        for i in range(0, 4):
+            sub.get(size=30)
+
+        sub.release("192.168.0.4/30")
+        self.assertEqual(sub.available_subnets[30], ["192.168.0.4/30"])
+
+        sub.release("192.168.0.0/30")
+        self.assertEqual(sub.available_subnets[29], ["192.168.0.0/29"])
+        self.assertEqual(sub.available_subnets[30], [])
+
+        self.assertEqual(str(sub.get(size=29)), "192.168.0.0/29")
+
+    def test_churn(self):
+        sub = PrefixesPool("10.0.0.0/22")
+
+        for i in range(0, 50):
+            nets = [sub.get(size=30) for j in range(0, 256)]
+            self.assertEqual(sub.get(size=30), False)
+
+            for net in nets:
+                sub.release(net)
+
+        self.assertEqual(sub.get_nbr_available_subnets()[23], 2)
+
+
+class Test_Validate_From_Reservations(unittest.TestCase):
+    def test_empty(self):
+        sub = PrefixesPool.from_reservations("192.168.0.0/28", [])
+
+        self.assertEqual(
+            sub.available_subnets[29], ["192.168.0.0/29", "192.168.0.8/29"]
+        )
+
+    def test_same_as_reserve(self):
+        reservations = [
+            ("192.168.1.0/24", "second"),
+            ("192.168.0.0/24", "first"),
+            ("192.168.0.0/26", None),
+            ("192.168.0.0/24", "first"),
+            ("192.168.200.0/30", None),
+        ]
+
+        sub = PrefixesPool.from_reservations("192.168.0.0/16", reservations)
+        ref = PrefixesPool("192.168.0.0/16")
+        for subnet, identifier in reservations:
+            ref.reserve(subnet, identifier=identifier)
+
+        self.assertEqual(sub.available_subnets, ref.available_subnets)
+        self.assertEqual(
+            sub.sub_by_id, {"first": "192.168.0.0/24", "second": "192.168.1.0/24"}
+        )
+        self.assertEqual(sub.get(size=24), ref.get(size=24))
+        self.assertEqual(sub.get(size=23), ref.get(size=23))
+        self.assertEqual(str(sub.get(size=24, identifier="first")), "192.168.0.0/24")
+
+    def test_skip_invalid(self):
+        reservations = [
+            ("10.0.0.0/24", None),
+            ("192.168.0.0/16", None),
+            ("192.168.0.0/24", "first"),
+            ("192.168.1.0/24", "first"),
+            ("2001:db8::/64", None),
+        ]
+
+        sub = PrefixesPool.from_reservations("192.168.0.0/16", reservations)
+
+        self.assertEqual(list(sub.sub_by_key.keys()), ["192.168.0.0/24"])
+        self.assertEqual(str(sub.get(size=24)), "192.168.1.0/24")
+
+
 # # Test negative cases:
 #   - IP out of range,
 #   - IP already reserved
@@ -2,9 +2,11 @@ import unittest
 import yaml
 import sys
 import logging
+import pytest
+import ipaddress
 from os import path
 
-from resource_manager.pools.ipaddr_subnet import IpAddressPool
+from resource_manager.pools.ipaddr_subnet import IpAddressPool, parse_addresses
 
 
 class Test_Validate_Get(unittest.TestCase):
@@ -88,6 +90,211 @@ class Test_Validate_Reserve(unittest.TestCase):
         self.assertEqual(sub.reserve("10.0.0.1", identifier="first"), True)
         self.assertEqual(str(sub.get(identifier="first")), "10.0.0.1")
 
+    def test_out_of_subnet(self):
+        sub = IpAddressPool("10.0.0.0/30")
+
+        self.assertEqual(sub.reserve("10.0.1.1"), False)
+
+
+class Test_Validate_Many(unittest.TestCase):
+    def test_get_many(self):
+        for storage in ["dict", "bitmap", "sparse"]:
+            sub = IpAddressPool("10.0.0.0/29", storage=storage)
+            sub.reserve("10.0.0.2", identifier="second")
+
+            result = sub.get_many(["first", "second", "third", "first"])
+
+            self.assertEqual(
+                {k: str(v) for k, v in result.items()},
+                {"first": "10.0.0.1", "second": "10.0.0.2", "third": "10.0.0.3"},
+            )
+
+    def test_get_many_full(self):
+        sub = IpAddressPool("10.0.0.0/30")
+
+        result = sub.get_many(["first", "second", "third"])
+        self.assertIsNone(result["third"])
+
+    def test_reserve_many(self):
+        sub = IpAddressPool("10.0.0.0/29")
+
+        self.assertEqual(
+            sub.reserve_many([("10.0.0.1/29", "first"), ("10.0.0.2", None)]),
+            [True, True],
+        )
+        self.assertEqual(str(sub.get(identifier="first")), "10.0.0.1")
+        self.assertEqual(str(sub.get()), "10.0.0.3")
+
+    def test_reserve_many_keep_identifier(self):
+        for storage in ["dict", "bitmap", "sparse"]:
+            sub = IpAddressPool("10.0.0.0/29", storage=storage)
+
+            self.assertEqual(
+                sub.reserve_many(
+                    [("10.0.0.1", "first"), ("10.0.0.1", None), ("10.0.0.2", None)]
+                ),
+                [True, True, True],
+            )
+            self.assertEqual(sub.reserve_many([("10.0.0.2", None)]), [True])
+            self.assertEqual(str(sub.get(identifier="first")), "10.0.0.1")
+            self.assertEqual(sub._get_owner(1), "first")
+            self.assertEqual(str(sub.get()), "10.0.0.3")
+
+            self.assertTrue(sub.release(identifier="first"))
+            self.assertEqual(str(sub.get()), "10.0.0.1")
+
+    def test_reserve_many_sparse(self):
+        sub = IpAddressPool("2001:db8::/64")
+
+        items = [("2001:db8::%x" % i, None) for i in range(1, 1001)]
+        items.append(("2001:db8::ffff", None))
+
+        self.assertEqual(sub.reserve_many(items), [True] * 1001)
+        self.assertEqual(list(sub.free), [(1001, 65535), (65536, 2**64 - 1)])
+        self.assertEqual(str(sub.get()), "2001:db8::3e9")
+
+    def test_reserve_many_batch(self):
+        sub = IpAddressPool("10.0.0.0/16")
+
+        items = [("10.0.%s.%s/16" % (i // 256, i % 256), None) for i in range(1, 1000)]
+        items.append(("10.0.0.10/16", None))
+        items.append(("10.1.0.1/16", None))
+        items.append(("not-an-ip", None))
+
+        result = sub.reserve_many(items)
+
+        self.assertEqual(len(result), len(items))
+        self.assertTrue(result[9])
+        self.assertFalse(result[-2])
+        self.assertFalse(result[-1])
+        self.assertEqual(sub.bitmap.nbr_set, 999)
+        self.assertEqual(str(sub.get()), "10.0.3.232")
+
+
+class Test_Parse_Addresses(unittest.TestCase):
+    def test_v4(self):
+        self.assertEqual(
+            list(parse_addresses(["10.0.0.1/24", "10.0.0.2", "10.0.0.256", None])),
+            [167772161, 167772162, -1, -1],
+        )
+
+    def test_v6(self):
+        self.assertEqual(
+            parse_addresses(["2001:db8::1/64", "10.0.0.1"], version=6),
+            [int(ipaddress.ip_address("2001:db8::1")), -1],
+        )
+
+
+class Test_Validate_Bitmap(unittest.TestCase):
+    def test_storage(self):
+
+        self.assertEqual(IpAddressPool("10.0.0.0/24").storage, "bitmap")
+        self.assertEqual(IpAddressPool("10.0.0.0/24", storage="dict").storage, "dict")
+
+        with pytest.raises(Exception):
+            IpAddressPool("10.0.0.0/24", storage="unknown")
+
+    def test_large_subnet(self):
+        sub = IpAddressPool("10.0.0.0/12")
+
+        self.assertEqual(sub.reserve("10.0.0.1"), True)
+        self.assertEqual(sub.reserve("10.0.0.2", identifier="second"), True)
+
+        self.assertEqual(str(sub.get(identifier="third")), "10.0.0.3")
+        self.assertEqual(str(sub.get(identifier="second")), "10.0.0.2")
+        self.assertEqual(sub.ips_by_id, {2: "second", 3: "third"})
+
+    def test_skip_full_words(self):
+        sub = IpAddressPool("10.0.0.0/16")
+
+        for i in range(1, 300):
+            sub.get()
+
+        self.assertEqual(str(sub.get(identifier="next")), "10.0.1.44")
+        self.assertEqual(sub.bitmap.hint, 4)
+        self.assertEqual(str(sub.get(id=2, identifier="gateway")), "10.0.0.2")
+        self.assertFalse(sub.get(id=2, identifier="other"))
+
+    def test_no_more_ip(self):
+        sub = IpAddressPool("10.0.0.0/29")
+
+        for i in range(1, 7):
+            self.assertEqual(str(sub.get()), "10.0.0.%s" % i)
+
+        self.assertIsNone(sub.get())
+
+
+class Test_Validate_Sparse(unittest.TestCase):
+    def test_storage(self):
+
+        self.assertEqual(IpAddressPool("2001:db8::/64").storage, "sparse")
+        self.assertEqual(
+            IpAddressPool("10.0.0.0/24", storage="sparse").storage, "sparse"
+        )
+
+    def test_v6_large_subnet(self):
+        sub = IpAddressPool("2001:db8::/48")
+
+        self.assertEqual(sub.reserve("2001:db8::1", identifier="first"), True)
+        self.assertEqual(sub.reserve("2001:db8::ffff:0:0:1"), True)
+
+        self.assertEqual(str(sub.get(identifier="second")), "2001:db8::2")
+        self.assertEqual(str(sub.get(identifier="first")), "2001:db8::1")
+        self.assertEqual(str(sub.get(id=2**64 + 1)), "2001:db8:0:1::1")
+        self.assertEqual(len(sub.free), 3)
+
+    def test_v6_with_id(self):
+        sub = IpAddressPool("2001:db8::/64")
+
+        self.assertEqual(str(sub.get(id=10, identifier="gateway")), "2001:db8::a")
+        self.assertFalse(sub.get(id=10))
+        self.assertEqual(str(sub.get()), "2001:db8::1")
+
+    def test_no_more_ip(self):
+        sub = IpAddressPool("10.0.0.0/30", storage="sparse")
+
+        self.assertEqual(str(sub.get()), "10.0.0.1")
+        self.assertEqual(str(sub.get()), "10.0.0.2")
+        self.assertIsNone(sub.get())
+
+
+class Test_Release(unittest.TestCase):
+    def test_release(self):
+        for storage in ["dict", "bitmap", "sparse"]:
+            sub = IpAddressPool("10.0.0.0/29", storage=storage)
+            sub.reserve("10.0.0.1/29", identifier="first")
+            sub.reserve("10.0.0.2/29")
+            sub.reserve("10.0.0.3/29", identifier="third")
+
+            self.assertTrue(sub.release(ip_address="10.0.0.2/29"))
+            self.assertFalse(sub.release(ip_address="10.0.0.2"))
+            self.assertTrue(sub.release(identifier="first"))
+            self.assertFalse(sub.release(identifier="first"))
+            self.assertFalse(sub.release(ip_address="10.1.0.1"))
+
+            self.assertEqual(str(sub.get(identifier="new")), "10.0.0.1")
+            self.assertEqual(str(sub.get()), "10.0.0.2")
+            self.assertEqual(str(sub.get(identifier="third")), "10.0.0.3")
+            self.assertFalse(sub.get(identifier="first", only_if_exist=True))
+
+    def test_release_edges(self):
+        for storage in ["dict", "bitmap", "sparse"]:
+            sub = IpAddressPool("10.0.0.0/29", storage=storage)
+
+            ## The network and broadcast addresses are not reserved by default
+            self.assertFalse(sub.release(ip_address="10.0.0.0"))
+            self.assertFalse(sub.release(ip_address="10.0.0.7"))
+
+            self.assertTrue(sub.reserve("10.0.0.0/29"))
+            self.assertEqual(sub.reserve_many([("10.0.0.7", None)]), [True])
+
+            self.assertTrue(sub.release(ip_address="10.0.0.0"), storage)
+            self.assertTrue(sub.release(ip_address="10.0.0.7"), storage)
+            self.assertFalse(sub.release(ip_address="10.0.0.0"))
+            self.assertFalse(sub.release(ip_address="10.0.0.7"))
+
+            self.assertEqual(str(sub.get()), "10.0.0.1")
+
 
 class Test_Validate_Outofrange(unittest.TestCase):
     def test_no_more_ip(self):
@@ -80,3 +80,41 @@ class Test_Validate_ListPool(unittest.TestCase):
         self.assertEqual(pool.get(identifier="first"), "t2")
         self.assertEqual(pool.get(), "t5")
         self.assertEqual(pool.get(), "t1")
+
+    def test_get_many(self):
+
+        pool = ListPool("test", items_list=["t[5,2,1,6]"])
+        pool.reserve(item="t2", identifier="second")
+
+        self.assertEqual(
+            pool.get_many(["first", "second", "third", "first", "fourth", "fifth"]),
+            {
+                "first": "t5",
+                "second": "t2",
+                "third": "t1",
+                "fourth": "t6",
+                "fifth": None,
+            },
+        )
+        self.assertEqual(pool.get_nbr_available(), 0)
+
+    def test_get_many_anonymous(self):
+
+        pool = ListPool("test", items_list=["t[1-4]"])
+
+        self.assertEqual(
+            pool.get_many(["a", None, "b"]), {"a": "t1", None: "t2", "b": "t3"}
+        )
+        self.assertNotIn(None, pool.item_by_identifier)
+        self.assertEqual(pool.item_by_value["t2"], True)
+        self.assertEqual(pool.get_nbr_available(), 1)
+
+    def test_reserve_many(self):
+
+        pool = ListPool("test", items_list=["t[1-3]"])
+
+        self.assertEqual(
+            pool.reserve_many([("t2", "first"), ("t3", None), ("t9", None)]),
+            [True, True, False],
+        )
+        self.assertEqual(pool.get(), "t1")
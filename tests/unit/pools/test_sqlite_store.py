@@ -0,0 +1,169 @@
+import unittest
+import shutil
+import tempfile
+import pytest
+from os import path
+
+from resource_manager.pools.sqlite_store import (
+    SqliteStore,
+    SqliteIntegerPool,
+    SqliteListPool,
+    SqliteIpAddressPool,
+    SqlitePrefixesPool,
+)
+
+
+class Test_SqliteStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = path.join(self.dir, "pools.db")
+        self.store = SqliteStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_wal(self):
+
+        self.assertEqual(self.store.execute("PRAGMA journal_mode")[0][0], "wal")
+
+    def test_integer_pool(self):
+
+        pool = SqliteIntegerPool(self.store, "asn", 65000, 65100)
+
+        self.assertEqual(pool.get(identifier="device1"), 65000)
+        self.assertTrue(pool.reserve(65001, identifier="device2"))
+        self.assertFalse(pool.reserve(65001, identifier="device3"))
+        self.assertEqual(pool.get(identifier="device3"), 65002)
+        self.assertEqual(pool.get(identifier="device1"), 65000)
+        self.assertEqual(pool.lookup("device2"), 65001)
+        self.assertIsNone(pool.lookup("device4"))
+
+        ## A new store on the same file finds the same allocations
+        store = SqliteStore(self.path)
+        pool = SqliteIntegerPool(store, "asn", 65000, 65100)
+
+        self.assertEqual(pool.get(identifier="device2"), 65001)
+        self.assertEqual(pool.get(identifier="device4"), 65003)
+
+        self.assertTrue(pool.release(identifier="device1"))
+        self.assertFalse(pool.release(identifier="device1"))
+        self.assertEqual(pool.get(identifier="device5"), 65000)
+        store.close()
+
+    def test_reserve_identifier(self):
+
+        pool = SqliteIntegerPool(self.store, "int", 1, 100)
+
+        self.assertEqual(pool.get(identifier="x"), 1)
+        self.assertFalse(pool.reserve(5, identifier="x"))
+        self.assertTrue(pool.reserve(1, identifier="x"))
+        self.assertEqual(pool.lookup("x"), 1)
+        self.assertEqual(pool.pool.int_by_id, {"x": 1})
+
+        ## The database and the native pool are still in sync
+        store = SqliteStore(self.path)
+        other = SqliteIntegerPool(store, "int", 1, 100)
+
+        self.assertTrue(other.reserve(5, identifier="y"))
+        self.assertEqual(other.get(identifier="x"), 1)
+        self.assertEqual(pool.get(identifier="z"), 2)
+        self.assertTrue(pool.release(identifier="x"))
+        self.assertFalse(other.release(identifier="x"))
+        self.assertEqual(other.get(identifier="w"), 1)
+        store.close()
+
+    def test_shared(self):
+
+        other_store = SqliteStore(self.path)
+
+        pool1 = SqliteIntegerPool(self.store, "asn", 1, 100)
+        pool2 = SqliteIntegerPool(other_store, "asn", 1, 100)
+
+        self.assertEqual(pool1.get(identifier="device1"), 1)
+        self.assertEqual(pool2.get(identifier="device2"), 2)
+        self.assertEqual(pool1.get(identifier="device3"), 3)
+        self.assertEqual(pool2.get(identifier="device1"), 1)
+
+        other_store.close()
+
+    def test_definition(self):
+
+        SqliteIntegerPool(self.store, "asn", 1, 100).get()
+
+        with pytest.raises(Exception):
+            SqliteIntegerPool(self.store, "asn", 1, 200).get()
+
+    def test_list_pool(self):
+
+        pool = SqliteListPool(self.store, "ints", ["et-0/0/[0-3]"])
+
+        self.assertEqual(pool.get(identifier="peer1"), "et-0/0/0")
+        self.assertTrue(pool.reserve("et-0/0/1"))
+        self.assertEqual(pool.get(identifier="peer2"), "et-0/0/2")
+
+        pool = SqliteListPool(SqliteStore(self.path), "ints", ["et-0/0/[0-3]"])
+        self.assertEqual(pool.get(identifier="peer2"), "et-0/0/2")
+        self.assertEqual(pool.get(), "et-0/0/3")
+        self.assertIsNone(pool.get())
+
+        self.assertTrue(pool.release(identifier="peer1"))
+        self.assertEqual(pool.get(identifier="peer3"), "et-0/0/0")
+
+    def test_ip_pool(self):
+
+        pool = SqliteIpAddressPool(self.store, "10.0.0.0/24")
+
+        self.assertEqual(str(pool.get(identifier="lb1")), "10.0.0.1")
+        self.assertTrue(pool.reserve("10.0.0.2/24", identifier="lb2"))
+        self.assertEqual(str(pool.get(identifier="lb3")), "10.0.0.3")
+        self.assertEqual(str(pool.get(id=10)), "10.0.0.10")
+
+        pool = SqliteIpAddressPool(SqliteStore(self.path), "10.0.0.0/24")
+        self.assertEqual(str(pool.get(identifier="lb2")), "10.0.0.2")
+        self.assertEqual(str(pool.get(identifier="lb4")), "10.0.0.4")
+        self.assertTrue(pool.release(ip_address="10.0.0.1"))
+        self.assertEqual(str(pool.get(identifier="lb5")), "10.0.0.1")
+
+    def test_ip_pool_reserve_allocated(self):
+
+        pool = SqliteIpAddressPool(self.store, "10.0.0.0/24")
+
+        self.assertEqual(str(pool.get(identifier="a")), "10.0.0.1")
+        self.assertFalse(pool.reserve("10.0.0.1/24"))
+        self.assertFalse(pool.reserve("10.0.0.1", identifier="b"))
+        self.assertTrue(pool.reserve("10.0.0.1/24", identifier="a"))
+
+        self.assertTrue(pool.reserve("10.0.0.5"))
+        self.assertTrue(pool.reserve("10.0.0.5"))
+        self.assertFalse(pool.reserve("10.0.0.5", identifier="c"))
+
+        self.assertEqual(str(pool.get(identifier="a")), "10.0.0.1")
+        self.assertIsNone(pool.lookup("b"))
+        self.assertEqual(
+            self.store.execute(
+                "SELECT COUNT(*) FROM allocations WHERE pool = ?", (pool.name,)
+            ),
+            [(2,)],
+        )
+
+    def test_prefixes_pool(self):
+
+        pool = SqlitePrefixesPool(self.store, "10.0.0.0/16")
+
+        self.assertEqual(str(pool.get(24, identifier="site1")), "10.0.0.0/24")
+        self.assertTrue(pool.reserve("10.0.1.0/24", identifier="site2"))
+        self.assertEqual(str(pool.get(24, identifier="site3")), "10.0.2.0/24")
+
+        pool = SqlitePrefixesPool(SqliteStore(self.path), "10.0.0.0/16")
+        self.assertEqual(str(pool.get(24, identifier="site2")), "10.0.1.0/24")
+        self.assertFalse(pool.get(25, identifier="site2"))
+        self.assertEqual(str(pool.get(24, identifier="site4")), "10.0.3.0/24")
+        self.assertTrue(pool.release(identifier="site1"))
+        self.assertEqual(str(pool.get(24, identifier="site5")), "10.0.0.0/24")
+
+        ## The prefix is already allocated
+        self.assertFalse(pool.reserve("10.0.1.0/24", identifier="site6"))
+        self.assertFalse(pool.reserve("10.0.1.0/24"))
+        self.assertTrue(pool.reserve("10.0.1.0/24", identifier="site2"))
+        self.assertEqual(str(pool.get(24, identifier="site2")), "10.0.1.0/24")
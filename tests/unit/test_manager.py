@@ -0,0 +1,111 @@
+import unittest
+import requests_mock
+import yaml
+import pytest
+from os import path
+
+from resource_manager.manager import ResourceManager
+
+here = path.abspath(path.dirname(__file__))
+
+FIXTURE_DIR = "backend/fixtures/"
+
+VALID_CONFIG_1 = {"netbox": {"address": "http://mock"}}
+
+
+class CountingManager(object):
+    """
+    Manager returning a new integer for each call to resolve
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def supported_types(self):
+        return ["COUNTER"]
+
+    def resolve(self, var_type, var_params, identifier=None):
+        self.calls.append((var_params, identifier))
+        return len(self.calls)
+
+
+class Test_ResourceManager(unittest.TestCase):
+    def test_register(self):
+
+        manager = CountingManager()
+        rm = ResourceManager(managers=[manager])
+
+        self.assertEqual(rm.supported_types(), ["COUNTER"])
+        self.assertIs(rm.get_manager("counter"), manager)
+        self.assertEqual(rm.resolve("counter", "test", "id1"), 1)
+        self.assertFalse(rm.resolve("unknown", "test", "id1"))
+
+        with pytest.raises(Exception):
+            rm.register(CountingManager())
+
+    def test_resolve_many_dedup(self):
+
+        manager = CountingManager()
+        rm = ResourceManager(managers=[manager])
+
+        results = rm.resolve_many(
+            [
+                ("COUNTER", "pool1", "id1"),
+                ("COUNTER", "pool1", "id2"),
+                ("COUNTER", "pool1", "id1"),
+                ("COUNTER", "pool1", None),
+                ("COUNTER", "pool1"),
+                ("UNKNOWN", "pool1", "id1"),
+            ],
+            workers=1,
+        )
+
+        self.assertEqual(results, [1, 2, 1, 3, 4, False])
+        self.assertEqual(len(manager.calls), 4)
+        self.assertEqual(rm.resolve_many([]), [])
+
+    @requests_mock.mock()
+    def test_resolve_many_netbox(self, m):
+
+        test02_1 = load_fixture("test02_1_dcim_devices")
+        test03_1 = load_fixture("test03_1_ipam_prefixes")
+        test03_2 = load_fixture("test03_2_ipam_prefixes")
+
+        m.get(
+            "http://mock/api/dcim/devices/?%s" % test02_1["params"],
+            json=test02_1["response"],
+        )
+        for test in [test03_1, test03_2]:
+            m.get(
+                "http://mock/api/ipam/prefixes/?%s" % test["params"],
+                json=test["response"],
+            )
+
+        rm = ResourceManager.from_config(VALID_CONFIG_1)
+        rm.get_manager("ASN").add_pool_specification(
+            name="range1", spec={"scope": [{"site": "test"}], "range": [65001, 65100]}
+        )
+
+        self.assertEqual(rm.supported_types(), ["ASN", "NET4", "NET6"])
+
+        results = rm.resolve_many(
+            [
+                ("ASN", "range1", "device1"),
+                ("NET4", "loopback/26", "first"),
+                ("ASN", "range1", "device10"),
+                ("net4", "loopback/26", "fourth"),
+                ("ASN", "range1", "device1"),
+                ("ASN", "unknown", "device1"),
+            ]
+        )
+
+        self.assertEqual(
+            [str(result) for result in results],
+            ["65001", "10.10.0.0/26", "65010", "10.10.0.64/26", "65001", "False"],
+        )
+        self.assertEqual(rm.flush(), {"written": 0, "conflicts": 0})
+
+
+def load_fixture(name):
+    with open(here + "/" + FIXTURE_DIR + name + ".json") as f:
+        return yaml.safe_load(f)